@@ -0,0 +1,188 @@
+"""
+Agrégats pré-calculés des commandes finies pour les statistiques postes / magasins.
+
+La table agregats_commandes cumule, par heure, jour et mois de commande, la
+quantité livrée pour chaque (poste, magasin, pièce). Elle est tenue à jour dans
+la transaction qui fait passer une commande à "Commande finie" (et corrigée si
+une commande finie est annulée ou supprimée).
+
+Une statistique sur [debut, fin] lit les mois, puis les jours, puis les heures
+entières dans les agrégats ; seules les fractions d'heure aux deux bornes sont lues en
+direct dans commandes (index sur dateCommande).
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, literal
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import AgregatCommandes, Boite, Commande
+
+STATUT_FINI = "Commande finie"
+
+# Format de stockage des DateTime SQLAlchemy sous SQLite, tronqué à l'heure / au jour
+FORMATS_PERIODE = {
+    "heure": "%Y-%m-%d %H:00:00.000000",
+    "jour": "%Y-%m-%d 00:00:00.000000",
+    "mois": "%Y-%m-01 00:00:00.000000",
+}
+
+
+def _quantite():
+    """Quantité livrée : les boîtes de chaque commande (scans regroupés)."""
+    return func.sum(Commande.quantite)
+
+def _lignes_agregees(db: Session, granularite, *filtres):
+    """Agrégats (granularite, periode, idPoste, idMagasin, idPiece, quantite) des commandes finies filtrées."""
+    periode = func.strftime(FORMATS_PERIODE[granularite], Commande.dateCommande)
+    id_poste = func.coalesce(Commande.idPoste, 0)
+    id_magasin = func.coalesce(Commande.idMagasin, 0)
+    return db.query(
+        literal(granularite), periode, id_poste, id_magasin, Boite.idPiece, _quantite(),
+    ).join(Boite, Boite.idBoite == Commande.idBoite).filter(
+        Commande.statutCommande == STATUT_FINI,
+        Boite.idPiece.isnot(None),
+        *filtres,
+    ).group_by(periode, id_poste, id_magasin, Boite.idPiece).all()
+
+def _cumuler(db: Session, lignes, signe=1):
+    """Ajoute (ou retire, signe=-1) des lignes d'agrégats, par UPSERT."""
+    if not lignes:
+        return
+    valeurs = [
+        {
+            "granularite": g,
+            "periode": datetime.strptime(p, "%Y-%m-%d %H:%M:%S.%f"),
+            "idPoste": poste,
+            "idMagasin": magasin,
+            "idPiece": piece,
+            "quantite": signe * q,
+        }
+        for g, p, poste, magasin, piece, q in lignes
+    ]
+    requete = sqlite_insert(AgregatCommandes)
+    db.execute(
+        requete.on_conflict_do_update(
+            index_elements=["granularite", "periode", "idPoste", "idMagasin", "idPiece"],
+            set_={"quantite": AgregatCommandes.quantite + requete.excluded.quantite},
+        ),
+        valeurs,
+    )
+
+def ajouter_commandes(db: Session, *filtres):
+    """À appeler (sans commit) quand des commandes viennent de passer à "Commande finie"."""
+    for granularite in FORMATS_PERIODE:
+        _cumuler(db, _lignes_agregees(db, granularite, *filtres))
+
+def retirer_commandes(db: Session, *filtres):
+    """À appeler (sans commit) avant d'annuler ou de supprimer des commandes potentiellement finies."""
+    for granularite in FORMATS_PERIODE:
+        _cumuler(db, _lignes_agregees(db, granularite, *filtres), signe=-1)
+
+def reconstruire(db: Session):
+    """Recalcule tous les agrégats depuis la table commandes (reprise, génération de données)."""
+    db.query(AgregatCommandes).delete()
+    ajouter_commandes(db)
+
+def reconstruire_si_vide(db: Session):
+    """Au démarrage : construit les agrégats d'une base qui n'en a pas encore. Retourne True si reconstruits."""
+    if db.query(AgregatCommandes.idPiece).first() is not None:
+        return False
+    if db.query(Commande.idCommande).filter(Commande.statutCommande == STATUT_FINI).first() is None:
+        return False
+    reconstruire(db)
+    return True
+
+
+# ---------- LECTURE ----------
+
+def _plancher(d, granularite):
+    """Début de l'heure, du jour ou du mois contenant d."""
+    d = d.replace(minute=0, second=0, microsecond=0)
+    if granularite in ("jour", "mois"):
+        d = d.replace(hour=0)
+    if granularite == "mois":
+        d = d.replace(day=1)
+    return d
+
+def _plafond(d, granularite):
+    """Première borne d'heure, de jour ou de mois >= d."""
+    p = _plancher(d, granularite)
+    if p == d:
+        return p
+    if granularite == "heure":
+        return p + timedelta(hours=1)
+    if granularite == "jour":
+        return p + timedelta(days=1)
+    return (p + timedelta(days=32)).replace(day=1)
+
+# Du plus grossier au plus fin : chaque niveau couvre le cœur de l'intervalle, les plus fins les bords
+NIVEAUX = ("mois", "jour", "heure")
+
+def decouper_periode(debut, fin):
+    """
+    Découpe [debut, fin] (fin incluse) en :
+    - "mois", "jours", "heures" : intervalles [a, b) de périodes entières lues dans les agrégats ;
+    - "direct" : fractions d'heure aux bornes, lues dans commandes ([a, b) puis [a, fin]).
+    """
+    decoupe = {"mois": [], "jours": [], "heures": [], "direct": []}
+    h_debut, h_fin = _plafond(debut, "heure"), _plancher(fin, "heure")
+    if h_debut >= h_fin:
+        decoupe["direct"].append((debut, fin, True))
+        return decoupe
+
+    cles = {"mois": "mois", "jour": "jours", "heure": "heures"}
+
+    def couvrir(a, b, niveaux):
+        if a >= b:
+            return
+        niveau = niveaux[0]
+        a_n, b_n = _plafond(a, niveau), _plancher(b, niveau)
+        if a_n >= b_n:
+            couvrir(a, b, niveaux[1:])
+            return
+        couvrir(a, a_n, niveaux[1:])
+        decoupe[cles[niveau]].append((a_n, b_n))
+        couvrir(b_n, b, niveaux[1:])
+
+    couvrir(h_debut, h_fin, NIVEAUX)
+    if debut < h_debut:
+        decoupe["direct"].append((debut, h_debut, False))
+    decoupe["direct"].append((h_fin, fin, True))
+    return decoupe
+
+def quantites_par_piece(db: Session, debut, fin, axe):
+    """
+    Quantités livrées sur [debut, fin] par (stand, idPiece), axe = "poste" ou "magasin".
+    Combine agrégats mensuels, journaliers, horaires et lecture directe des bornes.
+    """
+    colonne_agregat = AgregatCommandes.idPoste if axe == "poste" else AgregatCommandes.idMagasin
+    colonne_commande = Commande.idPoste if axe == "poste" else Commande.idMagasin
+    decoupe = decouper_periode(debut, fin)
+    totaux = {}
+
+    def cumuler(lignes):
+        for id_stand, id_piece, q in lignes:
+            cle = (id_stand or None, id_piece)
+            totaux[cle] = totaux.get(cle, 0) + q
+
+    for granularite, intervalles in (("mois", decoupe["mois"]), ("jour", decoupe["jours"]), ("heure", decoupe["heures"])):
+        for a, b in intervalles:
+            cumuler(db.query(colonne_agregat, AgregatCommandes.idPiece, func.sum(AgregatCommandes.quantite)).filter(
+                AgregatCommandes.granularite == granularite,
+                AgregatCommandes.periode >= a,
+                AgregatCommandes.periode < b,
+            ).group_by(colonne_agregat, AgregatCommandes.idPiece))
+
+    for a, b, fin_incluse in decoupe["direct"]:
+        borne = Commande.dateCommande <= b if fin_incluse else Commande.dateCommande < b
+        cumuler(db.query(colonne_commande, Boite.idPiece, _quantite()).join(
+            Boite, Boite.idBoite == Commande.idBoite
+        ).filter(
+            Commande.statutCommande == STATUT_FINI,
+            Boite.idPiece.isnot(None),
+            Commande.dateCommande >= a,
+            borne,
+        ).group_by(colonne_commande, Boite.idPiece))
+
+    return {cle: q for cle, q in totaux.items() if q}
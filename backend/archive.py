@@ -0,0 +1,173 @@
+"""
+Archivage des cycles terminés hors de la base principale.
+
+Les cycles clos depuis plus de RETENTION_JOURS jours quittent train.db avec leurs
+commandes terminées et leurs KPI : ils sont déplacés dans un fichier SQLite par mois
+(archives/archive_AAAA_MM.db, mois du début du cycle). La table archives_cycles de la
+base principale garde l'index cycle -> fichier ; le fichier n'est attaché
+(ATTACH DATABASE) que le temps d'un archivage ou d'une lecture, si bien qu'une
+requête sur un ancien cycle_id le retrouve sans que les tables chaudes grossissent.
+
+Restent dans la base principale : les commandes encore ouvertes (le circuit en a
+besoin) et les agrégats de statistiques (agregats.py), qui couvrent tout l'historique.
+"""
+import glob
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Index, MetaData, Table, and_, delete, insert, select
+from sqlalchemy.orm import Session
+
+import database
+import kpi
+from database import BASE_DIR, SessionLocal, ArchiveCycle, Commande, Cycle, KpiCycle
+
+DOSSIER_ARCHIVES = os.environ.get("TRAIN_ARCHIVES", os.path.join(BASE_DIR, "archives"))
+RETENTION_JOURS = 90
+STATUTS_TERMINES = ("Commande finie", "Annulée", "Produit manquant")
+
+# Mêmes colonnes et index, dans le schéma "archive" (le fichier attaché), sans clés
+# étrangères : boîtes et stands référencés restent dans la base principale
+_meta_archive = MetaData()
+
+def _copie(table):
+    copie = Table(
+        table.name, _meta_archive,
+        *[Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable,
+                 server_default=c.server_default.arg if c.server_default is not None else None) for c in table.c],
+        schema="archive",
+    )
+    for index in table.indexes:
+        Index(index.name, *[copie.c[c.name] for c in index.columns])
+    return copie
+
+cycles_archive = _copie(Cycle.__table__)
+commandes_archive = _copie(Commande.__table__)
+kpi_archive = _copie(KpiCycle.__table__)
+
+
+def nom_fichier(date_debut: datetime):
+    return f"archive_{date_debut:%Y_%m}.db"
+
+@contextmanager
+def archive_attachee(fichier):
+    """Connexion à la base principale avec `fichier` attaché sous le nom "archive"."""
+    chemin = os.path.join(DOSSIER_ARCHIVES, fichier)
+    # database.engine et non engine importé : utiliser_base() peut rediriger le moteur
+    with database.engine.connect() as conn:
+        # ATTACH est refusé dans une transaction : la connexion sort du pool sans transaction ouverte
+        conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (chemin,))
+        try:
+            # Fichiers écrits par une version antérieure : colonnes ajoutées depuis (ex. quantite)
+            for table in (cycles_archive, commandes_archive, kpi_archive):
+                database.ajouter_colonnes_manquantes(conn, table)
+            conn.commit()
+            yield conn
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql("DETACH DATABASE archive")
+
+
+# ---------- ARCHIVAGE ----------
+
+def _deplacer(conn, source, cible, condition):
+    """Copie les lignes de `source` vers l'archive puis les supprime de la base principale."""
+    colonnes = [c.name for c in source.c]
+    conn.execute(insert(cible).prefix_with("OR REPLACE").from_select(colonnes, select(source).where(condition)))
+    return conn.execute(delete(source).where(condition)).rowcount
+
+def _archiver_cycle(conn, fichier, cycle):
+    id_cycle, type_cycle, debut, fin = cycle
+    commandes, cycles, kpis = Commande.__table__, Cycle.__table__, KpiCycle.__table__
+    nb = _deplacer(conn, commandes, commandes_archive, and_(
+        commandes.c.typeCommande == type_cycle,
+        commandes.c.dateCommande >= debut,
+        commandes.c.dateCommande <= fin,
+        commandes.c.statutCommande.in_(STATUTS_TERMINES),
+    ))
+    _deplacer(conn, kpis, kpi_archive, kpis.c.idCycle == id_cycle)
+    _deplacer(conn, cycles, cycles_archive, cycles.c.idCycle == id_cycle)
+    conn.execute(insert(ArchiveCycle.__table__).prefix_with("OR REPLACE").values(
+        idCycle=id_cycle, date_debut=debut, date_fin=fin, type_cycle=type_cycle, fichier=fichier, nb_commandes=nb,
+    ))
+    return nb
+
+def archiver(retention_jours=RETENTION_JOURS, maintenant=None):
+    """
+    Déplace les cycles clos avant la limite de rétention vers leur fichier mensuel.
+    Un fichier = une transaction : copie dans l'archive, suppression et index sont
+    validés ensemble. Retourne le bilan {cycles, commandes, fichiers}.
+    """
+    limite = (maintenant or datetime.now()) - timedelta(days=retention_jours)
+    par_fichier = {}
+    db = SessionLocal()
+    try:
+        cycles = db.query(Cycle).filter(Cycle.date_fin != None, Cycle.date_fin < limite).order_by(Cycle.date_debut).all()
+        for cycle in cycles:
+            # KPI figés avant le départ : l'écran d'admin les relira tels quels dans l'archive
+            if db.get(KpiCycle, cycle.idCycle) is None:
+                kpi.calculer_et_stocker(db, cycle)
+            par_fichier.setdefault(nom_fichier(cycle.date_debut), []).append(
+                (cycle.idCycle, cycle.type_cycle, cycle.date_debut, cycle.date_fin)
+            )
+        db.commit()
+    finally:
+        db.close()
+
+    bilan = {"cycles": 0, "commandes": 0, "fichiers": sorted(par_fichier)}
+    if not par_fichier:
+        return bilan
+    os.makedirs(DOSSIER_ARCHIVES, exist_ok=True)
+    for fichier, liste in sorted(par_fichier.items()):
+        with archive_attachee(fichier) as conn:
+            for table in (cycles_archive, commandes_archive, kpi_archive):
+                table.create(conn, checkfirst=True)
+            for cycle in liste:
+                bilan["commandes"] += _archiver_cycle(conn, fichier, cycle)
+                bilan["cycles"] += 1
+            conn.commit()
+        logging.info(f"[ARCHIVE] {len(liste)} cycle(s) déplacé(s) vers {fichier}")
+    return bilan
+
+def supprimer_archives(db: Session):
+    """Vide l'index des archives (remise à zéro de la production), sans commit."""
+    db.query(ArchiveCycle).delete()
+
+def supprimer_fichiers():
+    """Supprime les fichiers d'archive ; à appeler une fois supprimer_archives() validée."""
+    for chemin in glob.glob(os.path.join(DOSSIER_ARCHIVES, "archive_*.db")):
+        try:
+            os.remove(chemin)
+        except OSError as e:
+            logging.warning(f"[ARCHIVE] Fichier non supprimé {chemin} : {e}")
+
+
+# ---------- LECTURE ----------
+
+def trouver_cycle(db: Session, debut_cycle: datetime, mode="Normal"):
+    """Entrée d'index d'un cycle archivé, par sa date de début à la seconde près (cycle_id de l'admin)."""
+    debut_cycle = debut_cycle.replace(tzinfo=None, microsecond=0)
+    return db.query(ArchiveCycle).filter(
+        ArchiveCycle.type_cycle == mode,
+        ArchiveCycle.date_debut >= debut_cycle,
+        ArchiveCycle.date_debut < debut_cycle + timedelta(seconds=1),
+    ).first()
+
+def lire(fichier, requete):
+    """
+    Exécute une requête sur les tables *_archive, fichier attaché. Les tables non
+    qualifiées (boîtes, pièces, stands) restent celles de la base principale.
+    """
+    if not os.path.exists(os.path.join(DOSSIER_ARCHIVES, fichier)):
+        logging.warning(f"[ARCHIVE] Fichier d'archive absent : {fichier}")
+        return []
+    with archive_attachee(fichier) as conn:
+        return conn.execute(requete).all()
+
+def kpi_cycle_archive(entree: ArchiveCycle):
+    """KPI figés d'un cycle archivé (None si absents)."""
+    lignes = lire(entree.fichier, select(kpi_archive.c.resultat).where(kpi_archive.c.idCycle == entree.idCycle))
+    return json.loads(lignes[0][0]) if lignes and lignes[0][0] else None
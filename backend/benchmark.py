@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+benchmark.py - Banc de performance des chemins critiques du backend.
+
+Peuple une base SQLite dédiée (jamais train.db) à plusieurs échelles via
+generation_donnees.generer_base, mesure les routes et fonctions les plus
+sollicitées puis compare les résultats à une référence JSON. Le script sort en erreur (code 1) si une mesure régresse
+au-delà du seuil.
+
+Exemples :
+    python benchmark.py --echelles 1000,10000 --maj-reference
+    python benchmark.py --echelles 1000,10000 --seuil 0.25
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import requetes
+import server
+from update_grid import traiter_fichier_config
+from database import SessionLocal, Boite, Cycle, utiliser_base
+from generation_donnees import generer_base
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_PAR_DEFAUT = os.path.join(BASE_DIR, "benchmark_reference.json")
+BASE_BENCH = os.path.join(tempfile.gettempdir(), "bench_train.db")
+
+# ---------- PRÉPARATION DES DONNÉES ----------
+
+def generer_csv_etagere(codes, nb_lignes=50, nb_colonnes=50):
+    """Construit un CSV de configuration d'étagère avec des blocs fusionnés 2x2."""
+    lignes = ["Magasin benchmark"]
+    for r in range(nb_lignes):
+        cellules = []
+        for c in range(nb_colonnes):
+            bloc = (r // 2) * (nb_colonnes // 2) + (c // 2)
+            cellules.append(codes[bloc % len(codes)] if bloc % 3 else "X")
+        lignes.append(",".join(cellules))
+    return "\n".join(lignes)
+
+
+# ---------- MESURES ----------
+
+def mesurer(fonction, repetitions):
+    """Exécute fonction `repetitions` fois et retourne les durées en millisecondes."""
+    durees = []
+    for _ in range(repetitions):
+        t0 = time.perf_counter()
+        fonction()
+        durees.append((time.perf_counter() - t0) * 1000)
+    return {
+        "min_ms": round(min(durees), 3),
+        "mediane_ms": round(statistics.median(durees), 3),
+        "max_ms": round(max(durees), 3),
+    }
+
+def lancer_echelle(nb_commandes, repetitions):
+    """Peuple la base à l'échelle demandée et mesure chaque chemin critique."""
+    generer_base(nb_pieces=200, nb_stands=7, nb_cycles=30, nb_commandes=nb_commandes)
+
+    db = SessionLocal()
+    try:
+        boites = db.query(Boite).all()
+        codes = [b.code_barre for b in boites]
+        codes_poste_1 = [b.code_barre for b in boites if b.idPoste == 1]
+        ids_boites = [b.idBoite for b in boites]
+        dernier_cycle = db.query(Cycle).filter(Cycle.type_cycle == "Normal").order_by(Cycle.date_debut.desc()).first()
+        debut_dernier_cycle = dernier_cycle.date_debut
+    finally:
+        db.close()
+    cycle_id = debut_dernier_cycle.strftime("%Y-%m-%d %H:%M:%S")
+    # Toute la période générée, bornes non alignées sur l'heure
+    debut_periode = debut_dernier_cycle - timedelta(days=40, minutes=17)
+    fin_periode = datetime.now()
+    csv_etagere = generer_csv_etagere(codes)
+    rng = random.Random(0)
+
+    # Pas de "with" : on ne déclenche pas le lifespan (ni data_db ni la simulation)
+    client = TestClient(server.app)
+
+    def scan():
+        res = client.post("/scan", json={"poste": 1, "code_barre": rng.choice(codes_poste_1)})
+        assert res.status_code == 200, res.text
+
+    def configurer_etagere():
+        db = SessionLocal()
+        try:
+            traiter_fichier_config(csv_etagere, 7, db)
+        finally:
+            db.close()
+
+    def tick_simulateur():
+        # Tous les délais expirent : pire cas (lecture + incrémentation de chaque boîte)
+        server.tick_approvisionnement({bid: 1 for bid in ids_boites})
+
+    cas = {
+        "recevoir_scan": scan,
+        "get_commandes_en_cours": lambda: client.get("/api/commandes/en_cours?mode=Normal"),
+        "get_admin_dashboard": lambda: client.get("/api/admin/dashboard?mode=Normal"),
+        "get_commandes_cycle_logs": lambda: requetes.get_commandes_cycle_logs(debut_dernier_cycle, mode="Normal"),
+        "export_csv": lambda: client.get(f"/api/admin/export-csv?type=logs&mode=Normal&cycle_id={cycle_id}"),
+        "statistiques_postes": lambda: requetes.get_pieces_arrivees_postes(debut_periode, fin_periode),
+        "traiter_fichier_config": configurer_etagere,
+        "tick_approvisionnement": tick_simulateur,
+    }
+    return {nom: mesurer(f, repetitions) for nom, f in cas.items()}
+
+
+# ---------- RÉFÉRENCE ET RÉGRESSIONS ----------
+
+def comparer_a_reference(resultats, reference, seuil):
+    """
+    Compare les médianes mesurées aux médianes de référence.
+    Retourne la liste des régressions dépassant le seuil (ex : 0.2 = +20 %).
+    """
+    regressions = []
+    for echelle, mesures in resultats.items():
+        for nom, m in mesures.items():
+            ref = reference.get(echelle, {}).get(nom)
+            if not ref or not ref.get("mediane_ms"):
+                continue
+            ratio = m["mediane_ms"] / ref["mediane_ms"]
+            if ratio > 1 + seuil:
+                regressions.append({
+                    "echelle": echelle,
+                    "mesure": nom,
+                    "reference_ms": ref["mediane_ms"],
+                    "actuel_ms": m["mediane_ms"],
+                    "ratio": round(ratio, 2),
+                })
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark des chemins critiques du backend")
+    parser.add_argument("--echelles", default="1000,10000,100000", help="Nombres de commandes, séparés par des virgules")
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--reference", default=REFERENCE_PAR_DEFAUT, help="Fichier JSON de référence")
+    parser.add_argument("--sortie", default=None, help="Fichier JSON où écrire les résultats bruts")
+    parser.add_argument("--seuil", type=float, default=0.2, help="Régression tolérée (0.2 = +20 %%)")
+    parser.add_argument("--maj-reference", action="store_true", help="Écrase la référence avec les résultats")
+    args = parser.parse_args(argv)
+
+    # On coupe les logs INFO (httpx, simulation) qui fausseraient les mesures
+    logging.getLogger().setLevel(logging.WARNING)
+    utiliser_base(BASE_BENCH)
+
+    resultats = {}
+    for echelle in [int(e) for e in args.echelles.split(",") if e.strip()]:
+        print(f"[BENCH] Échelle {echelle} commandes...")
+        resultats[str(echelle)] = lancer_echelle(echelle, args.repetitions)
+        for nom, m in resultats[str(echelle)].items():
+            print(f"    {nom:<28} médiane {m['mediane_ms']:>10.2f} ms   (min {m['min_ms']:.2f} / max {m['max_ms']:.2f})")
+
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as f:
+            json.dump(resultats, f, indent=2)
+
+    if args.maj_reference:
+        with open(args.reference, "w", encoding="utf-8") as f:
+            json.dump(resultats, f, indent=2)
+        print(f"[BENCH] Référence mise à jour : {args.reference}")
+        return 0
+
+    if not os.path.exists(args.reference):
+        print("[BENCH] Aucune référence trouvée, relancer avec --maj-reference pour en créer une.")
+        return 0
+
+    with open(args.reference, encoding="utf-8") as f:
+        reference = json.load(f)
+
+    regressions = comparer_a_reference(resultats, reference, args.seuil)
+    if not regressions:
+        print(f"[BENCH] Aucune régression au-delà de {args.seuil:.0%}.")
+        return 0
+
+    for r in regressions:
+        print(f"[RÉGRESSION] {r['mesure']} @ {r['echelle']} : {r['reference_ms']} ms -> {r['actuel_ms']} ms (x{r['ratio']})")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, PrimaryKeyConstraint, UniqueConstraint
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, PrimaryKeyConstraint, UniqueConstraint, Index
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, timezone
@@ -74,6 +74,42 @@ class Case(Base):
     boite = relationship("Boite", back_populates="Cases")
     Stand = relationship("Stand", back_populates="Cases")
 
+# Table des étagères : disposition visuelle (JSON) calculée à l'import du CSV
+class Etagere(Base):
+    __tablename__ = "etageres"
+    idStand = Column(Integer, ForeignKey("stands.idStand"), primary_key=True)
+    layout = Column(String)      # JSON {"layout": ..., "items": [...]}
+    empreinte = Column(String)   # Hash du JSON, sert d'ETag
+    date_maj = Column(DateTime, default=datetime.now)
+
+# Journal des mouvements de stock (ajout seul) : source de vérité du stock des boîtes.
+# Boite.nbBoite n'en est que la valeur courante matérialisée, mise à jour dans la même transaction.
+class MouvementStock(Base):
+    __tablename__ = "mouvements_stock"
+    idMouvement = Column(Integer, primary_key=True, autoincrement=True)
+    idBoite = Column(Integer, ForeignKey("boites.idBoite"), nullable=False)
+    date = Column(DateTime, default=datetime.now, nullable=False)
+    delta = Column(Integer, nullable=False)
+    motif = Column(String)  # "recuperation", "approvisionnement", "inventaire", "creation"
+    idCommande = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_mouvements_boite_date", "idBoite", "date"),
+    )
+
+# Instantanés périodiques du stock : valeur après le mouvement idMouvement inclus
+class InstantaneStock(Base):
+    __tablename__ = "instantanes_stock"
+    idInstantane = Column(Integer, primary_key=True, autoincrement=True)
+    idBoite = Column(Integer, ForeignKey("boites.idBoite"), nullable=False)
+    date = Column(DateTime, default=datetime.now, nullable=False)
+    nbBoite = Column(Integer, nullable=False)
+    idMouvement = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        Index("ix_instantanes_boite_date", "idBoite", "date"),
+    )
+
 # Table des commandes
 class Commande(Base):
     __tablename__ = "commandes"
@@ -86,11 +122,35 @@ class Commande(Base):
     date_livraison = Column(DateTime, nullable=True)
     statutCommande = Column(String, default="A récupérer")
     typeCommande = Column(String, default="Normal")  # "Normal" ou "Personnalisé"
+    # Boîtes demandées : les scans répétés d'une boîte pour un poste tant qu'elle est à récupérer
+    quantite = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        # Commandes en attente d'une boîte (prévision de rupture à chaque scan)
+        Index("ix_commandes_boite_statut", "idBoite", "statutCommande"),
+        # Bornes partielles des statistiques (voir agregats.py)
+        Index("ix_commandes_date", "dateCommande"),
+    )
 
     boite = relationship("Boite")
     poste = relationship("Stand", back_populates="commandes_poste", foreign_keys=[idPoste])
     magasin = relationship("Stand", back_populates="commandes_magasin", foreign_keys=[idMagasin])
 
+# Agrégats pré-calculés des commandes finies, par heure, jour et mois de commande
+# (statistiques postes / magasins). idPoste et idMagasin valent 0 quand ils sont inconnus.
+class AgregatCommandes(Base):
+    __tablename__ = "agregats_commandes"
+    granularite = Column(String)   # "heure", "jour" ou "mois"
+    periode = Column(DateTime)     # Début de la période
+    idPoste = Column(Integer)
+    idMagasin = Column(Integer)
+    idPiece = Column(Integer)
+    quantite = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("granularite", "periode", "idPoste", "idMagasin", "idPiece"),
+    )
+
 # Table Cycle
 class Cycle(Base):
     __tablename__ = "cycles"
@@ -98,7 +158,32 @@ class Cycle(Base):
     date_debut = Column(DateTime, default=datetime.now)
     date_fin = Column(DateTime, nullable=True)
     type_cycle = Column(String, default="Normal")  # "Normal" ou "Personnalisé"
-    
+
+# Table KpiCycle : indicateurs d'un cycle terminé, calculés à sa clôture (voir kpi.py)
+class KpiCycle(Base):
+    __tablename__ = "kpi_cycles"
+    idCycle = Column(Integer, ForeignKey("cycles.idCycle"), primary_key=True)
+    resultat = Column(String)   # JSON
+    date_calcul = Column(DateTime, default=datetime.now)
+
+# Table ArchiveCycle : cycles déplacés dans un fichier d'archive mensuel (voir archive.py)
+class ArchiveCycle(Base):
+    __tablename__ = "archives_cycles"
+    idCycle = Column(Integer, primary_key=True)
+    date_debut = Column(DateTime, index=True)
+    date_fin = Column(DateTime)
+    type_cycle = Column(String)
+    fichier = Column(String)     # ex. "archive_2024_03.db"
+    nb_commandes = Column(Integer, default=0)
+
+# Table EmetteurScans
+# Canaux d'ingestion (sender.py) : dernier numéro de scan enregistré, pour ignorer les renvois
+class EmetteurScans(Base):
+    __tablename__ = "emetteurs_scans"
+    idEmetteur = Column(String, primary_key=True)
+    dernier_seq = Column(Integer, nullable=False, default=0)
+    date_maj = Column(DateTime, default=datetime.now)
+
 # Table Login
 class Login(Base):
     __tablename__ = "login"
@@ -136,8 +221,68 @@ class Train(Base):
         self.position = self.postes[self.index]
         return self.position
 
+def generer_sku(piece):
+    """Génère le code-barre SKU d'une pièce (ex : PHA-0001) selon sa catégorie"""
+    nom = piece["nomPiece"].upper()
+    id_p = piece["idPiece"]
+    
+    # Logique de catégorie
+    if any(x in nom for x in ["PHARE", "CAPOT", "CORPS"]):
+        prefixe = "PHA" # Phares et composants
+    elif any(x in nom for x in ["VIS", "ECROU", "RONDELLE"]):
+        prefixe = "VIS" # Visserie
+    elif any(x in nom for x in ["FIXATION", "SUPPORT", "PINCE", "CADRE"]):
+        prefixe = "FIX" # Fixations
+    elif any(x in nom for x in ["CATADIOPE", "CATADIOPTRE"]):
+        prefixe = "CAT" # Catadioptres
+    elif any(x in nom for x in ["FIL", "AMPOULE", "COSSE", "LAMELLE"]):
+        prefixe = "ELE" # Électrique
+    elif any(x in nom for x in ["SACHET", "SAC", "NOTICE"]):
+        prefixe = "PKG" # Packaging
+    else:
+        prefixe = "PRT" # Pièce standard (Part)
+        
+    # Retourne un format : PHA-0001
+    return f"{prefixe}-{id_p:04d}"
+
+def utiliser_base(chemin):
+    """
+    Redirige le moteur et toutes les sessions vers un autre fichier SQLite
+    (utilisé par les benchmarks pour ne pas toucher à train.db).
+    """
+    global engine
+    engine = create_engine(f"sqlite:///{chemin}", connect_args={"check_same_thread": False})
+    SessionLocal.configure(bind=engine)
+    return engine
+
+def ajouter_colonnes_manquantes(conn, table):
+    """
+    Ajoute à une table existante les colonnes apparues depuis sa création (celles qui
+    ont un server_default, pour remplir les lignes déjà présentes).
+    """
+    prefixe = f'"{table.schema}".' if table.schema else ""
+    existantes = {ligne[1] for ligne in conn.exec_driver_sql(f'PRAGMA {prefixe}table_info("{table.name}")')}
+    if not existantes:
+        return
+    for colonne in table.c:
+        if colonne.name in existantes or colonne.server_default is None:
+            continue
+        type_sql = colonne.type.compile(dialect=conn.dialect)
+        contrainte = "" if colonne.nullable else " NOT NULL"
+        conn.exec_driver_sql(
+            f'ALTER TABLE {prefixe}"{table.name}" ADD COLUMN "{colonne.name}" {type_sql}{contrainte} '
+            f"DEFAULT {colonne.server_default.arg}"
+        )
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all ne touche pas aux tables existantes : on ajoute les colonnes et index apparus depuis
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            ajouter_colonnes_manquantes(conn, table)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 def drop_db():
     Base.metadata.drop_all(bind=engine)
@@ -193,31 +338,7 @@ def data_db():
         {"idPiece": 39, "nomPiece": "Fil", "description": ""},
     ]
 
-    
-    def generer_sku(piece):
-        nom = piece["nomPiece"].upper()
-        id_p = piece["idPiece"]
-        
-        # Logique de catégorie
-        if any(x in nom for x in ["PHARE", "CAPOT", "CORPS"]):
-            prefixe = "PHA" # Phares et composants
-        elif any(x in nom for x in ["VIS", "ECROU", "RONDELLE"]):
-            prefixe = "VIS" # Visserie
-        elif any(x in nom for x in ["FIXATION", "SUPPORT", "PINCE", "CADRE"]):
-            prefixe = "FIX" # Fixations
-        elif any(x in nom for x in ["CATADIOPE", "CATADIOPTRE"]):
-            prefixe = "CAT" # Catadioptres
-        elif any(x in nom for x in ["FIL", "AMPOULE", "COSSE", "LAMELLE"]):
-            prefixe = "ELE" # Électrique
-        elif any(x in nom for x in ["SACHET", "SAC", "NOTICE"]):
-            prefixe = "PKG" # Packaging
-        else:
-            prefixe = "PRT" # Pièce standard (Part)
-            
-        # Retourne un format : PHA-0001
-        return f"{prefixe}-{id_p:04d}"
 
-    
     for p in pieces_a_creer:
             if not db.query(Piece).filter_by(idPiece=p["idPiece"]).first():
                 db.add(Piece(**p))
@@ -279,7 +400,8 @@ def data_db():
 
     # Création de l'utilisateur
     if not db.query(Login).filter_by(username="test").first():
-        db.add(Login(username="test", password="password123", email="test@example.com"))
+        from securite import hacher_mot_de_passe  # securite importe database
+        db.add(Login(username="test", password=hacher_mot_de_passe("password123"), email="test@example.com"))
 
     
     db.commit()
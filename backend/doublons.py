@@ -0,0 +1,139 @@
+"""
+Filtrage des scans en double avant l'écriture en base.
+
+- Rebonds : un même (poste, code-barres) revu moins de FENETRE_REBOND secondes après
+  un scan enregistré est accusé sans créer de commande (double lecture du scanner,
+  opérateur qui rescanne parce que l'écran tarde).
+- Clé d'idempotence : un envoi qui porte la même clé qu'un scan déjà traité (renvoi
+  HTTP après un délai dépassé) renvoie le même résultat pendant DUREE_IDEMPOTENCE.
+
+Cartes en mémoire du worker, bornées (les entrées les plus anciennes sortent en premier).
+Avec plusieurs workers (TRAIN_ETAT=sqlite), une double lecture envoyée en HTTP peut
+arriver sur deux workers : les cartes passent alors dans l'état partagé (partager()).
+La place est réservée avant l'écriture : deux scans simultanés ne passent pas tous les
+deux ; si l'écriture échoue, la réservation est libérée et le scan peut être retenté.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+FENETRE_REBOND = float(os.environ.get("TRAIN_FENETRE_REBOND", "2"))   # Secondes, 0 pour désactiver ; par worker sauf partager()
+DUREE_IDEMPOTENCE = 600.0   # Secondes
+TAILLE_MAX = 10_000
+
+
+class CarteTtl:
+    """Clé -> (expiration, valeur), bornée à `taille` entrées ; valeur None = réservation en cours."""
+    def __init__(self, duree, taille=TAILLE_MAX):
+        self.duree = duree
+        self.taille = taille
+        self.lock = threading.Lock()
+        self.entrees = OrderedDict()
+
+    def reserver(self, cle):
+        """
+        True si la clé est libre (elle est alors réservée), sinon (False, valeur) :
+        valeur est l'identifiant déjà associé, ou None si le premier scan est encore en cours.
+        """
+        if self.duree <= 0:
+            return True, None
+        maintenant = time.monotonic()
+        with self.lock:
+            entree = self.entrees.get(cle)
+            if entree is not None and entree[0] > maintenant:
+                return False, entree[1]
+            self.entrees[cle] = (maintenant + self.duree, None)
+            self.entrees.move_to_end(cle)
+            while len(self.entrees) > self.taille:
+                self.entrees.popitem(last=False)
+        return True, None
+
+    def confirmer(self, cle, valeur):
+        with self.lock:
+            if cle in self.entrees:
+                self.entrees[cle] = (self.entrees[cle][0], valeur)
+
+    def liberer(self, cle):
+        with self.lock:
+            self.entrees.pop(cle, None)
+
+    def vider(self):
+        with self.lock:
+            self.entrees.clear()
+
+
+class CarteTtlPartagee:
+    """Même interface que CarteTtl, rangée dans l'état partagé : commune à tous les workers."""
+    def __init__(self, etat, prefixe, duree):
+        self.etat = etat
+        self.prefixe = prefixe
+        self.duree = duree
+
+    def _cle(self, cle):
+        return f"{self.prefixe}:{json.dumps(cle)}"
+
+    def reserver(self, cle):
+        if self.duree <= 0:
+            return True, None
+        libre, valeur = self.etat.reserver(self._cle(cle), self.duree)
+        return libre, json.loads(valeur) if valeur is not None else None
+
+    def confirmer(self, cle, valeur):
+        if self.duree > 0:
+            self.etat.confirmer_reservation(self._cle(cle), json.dumps(valeur))
+
+    def liberer(self, cle):
+        if self.duree > 0:
+            self.etat.liberer_reservation(self._cle(cle))
+
+    def vider(self):
+        self.etat.vider_reservations(self.prefixe)
+
+
+class FiltreDoublons:
+    """Les deux cartes d'un worker ; reserver() indique si le scan doit être écrit."""
+    def __init__(self, fenetre=FENETRE_REBOND, duree_idempotence=DUREE_IDEMPOTENCE, taille=TAILLE_MAX):
+        self.rebonds = CarteTtl(fenetre, taille)
+        self.idempotence = CarteTtl(duree_idempotence, taille)
+
+    def _cles(self, poste, code_barre, cle_idempotence):
+        cles = [(self.rebonds, (poste, code_barre))]
+        if cle_idempotence:
+            cles.insert(0, (self.idempotence, str(cle_idempotence)))
+        return cles
+
+    def reserver(self, poste, code_barre, cle_idempotence=None):
+        """
+        (True, None) : scan nouveau, à écrire puis confirmer() ou liberer().
+        (False, id_commande) : doublon à accuser sans écrire (id None si le premier est en cours).
+        """
+        prises = []
+        for carte, cle in self._cles(poste, code_barre, cle_idempotence):
+            libre, valeur = carte.reserver(cle)
+            if not libre:
+                for c, k in prises:
+                    c.liberer(k)
+                return False, valeur
+            prises.append((carte, cle))
+        return True, None
+
+    def confirmer(self, poste, code_barre, cle_idempotence, id_commande):
+        for carte, cle in self._cles(poste, code_barre, cle_idempotence):
+            carte.confirmer(cle, id_commande)
+
+    def liberer(self, poste, code_barre, cle_idempotence=None):
+        for carte, cle in self._cles(poste, code_barre, cle_idempotence):
+            carte.liberer(cle)
+
+    def vider(self):
+        self.rebonds.vider()
+        self.idempotence.vider()
+
+    def partager(self, etat):
+        """Plusieurs workers : les deux cartes passent dans l'état partagé (mêmes durées)."""
+        self.rebonds = CarteTtlPartagee(etat, "rebond", self.rebonds.duree)
+        self.idempotence = CarteTtlPartagee(etat, "idempotence", self.idempotence.duree)
+
+filtre_scans = FiltreDoublons()
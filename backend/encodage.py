@@ -0,0 +1,70 @@
+"""
+Encodages des messages WebSocket, choisis par le client à la connexion (?format=...).
+
+- "json" (défaut) : JSON compact, sérialisé par orjson s'il est installé ;
+- "msgpack" : MessagePack en trames binaires, si le paquet msgpack est installé.
+
+Un message diffusé n'est encodé qu'une fois par format, quel que soit le nombre de
+sockets qui le reçoivent. La compression permessage-deflate est négociée par uvicorn
+lui-même (backend websockets, --ws-per-message-deflate, actif par défaut) : un client
+qui la propose la reçoit, en plus de l'encodage choisi.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMAT_DEFAUT = "json"
+
+
+def _json(donnees):
+    if orjson is not None:
+        return orjson.dumps(donnees).decode()
+    return json.dumps(donnees, separators=(",", ":"), ensure_ascii=False)
+
+def _msgpack(donnees):
+    return msgpack.packb(donnees, use_bin_type=True)
+
+# format -> (fonction d'encodage, trame binaire ?)
+ENCODEURS = {"json": (_json, False)}
+if msgpack is not None:
+    ENCODEURS["msgpack"] = (_msgpack, True)
+
+
+def verifier_format(nom):
+    """Format demandé par un client ; ValueError s'il est inconnu ou indisponible sur ce serveur."""
+    nom = nom or FORMAT_DEFAUT
+    if nom not in ENCODEURS:
+        raise ValueError(f"Format inconnu ou indisponible : {nom} (disponibles : {', '.join(ENCODEURS)})")
+    return nom
+
+
+class MessageDiffuse:
+    """Message à diffuser, avec ses encodages calculés à la demande puis réutilisés."""
+    __slots__ = ("donnees", "encodes")
+
+    def __init__(self, donnees, texte_json=None):
+        self.donnees = donnees
+        self.encodes = {} if texte_json is None else {"json": texte_json}
+
+    @classmethod
+    def depuis_json(cls, texte):
+        return cls(json.loads(texte), texte)
+
+    def encoder(self, nom=FORMAT_DEFAUT):
+        if nom not in self.encodes:
+            self.encodes[nom] = ENCODEURS[nom][0](self.donnees)
+        return self.encodes[nom]
+
+    async def envoyer(self, websocket, nom=FORMAT_DEFAUT):
+        if ENCODEURS[nom][1]:
+            await websocket.send_bytes(self.encoder(nom))
+        else:
+            await websocket.send_text(self.encoder(nom))
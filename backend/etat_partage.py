@@ -0,0 +1,274 @@
+"""
+État partagé entre les workers du serveur (uvicorn --workers N).
+
+Trois services, derrière la même interface :
+- valeurs partagées (lire / ecrire / incrementer) : le mode actif de l'application,
+  le numéro de séquence des diffusions WebSocket ;
+- publication sur des canaux (publier / abonner) : diffusions WebSocket, signal de
+  mise à jour des délais, invalidation du cache des étagères, observations de scans ;
+- bail de leadership (tenter_bail) : un seul worker fait tourner la simulation
+  d'approvisionnement et les tâches de maintenance.
+
+En mode "sqlite" seulement, des réservations à durée limitée (reserver) : l'anti-rebond
+des scans (doublons.py) y passe pour être commun à tous les workers.
+
+Implémentations, choisies par la variable d'environnement TRAIN_ETAT :
+- "local" (défaut) : un seul processus, tout en mémoire, toujours leader ;
+- "sqlite" : tables de train.db partagées par les workers ; chaque worker sonde la
+  table des notifications toutes les INTERVALLE_SONDAGE secondes.
+
+publier() ne prévient que les AUTRES workers : l'appelant traite lui-même son
+propre processus (diffusion à ses sockets, etc.), sans attendre le sondage.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, cast, delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import database
+
+INTERVALLE_SONDAGE = 0.1     # Secondes entre deux lectures des notifications
+RETENTION_NOTIFICATIONS = 60 # Secondes : un worker absent plus longtemps a de toute façon tout rechargé
+DUREE_BAIL = 10.0            # Secondes sans renouvellement avant qu'un autre worker prenne la main
+
+
+class EtatPartage:
+    """Interface commune ; les abonnements sont locaux au processus."""
+    distribue = False
+
+    def __init__(self):
+        self.abonnes = {}
+
+    def abonner(self, canal, rappel):
+        """rappel(message) : fonction ou coroutine, appelée dans la boucle d'évènements."""
+        self.abonnes.setdefault(canal, []).append(rappel)
+
+    async def _notifier(self, canal, message):
+        for rappel in self.abonnes.get(canal, []):
+            try:
+                resultat = rappel(message)
+                if asyncio.iscoroutine(resultat):
+                    await resultat
+            except Exception as e:
+                logging.error(f"[ETAT] Erreur sur le canal {canal} : {e}")
+
+    async def demarrer(self):
+        pass
+
+    async def arreter(self):
+        pass
+
+
+class EtatLocal(EtatPartage):
+    """Un seul worker : valeurs en mémoire, personne d'autre à prévenir, toujours leader."""
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.valeurs = {}
+
+    def lire(self, cle, defaut=None):
+        with self.lock:
+            return self.valeurs.get(cle, defaut)
+
+    def ecrire(self, cle, valeur):
+        with self.lock:
+            self.valeurs[cle] = valeur
+
+    def incrementer(self, cle, initial=1):
+        """Compteur : renvoie `initial` au premier appel, puis la valeur suivante."""
+        with self.lock:
+            valeur = int(self.valeurs[cle]) + 1 if cle in self.valeurs else initial
+            self.valeurs[cle] = valeur
+            return valeur
+
+    def publier(self, canal, message):
+        pass
+
+    def tenter_bail(self, nom, duree=DUREE_BAIL):
+        return True
+
+    def liberer_bail(self, nom):
+        pass
+
+
+_meta = MetaData()
+table_valeurs = Table(
+    "etat_valeurs", _meta,
+    Column("cle", String, primary_key=True),
+    Column("valeur", String),
+)
+table_notifications = Table(
+    "etat_notifications", _meta,
+    Column("idNotification", Integer, primary_key=True, autoincrement=True),
+    Column("canal", String, nullable=False),
+    Column("message", String),
+    Column("origine", String, nullable=False),
+    Column("date", Float, nullable=False),   # time.time()
+)
+table_baux = Table(
+    "etat_baux", _meta,
+    Column("nom", String, primary_key=True),
+    Column("titulaire", String, nullable=False),
+    Column("expiration", Float, nullable=False),
+)
+table_reservations = Table(
+    "etat_reservations", _meta,
+    Column("cle", String, primary_key=True),
+    Column("valeur", String),                  # None tant que le détenteur n'a rien confirmé
+    Column("expiration", Float, nullable=False),
+)
+
+
+class EtatSqlite(EtatPartage):
+    """Workers d'une même machine : valeurs, notifications et baux dans la base SQLite commune."""
+    distribue = True
+
+    def __init__(self, intervalle=INTERVALLE_SONDAGE):
+        super().__init__()
+        self.origine = uuid.uuid4().hex
+        self.intervalle = intervalle
+        self.dernier = 0
+        self.tache = None
+        self.creer_tables()
+
+    @property
+    def engine(self):
+        # Relu à chaque appel : utiliser_base() peut rediriger le moteur
+        return database.engine
+
+    def creer_tables(self):
+        _meta.create_all(self.engine)
+
+    # --- Valeurs ---
+    def lire(self, cle, defaut=None):
+        with self.engine.connect() as conn:
+            valeur = conn.execute(select(table_valeurs.c.valeur).where(table_valeurs.c.cle == cle)).scalar()
+        return defaut if valeur is None else valeur
+
+    def ecrire(self, cle, valeur):
+        requete = sqlite_insert(table_valeurs).values(cle=cle, valeur=valeur)
+        with self.engine.begin() as conn:
+            conn.execute(requete.on_conflict_do_update(index_elements=["cle"], set_={"valeur": requete.excluded.valeur}))
+
+    def incrementer(self, cle, initial=1):
+        """Compteur atomique entre workers (upsert ... RETURNING)."""
+        requete = sqlite_insert(table_valeurs).values(cle=cle, valeur=str(initial))
+        requete = requete.on_conflict_do_update(
+            index_elements=["cle"], set_={"valeur": cast(cast(table_valeurs.c.valeur, Integer) + 1, String)},
+        ).returning(table_valeurs.c.valeur)
+        with self.engine.begin() as conn:
+            return int(conn.execute(requete).scalar())
+
+    # --- Notifications ---
+    def publier(self, canal, message):
+        with self.engine.begin() as conn:
+            conn.execute(insert(table_notifications).values(
+                canal=canal, message=message, origine=self.origine, date=time.time(),
+            ))
+
+    def _lire_notifications(self):
+        n = table_notifications
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(n.c.idNotification, n.c.canal, n.c.message, n.c.origine)
+                .where(n.c.idNotification > self.dernier)
+                .order_by(n.c.idNotification)
+            ).all()
+
+    def purger(self):
+        with self.engine.begin() as conn:
+            conn.execute(delete(table_reservations).where(table_reservations.c.expiration < time.time()))
+            return conn.execute(delete(table_notifications).where(
+                table_notifications.c.date < time.time() - RETENTION_NOTIFICATIONS
+            )).rowcount
+
+    async def _ecouter(self):
+        tours = 0
+        while True:
+            try:
+                for id_notif, canal, message, origine in await asyncio.to_thread(self._lire_notifications):
+                    self.dernier = id_notif
+                    if origine != self.origine:
+                        await self._notifier(canal, message)
+                tours += 1
+                if tours % 600 == 0:
+                    await asyncio.to_thread(self.purger)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"[ETAT] Lecture des notifications impossible : {e}")
+            await asyncio.sleep(self.intervalle)
+
+    async def demarrer(self):
+        # On ne rejoue pas l'historique : seules les notifications postérieures au démarrage comptent
+        with self.engine.connect() as conn:
+            self.dernier = conn.execute(select(func.coalesce(func.max(table_notifications.c.idNotification), 0))).scalar()
+        self.tache = asyncio.create_task(self._ecouter())
+
+    async def arreter(self):
+        if self.tache:
+            self.tache.cancel()
+            self.tache = None
+
+    # --- Bail de leadership ---
+    def tenter_bail(self, nom, duree=DUREE_BAIL):
+        """Prend ou renouvelle le bail `nom` ; True si ce worker le détient (upsert conditionnel atomique)."""
+        maintenant = time.time()
+        requete = sqlite_insert(table_baux).values(nom=nom, titulaire=self.origine, expiration=maintenant + duree)
+        requete = requete.on_conflict_do_update(
+            index_elements=["nom"],
+            set_={"titulaire": requete.excluded.titulaire, "expiration": requete.excluded.expiration},
+            where=(table_baux.c.titulaire == self.origine) | (table_baux.c.expiration < maintenant),
+        )
+        with self.engine.begin() as conn:
+            return conn.execute(requete).rowcount == 1
+
+    def liberer_bail(self, nom):
+        with self.engine.begin() as conn:
+            conn.execute(delete(table_baux).where(table_baux.c.nom == nom, table_baux.c.titulaire == self.origine))
+
+    # --- Réservations à durée limitée ---
+    def reserver(self, cle, duree):
+        """
+        Réserve `cle` pour `duree` secondes si elle est libre ou expirée : (True, None).
+        Sinon (False, valeur), valeur confirmée par le détenteur (None s'il n'a pas fini).
+        """
+        maintenant = time.time()
+        r = table_reservations
+        requete = sqlite_insert(r).values(cle=cle, valeur=None, expiration=maintenant + duree)
+        requete = requete.on_conflict_do_update(
+            index_elements=["cle"],
+            set_={"valeur": None, "expiration": requete.excluded.expiration},
+            where=r.c.expiration <= maintenant,
+        )
+        with self.engine.begin() as conn:
+            if conn.execute(requete).rowcount == 1:
+                return True, None
+            return False, conn.execute(select(r.c.valeur).where(r.c.cle == cle)).scalar()
+
+    def confirmer_reservation(self, cle, valeur):
+        with self.engine.begin() as conn:
+            conn.execute(table_reservations.update().where(table_reservations.c.cle == cle).values(valeur=valeur))
+
+    def liberer_reservation(self, cle):
+        with self.engine.begin() as conn:
+            conn.execute(delete(table_reservations).where(table_reservations.c.cle == cle))
+
+    def vider_reservations(self, prefixe):
+        with self.engine.begin() as conn:
+            conn.execute(delete(table_reservations).where(table_reservations.c.cle.startswith(f"{prefixe}:")))
+
+
+BACKENDS = {"local": EtatLocal, "sqlite": EtatSqlite}
+
+def creer_etat(nom=None):
+    nom = nom or os.environ.get("TRAIN_ETAT", "local")
+    if nom not in BACKENDS:
+        raise ValueError(f"TRAIN_ETAT inconnu : {nom} (attendu : {', '.join(BACKENDS)})")
+    logging.info(f"[ETAT] État partagé : {nom}")
+    return BACKENDS[nom]()
@@ -8,14 +8,18 @@ Exemple :
 """
 
 import requests
+import time
 import traceback
+from traces import nouvelle_trace
 
 SERVER_HOST = "http://127.0.0.1:8000"
 SCAN_ENDPOINT = f"{SERVER_HOST}/scan"
 
 def send_scan(barcode, device_id):
     """Envoie un code-barres simulé au serveur FastAPI"""
-    payload = {"code_barre": barcode, "poste": device_id}
+    trace = nouvelle_trace()
+    trace["t_envoi"], trace["h_envoi"] = time.monotonic(), time.time()
+    payload = {"code_barre": barcode, "poste": device_id, "trace": trace}
     try:
         res = requests.post(SCAN_ENDPOINT, json=payload, timeout=3)
         if res.ok:
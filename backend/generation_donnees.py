@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+generation_donnees.py - Générateur de jeux de données synthétiques pour train.db.
+
+Crée N pièces/boîtes (codes SKU via database.generer_sku), M stands avec leurs
+grilles d'étagères (table cases), K cycles et autant de commandes que voulu,
+avec des statuts et des horodatages réalistes. Les insertions passent par
+executemany sur la connexion brute pour qu'une base d'un million de commandes
+se construise en quelques secondes.
+
+Exemple :
+    python generation_donnees.py /tmp/gros_train.db --pieces 2000 --stands 20 --cycles 200 --commandes 1000000
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from database import generer_sku, reset_db, utiliser_base
+from securite import hacher_mot_de_passe
+import database
+import agregats
+from stock import amorcer
+
+# Familles de pièces : donnent des préfixes SKU variés (PHA, VIS, FIX, CAT, ELE, PKG, PRT)
+FAMILLES = [
+    "Phare", "Capot", "Vis", "Ecrou", "Rondelle", "Fixation", "Support",
+    "Catadioptre", "Fil", "Ampoule", "Cosse", "Sachet", "Notice", "Socle",
+]
+
+# Répartition des statuts finaux pour un cycle terminé
+STATUTS_FINAUX = [("Commande finie", 0.95), ("Annulée", 0.03), ("Produit manquant", 0.02)]
+
+TAILLE_LOT = 50_000
+DUREE_CYCLE = timedelta(hours=8)
+
+
+def _format_date(d):
+    """Format de stockage des DateTime SQLAlchemy sous SQLite."""
+    return d.isoformat(sep=" ", timespec="microseconds") if d else None
+
+def _tirer_statut(rng):
+    x = rng.random()
+    cumul = 0.0
+    for statut, proba in STATUTS_FINAUX:
+        cumul += proba
+        if x < cumul:
+            return statut
+    return STATUTS_FINAUX[0][0]
+
+def _executer_par_lots(cursor, sql, lignes):
+    """executemany par lots de TAILLE_LOT pour borner la mémoire."""
+    lot = []
+    for ligne in lignes:
+        lot.append(ligne)
+        if len(lot) >= TAILLE_LOT:
+            cursor.executemany(sql, lot)
+            lot = []
+    if lot:
+        cursor.executemany(sql, lot)
+
+
+def generer_stands(nb_stands):
+    """Environ 3/7 de postes (catégorie 0), le reste en magasins (catégorie 1), comme data_db."""
+    nb_postes = max(1, nb_stands * 3 // 7)
+    stands = []
+    for i in range(1, nb_stands + 1):
+        if i <= nb_postes:
+            stands.append((i, f"Poste {i}", 0))
+        else:
+            stands.append((i, f"Magasin {i - nb_postes}", 1))
+    return stands
+
+def generer_pieces_boites(nb_pieces, postes, magasins, rng):
+    """Retourne (pieces, boites) ; chaque boîte est affectée à un magasin et un poste."""
+    pieces, boites = [], []
+    for id_p in range(1, nb_pieces + 1):
+        nom = f"{FAMILLES[id_p % len(FAMILLES)]} {id_p}"
+        pieces.append((id_p, nom, ""))
+        code = generer_sku({"idPiece": id_p, "nomPiece": nom})
+        boites.append((
+            id_p, id_p, code, rng.randint(0, 30),
+            rng.choice(magasins) if magasins else None,
+            rng.choice(postes),
+            rng.choice((60, 120, 180, 300)),
+        ))
+    return pieces, boites
+
+def generer_cases(boites, largeur=20):
+    """Range les boîtes de chaque magasin sur une grille de `largeur` colonnes."""
+    par_magasin = {}
+    for b in boites:
+        if b[4] is not None:
+            par_magasin.setdefault(b[4], []).append(b[0])
+    cases = []
+    for id_magasin, ids in par_magasin.items():
+        for i, id_boite in enumerate(ids):
+            cases.append((id_magasin, id_boite, i // largeur + 1, i % largeur + 1))
+    return cases
+
+def generer_cycles(nb_cycles, fin, part_perso=0.1, rng=None):
+    """Un cycle de 8 h par jour en remontant depuis `fin` ; le dernier (en cours) se termine à `fin`."""
+    rng = rng or random.Random()
+    cycles = []
+    for i in range(nb_cycles):
+        debut = fin - DUREE_CYCLE - timedelta(days=nb_cycles - 1 - i)
+        ouvert = (i == nb_cycles - 1)
+        type_cycle = "Personnalisé" if rng.random() < part_perso else "Normal"
+        cycles.append((i + 1, debut, None if ouvert else debut + DUREE_CYCLE, type_cycle))
+    return cycles
+
+def generer_commandes(nb_commandes, cycles, boites, rng):
+    """
+    Générateur de commandes réparties uniformément entre les cycles.
+    Dans un cycle terminé toutes les commandes sont clôturées ; dans le cycle
+    ouvert, les plus récentes sont encore "A récupérer" ou "A déposer".
+    """
+    if not cycles:
+        return
+    par_cycle, reste = divmod(nb_commandes, len(cycles))
+    for idx, (_, debut, fin, type_cycle) in enumerate(cycles):
+        n = par_cycle + (1 if idx < reste else 0)
+        if n == 0:
+            continue
+        ouvert = fin is None
+        duree = DUREE_CYCLE.total_seconds()
+        decalages = sorted(rng.random() * duree for _ in range(n))
+        for rang, dec in enumerate(decalages):
+            b = boites[rng.randrange(len(boites))]
+            date_cmd = debut + timedelta(seconds=dec)
+            attente = timedelta(seconds=rng.expovariate(1 / 180))
+            trajet = timedelta(seconds=rng.expovariate(1 / 240))
+
+            if ouvert and rang >= n * 0.9:
+                statut = "A récupérer" if rng.random() < 0.6 else "A déposer"
+            else:
+                statut = _tirer_statut(rng)
+
+            date_recup = date_cmd + attente if statut not in ("A récupérer", "Annulée") else None
+            date_livr = date_cmd + attente + trajet if statut in ("Commande finie", "Annulée", "Produit manquant") else None
+            yield (
+                b[0], b[5], b[4], _format_date(date_cmd), _format_date(date_recup),
+                _format_date(date_livr), statut, type_cycle,
+            )
+
+def generer_base(nb_pieces=200, nb_stands=7, nb_cycles=30, nb_commandes=100_000, graine=42):
+    """
+    Réinitialise la base actuellement liée (voir database.utiliser_base) et la
+    remplit avec un jeu de données synthétique. Retourne un résumé des volumes.
+    """
+    rng = random.Random(graine)
+    reset_db()
+
+    stands = generer_stands(nb_stands)
+    postes = [s[0] for s in stands if s[2] == 0]
+    magasins = [s[0] for s in stands if s[2] == 1]
+    pieces, boites = generer_pieces_boites(nb_pieces, postes, magasins, rng)
+    cases = generer_cases(boites)
+    cycles = generer_cycles(nb_cycles, datetime.now(), rng=rng)
+
+    conn = database.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        # Construction uniquement : la durabilité n'a pas d'intérêt ici
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA journal_mode = MEMORY")
+
+        cursor.executemany("INSERT INTO stands (idStand, nomStand, categorie) VALUES (?, ?, ?)", stands)
+        cursor.executemany("INSERT INTO pieces (idPiece, nomPiece, description) VALUES (?, ?, ?)", pieces)
+        cursor.executemany(
+            "INSERT INTO boites (idBoite, idPiece, code_barre, nbBoite, idMagasin, idPoste, approvisionnement) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", boites)
+        cursor.executemany("INSERT INTO cases (idStand, idBoite, ligne, colonne) VALUES (?, ?, ?, ?)", cases)
+        cursor.executemany(
+            "INSERT INTO cycles (idCycle, date_debut, date_fin, type_cycle) VALUES (?, ?, ?, ?)",
+            [(c[0], _format_date(c[1]), _format_date(c[2]), c[3]) for c in cycles])
+        cursor.executemany(
+            "INSERT INTO train (idTrain, position, statut_train) VALUES (?, ?, ?)",
+            [(1, magasins[0] if magasins else postes[0], "Normal"), (2, postes[0], "Personnalisé")])
+        _executer_par_lots(
+            cursor,
+            "INSERT INTO commandes (idBoite, idPoste, idMagasin, dateCommande, date_recuperation, "
+            "date_livraison, statutCommande, typeCommande) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            generer_commandes(nb_commandes, cycles, boites, rng))
+        cursor.execute(
+            "INSERT INTO login (username, password, email) VALUES (?, ?, ?)",
+            ("test", hacher_mot_de_passe("password123"), "test@example.com"))
+        conn.commit()
+        cursor.execute("PRAGMA synchronous = FULL")
+        cursor.execute("PRAGMA journal_mode = DELETE")
+        # PRAGMA journal_mode renvoie une ligne : le curseur doit être fermé avant de rendre la connexion au pool
+        cursor.close()
+    finally:
+        conn.close()
+
+    # Point de départ du registre de stock (un instantané par boîte) et agrégats statistiques
+    db = database.SessionLocal()
+    try:
+        amorcer(db)
+        agregats.reconstruire(db)
+        db.commit()
+    finally:
+        db.close()
+
+    return {
+        "stands": len(stands),
+        "pieces": len(pieces),
+        "boites": len(boites),
+        "cases": len(cases),
+        "cycles": len(cycles),
+        "commandes": nb_commandes,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère une base train.db synthétique")
+    parser.add_argument("base", help="Chemin du fichier SQLite à (re)créer")
+    parser.add_argument("--pieces", type=int, default=200)
+    parser.add_argument("--stands", type=int, default=7)
+    parser.add_argument("--cycles", type=int, default=30)
+    parser.add_argument("--commandes", type=int, default=100_000)
+    parser.add_argument("--graine", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    utiliser_base(args.base)
+    t0 = time.perf_counter()
+    resume = generer_base(args.pieces, args.stands, args.cycles, args.commandes, args.graine)
+    duree = time.perf_counter() - t0
+    print(f"[GEN] {args.base} généré en {duree:.1f} s : " + ", ".join(f"{v} {k}" for k, v in resume.items()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Indicateurs de performance (KPI) des cycles.
+
+Pour un cycle, et pour chacun de ses postes et magasins :
+- délais demande -> récupération et récupération -> livraison (p50, p90, p95, max, en secondes) ;
+- commandes par heure ;
+- taux de "Produit manquant".
+
+Un cycle terminé est calculé une fois à sa clôture (stop_cycle) et mis en cache
+dans la table kpi_cycles. Le cycle en cours est tenu à jour incrémentalement
+(en_cours) à chaque scan et à chaque changement de statut : l'écran d'admin ne
+relit jamais les commandes brutes.
+"""
+import bisect
+import json
+import threading
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from database import Commande, Cycle, KpiCycle
+
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p95", 0.95))
+
+
+def _repartition(valeurs):
+    """Quantiles d'une liste triée de durées (secondes), None si vide."""
+    if not valeurs:
+        return None
+    n = len(valeurs)
+    resultat = {nom: round(valeurs[min(n - 1, int(n * q))], 1) for nom, q in QUANTILES}
+    resultat["max"] = round(valeurs[-1], 1)
+    resultat["nb"] = n
+    return resultat
+
+
+class _Bloc:
+    """Compteurs d'un périmètre (cycle entier, un poste ou un magasin)."""
+    def __init__(self):
+        self.nb = 0
+        self.manquants = 0
+        self.attentes = []   # demande -> récupération (triées)
+        self.trajets = []    # récupération -> livraison (triées)
+
+    def resultat(self, heures):
+        return {
+            "nb_commandes": self.nb,
+            "commandes_par_heure": round(self.nb / heures, 2) if heures > 0 else None,
+            "demande_recuperation": _repartition(self.attentes),
+            "recuperation_livraison": _repartition(self.trajets),
+            "nb_manquants": self.manquants,
+            "taux_manquant": round(self.manquants / self.nb, 4) if self.nb else 0.0,
+        }
+
+
+class AccumulateurKpi:
+    """Agrège les évènements d'un cycle ; alimenté en bloc (clôture) ou au fil de l'eau (cycle en cours)."""
+    def __init__(self):
+        self.blocs = {}
+
+    def _blocs(self, poste, magasin):
+        for cle in (("global", ""), ("postes", str(poste)), ("magasins", str(magasin))):
+            if cle not in self.blocs:
+                self.blocs[cle] = _Bloc()
+            yield self.blocs[cle]
+
+    def commande(self, poste, magasin):
+        for b in self._blocs(poste, magasin):
+            b.nb += 1
+
+    def recuperation(self, poste, magasin, secondes):
+        for b in self._blocs(poste, magasin):
+            bisect.insort(b.attentes, secondes)
+
+    def livraison(self, poste, magasin, secondes):
+        for b in self._blocs(poste, magasin):
+            bisect.insort(b.trajets, secondes)
+
+    def manquant(self, poste, magasin):
+        for b in self._blocs(poste, magasin):
+            b.manquants += 1
+
+    def resultat(self, cycle: Cycle, fin=None):
+        fin = cycle.date_fin or fin or datetime.now()
+        heures = (fin - cycle.date_debut).total_seconds() / 3600
+        global_ = self.blocs.get(("global", ""), _Bloc())
+        return {
+            "idCycle": cycle.idCycle,
+            "type_cycle": cycle.type_cycle,
+            "debut": cycle.date_debut.isoformat(),
+            "fin": cycle.date_fin.isoformat() if cycle.date_fin else None,
+            "en_cours": cycle.date_fin is None,
+            "global": global_.resultat(heures),
+            "postes": {k: b.resultat(heures) for (axe, k), b in sorted(self.blocs.items()) if axe == "postes"},
+            "magasins": {k: b.resultat(heures) for (axe, k), b in sorted(self.blocs.items()) if axe == "magasins"},
+        }
+
+
+def accumuler_cycle(db: Session, cycle: Cycle):
+    """Rejoue les commandes d'un cycle (un parcours de l'index sur dateCommande)."""
+    acc = AccumulateurKpi()
+    commandes = db.query(
+        Commande.idPoste, Commande.idMagasin, Commande.statutCommande,
+        Commande.dateCommande, Commande.date_recuperation, Commande.date_livraison,
+    ).filter(
+        Commande.typeCommande == cycle.type_cycle,
+        Commande.dateCommande >= cycle.date_debut,
+        Commande.dateCommande <= (cycle.date_fin or datetime.now()),
+    )
+    for poste, magasin, statut, date_cmd, date_recup, date_livr in commandes:
+        acc.commande(poste, magasin)
+        if date_recup:
+            acc.recuperation(poste, magasin, (date_recup - date_cmd).total_seconds())
+        if statut == "Commande finie" and date_recup and date_livr:
+            acc.livraison(poste, magasin, (date_livr - date_recup).total_seconds())
+        elif statut == "Produit manquant":
+            acc.manquant(poste, magasin)
+    return acc
+
+def calculer_et_stocker(db: Session, cycle: Cycle):
+    """KPI définitifs d'un cycle terminé, enregistrés dans kpi_cycles (sans commit)."""
+    resultat = accumuler_cycle(db, cycle).resultat(cycle)
+    contenu = json.dumps(resultat, ensure_ascii=False)
+    cache = db.query(KpiCycle).filter(KpiCycle.idCycle == cycle.idCycle).first()
+    if cache:
+        cache.resultat = contenu
+        cache.date_calcul = datetime.now()
+    else:
+        db.add(KpiCycle(idCycle=cycle.idCycle, resultat=contenu, date_calcul=datetime.now()))
+    return resultat
+
+def kpi_cycle(db: Session, cycle: Cycle):
+    """
+    KPI d'un cycle : version incrémentale pour le cycle en cours, cache pour un cycle
+    terminé (calculé et mis en cache au premier accès s'il a été clos avant ce module).
+    """
+    if cycle.date_fin is None:
+        if not en_cours.incremental:
+            return accumuler_cycle(db, cycle).resultat(cycle)
+        resultat = en_cours.resultat(cycle)
+        if resultat is None:
+            en_cours.demarrer(cycle, accumuler_cycle(db, cycle))
+            resultat = en_cours.resultat(cycle)
+        return resultat
+
+    cache = db.query(KpiCycle.resultat).filter(KpiCycle.idCycle == cycle.idCycle).scalar()
+    if cache:
+        return json.loads(cache)
+    resultat = calculer_et_stocker(db, cycle)
+    db.commit()
+    return resultat
+
+
+class KpiEnCours:
+    """
+    Accumulateurs des cycles ouverts, par type de cycle (un verrou : routes sync en threads).
+    incremental=False (plusieurs workers) : chaque lecture recalcule depuis les commandes.
+    """
+    def __init__(self):
+        self.incremental = True
+        self.lock = threading.Lock()
+        self.cycles = {}   # type_cycle -> (idCycle, date_debut, AccumulateurKpi)
+
+    def demarrer(self, cycle: Cycle, acc=None):
+        with self.lock:
+            self.cycles[cycle.type_cycle] = (cycle.idCycle, cycle.date_debut, acc or AccumulateurKpi())
+
+    def arreter(self, type_cycle):
+        with self.lock:
+            self.cycles.pop(type_cycle, None)
+
+    def charger(self, db: Session):
+        """Au démarrage : reconstruit l'accumulateur de chaque cycle ouvert."""
+        with self.lock:
+            self.cycles.clear()
+        for cycle in db.query(Cycle).filter(Cycle.date_fin == None).all():
+            self.demarrer(cycle, accumuler_cycle(db, cycle))
+
+    def _appliquer(self, type_cycle, date_commande, action, *args):
+        with self.lock:
+            courant = self.cycles.get(type_cycle)
+            # Une commande antérieure au cycle ouvert appartient à un cycle déjà clos
+            if courant is None or (date_commande and date_commande < courant[1]):
+                return
+            getattr(courant[2], action)(*args)
+
+    def commande(self, type_cycle, date_commande, poste, magasin):
+        self._appliquer(type_cycle, date_commande, "commande", poste, magasin)
+
+    def recuperation(self, type_cycle, date_commande, poste, magasin, secondes):
+        self._appliquer(type_cycle, date_commande, "recuperation", poste, magasin, secondes)
+
+    def livraison(self, type_cycle, date_commande, poste, magasin, secondes):
+        self._appliquer(type_cycle, date_commande, "livraison", poste, magasin, secondes)
+
+    def manquant(self, type_cycle, date_commande, poste, magasin):
+        self._appliquer(type_cycle, date_commande, "manquant", poste, magasin)
+
+    def resultat(self, cycle: Cycle):
+        with self.lock:
+            courant = self.cycles.get(cycle.type_cycle)
+            if courant is None or courant[0] != cycle.idCycle:
+                return None
+            return courant[2].resultat(cycle)
+
+en_cours = KpiEnCours()
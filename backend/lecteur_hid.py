@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Zapettes USB en mode HID-POS (page d'usage 0x8C), lues avec hidapi.
+
+Le scanner envoie ses codes-barres dans des rapports "Scanned Data" : pas de port
+série à sonder, pas de lecture octet par octet, pas d'émulation clavier. Chaque
+scanner a son thread, bloqué dans hid.device.read() jusqu'au rapport suivant.
+
+Disposition des rapports (64 octets, Honeywell / Datalogic / Zebra en HID-POS) :
+    [0] ID du rapport (0x02)  [1] longueur utile  [2:5] symbologie (AIM)
+    [5:61] données décodées   [63] bit 0 : le code continue dans le rapport suivant
+
+Scanners retenus : tout périphérique de la page d'usage POS, plus les couples
+VID:PID listés dans TRAIN_HID_SCANNERS (ex. "0c2e:0b61,05e0:1200") pour ceux qui
+ne la déclarent pas.
+"""
+import os
+import threading
+import time
+
+from traces import nouvelle_trace
+
+try:
+    import hid
+except ImportError:
+    hid = None
+
+PAGE_USAGE_POS = 0x8C
+ID_RAPPORT_SCAN = 0x02
+TAILLE_RAPPORT = 64
+DEBUT_DONNEES = 5
+TAILLE_DONNEES = 56
+RECONNECT_DELAY = 2.0
+
+
+def identifiants_configures(texte=None):
+    """ "0c2e:0b61,05e0:1200" -> {(0x0c2e, 0x0b61), (0x05e0, 0x1200)} ; ValueError si mal formé."""
+    texte = os.environ.get("TRAIN_HID_SCANNERS", "") if texte is None else texte
+    identifiants = set()
+    for couple in filter(None, (c.strip() for c in texte.split(","))):
+        vid, pid = couple.split(":")
+        identifiants.add((int(vid, 16), int(pid, 16)))
+    return identifiants
+
+def lister_scanners(identifiants=None):
+    """Périphériques HID à lire (dicts de hid.enumerate()), un par chemin. Vide sans hidapi."""
+    if hid is None:
+        return []
+    identifiants = identifiants_configures() if identifiants is None else identifiants
+    scanners = {}
+    for info in hid.enumerate():
+        if info.get("usage_page") == PAGE_USAGE_POS or (info["vendor_id"], info["product_id"]) in identifiants:
+            scanners.setdefault(info["path"], info)
+    return list(scanners.values())
+
+
+class DecodeurHidPos:
+    """Réassemble les rapports "Scanned Data" d'un scanner en codes-barres complets."""
+    def __init__(self):
+        self.morceaux = bytearray()
+
+    def ajouter(self, rapport):
+        """Retourne le code-barres quand il est complet, None sinon (autre rapport, code à suivre)."""
+        if len(rapport) < DEBUT_DONNEES or rapport[0] != ID_RAPPORT_SCAN:
+            return None
+        longueur = min(rapport[1], TAILLE_DONNEES)
+        self.morceaux += bytes(rapport[DEBUT_DONNEES:DEBUT_DONNEES + longueur])
+        if len(rapport) >= TAILLE_RAPPORT and rapport[TAILLE_RAPPORT - 1] & 0x01:
+            return None
+        code = self.morceaux.decode("utf-8", errors="ignore").strip("\x00\r\n\t ")
+        self.morceaux.clear()
+        return code or None
+
+
+def lire_scanner(info, device_id, transmettre):
+    """Thread d'un scanner : lecture bloquante des rapports, code complet -> transmettre(code, poste, trace)."""
+    nom = f"{info.get('product_string') or 'HID'} {info['vendor_id']:04x}:{info['product_id']:04x}"
+    print(f"[INFO] Thread zapette {device_id} démarré sur {nom} (HID-POS)")
+    while True:
+        try:
+            device = hid.device()
+            device.open_path(info["path"])
+            device.set_nonblocking(False)
+            print(f"[OPEN] {nom} ouvert (zapette {device_id})")
+            decodeur = DecodeurHidPos()
+            trace = None
+            try:
+                while True:
+                    rapport = device.read(TAILLE_RAPPORT)
+                    if not rapport:
+                        raise OSError("lecture vide (scanner débranché ?)")
+                    if trace is None:
+                        # Premier rapport du code-barres : début de la trace
+                        trace = nouvelle_trace()
+                    code = decodeur.ajouter(rapport)
+                    if code:
+                        transmettre(code, device_id, trace)
+                    if not decodeur.morceaux:
+                        trace = None
+            finally:
+                device.close()
+        except OSError as e:
+            # Débranché, ou ouverture refusée (droits sur /dev/hidraw*)
+            print(f"[⚠️] {nom} indisponible (zapette {device_id}) : {e}, nouvelle tentative dans {RECONNECT_DELAY}s")
+            time.sleep(RECONNECT_DELAY)
+        except Exception as e:
+            print(f"[EXC] Erreur lecture {nom} (zapette {device_id}): {e}")
+            time.sleep(RECONNECT_DELAY)
+
+def demarrer_lecteurs(premier_id, transmettre):
+    """Un thread par scanner HID-POS ; les numéros de zapette partent de premier_id."""
+    scanners = lister_scanners()
+    threads = []
+    for idx, info in enumerate(scanners, start=premier_id):
+        t = threading.Thread(target=lire_scanner, args=(info, idx, transmettre), daemon=True)
+        t.start()
+        threads.append(t)
+        print(f"[INFO] Zapette {idx} assignée au scanner HID {info['vendor_id']:04x}:{info['product_id']:04x}")
+    return threads
@@ -0,0 +1,185 @@
+"""
+Instrumentation du backend : latence par route HTTP et requêtes SQL par requête HTTP.
+
+- MiddlewareMetriques (ASGI pur, pas de BaseHTTPMiddleware) chronomètre chaque
+  requête HTTP et l'agrège par route (le modèle de chemin, pas l'URL brute).
+- Les évènements SQLAlchemy before/after_cursor_execute comptent les requêtes
+  SQL et leur durée ; elles sont rattachées à la requête HTTP en cours via une
+  ContextVar, ce qui fait apparaître les motifs N+1.
+- exporter_prometheus() produit le format texte Prometheus servi sur /metrics.
+- Si la variable d'environnement SQL_LENT_MS est définie, toute requête SQL plus
+  longue est journalisée (logging.warning).
+"""
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Bornes des histogrammes
+BUCKETS_DUREE = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKETS_NB_SQL = (1, 2, 5, 10, 20, 50, 100, 500)
+
+SEUIL_SQL_LENT = float(os.environ.get("SQL_LENT_MS", "0") or 0) / 1000
+
+# Statistiques SQL de la requête HTTP en cours : [nb_requetes, duree_totale]
+_sql_requete_courante: ContextVar = ContextVar("sql_requete_courante", default=None)
+
+
+class Histogramme:
+    """Histogramme cumulatif au sens Prometheus (buckets, somme, compteur)."""
+    def __init__(self, bornes):
+        self.bornes = bornes
+        self.buckets = [0] * len(bornes)
+        self.somme = 0.0
+        self.compte = 0
+
+    def observer(self, valeur):
+        for i, borne in enumerate(self.bornes):
+            if valeur <= borne:
+                self.buckets[i] += 1
+                break
+        self.somme += valeur
+        self.compte += 1
+
+    def lignes(self, nom, labels):
+        cumul = 0
+        for borne, n in zip(self.bornes, self.buckets):
+            cumul += n
+            yield f'{nom}_bucket{{{labels},le="{borne}"}} {cumul}'
+        yield f'{nom}_bucket{{{labels},le="+Inf"}} {self.compte}'
+        yield f"{nom}_sum{{{labels}}} {self.somme:.6f}"
+        yield f"{nom}_count{{{labels}}} {self.compte}"
+
+
+class RegistreMetriques:
+    """Stocke les métriques en mémoire (un verrou : les routes sync tournent dans un pool de threads)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.duree_http = {}     # (methode, route, statut) -> Histogramme
+            self.nb_sql_http = {}    # (methode, route) -> Histogramme
+            self.duree_sql_http = {} # (methode, route) -> secondes cumulées
+            self.sql_total = 0
+            self.sql_duree_totale = 0.0
+            self.sql_lentes = 0
+
+    def enregistrer_http(self, methode, route, statut, duree, nb_sql, duree_sql):
+        with self.lock:
+            cle = (methode, route, statut)
+            if cle not in self.duree_http:
+                self.duree_http[cle] = Histogramme(BUCKETS_DUREE)
+            self.duree_http[cle].observer(duree)
+
+            cle_sql = (methode, route)
+            if cle_sql not in self.nb_sql_http:
+                self.nb_sql_http[cle_sql] = Histogramme(BUCKETS_NB_SQL)
+            self.nb_sql_http[cle_sql].observer(nb_sql)
+            self.duree_sql_http[cle_sql] = self.duree_sql_http.get(cle_sql, 0.0) + duree_sql
+
+    def enregistrer_sql(self, duree, lente):
+        with self.lock:
+            self.sql_total += 1
+            self.sql_duree_totale += duree
+            if lente:
+                self.sql_lentes += 1
+
+registre = RegistreMetriques()
+
+
+# ---------- SQLALCHEMY ----------
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _avant_sql(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("debut_sql", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _apres_sql(conn, cursor, statement, parameters, context, executemany):
+    debuts = conn.info.get("debut_sql")
+    if not debuts:
+        return
+    duree = time.perf_counter() - debuts.pop()
+
+    courante = _sql_requete_courante.get()
+    if courante is not None:
+        courante[0] += 1
+        courante[1] += duree
+
+    lente = SEUIL_SQL_LENT > 0 and duree >= SEUIL_SQL_LENT
+    if lente:
+        logging.warning(f"[SQL LENT] {duree * 1000:.1f} ms : {statement}")
+    registre.enregistrer_sql(duree, lente)
+
+
+# ---------- HTTP ----------
+
+class MiddlewareMetriques:
+    """Middleware ASGI : mesure la latence par route et les requêtes SQL associées."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        statut = [500]
+
+        async def send_avec_statut(message):
+            if message["type"] == "http.response.start":
+                statut[0] = message["status"]
+            await send(message)
+
+        sql = [0, 0.0]
+        jeton = _sql_requete_courante.set(sql)
+        debut = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_avec_statut)
+        finally:
+            duree = time.perf_counter() - debut
+            _sql_requete_courante.reset(jeton)
+            # Modèle de chemin (ex : /api/commande/{id_commande}/statut) pour borner la cardinalité
+            route = getattr(scope.get("route"), "path", None) or "inconnue"
+            registre.enregistrer_http(scope["method"], route, statut[0], duree, sql[0], sql[1])
+
+
+def _echapper(valeur):
+    return str(valeur).replace("\\", "\\\\").replace('"', '\\"')
+
+def exporter_prometheus():
+    """Sérialise le registre au format texte d'exposition Prometheus (0.0.4)."""
+    lignes = []
+    with registre.lock:
+        lignes.append("# HELP train_http_duree_secondes Latence des requêtes HTTP par route.")
+        lignes.append("# TYPE train_http_duree_secondes histogram")
+        for (methode, route, statut), h in sorted(registre.duree_http.items()):
+            labels = f'methode="{methode}",route="{_echapper(route)}",statut="{statut}"'
+            lignes.extend(h.lignes("train_http_duree_secondes", labels))
+
+        lignes.append("# HELP train_http_requetes_sql Nombre de requêtes SQL exécutées par requête HTTP.")
+        lignes.append("# TYPE train_http_requetes_sql histogram")
+        for (methode, route), h in sorted(registre.nb_sql_http.items()):
+            labels = f'methode="{methode}",route="{_echapper(route)}"'
+            lignes.extend(h.lignes("train_http_requetes_sql", labels))
+
+        lignes.append("# HELP train_http_sql_duree_secondes_total Temps SQL cumulé par route.")
+        lignes.append("# TYPE train_http_sql_duree_secondes_total counter")
+        for (methode, route), total in sorted(registre.duree_sql_http.items()):
+            lignes.append(f'train_http_sql_duree_secondes_total{{methode="{methode}",route="{_echapper(route)}"}} {total:.6f}')
+
+        lignes.append("# HELP train_sql_requetes_total Nombre total de requêtes SQL.")
+        lignes.append("# TYPE train_sql_requetes_total counter")
+        lignes.append(f"train_sql_requetes_total {registre.sql_total}")
+        lignes.append("# HELP train_sql_duree_secondes_total Temps SQL total.")
+        lignes.append("# TYPE train_sql_duree_secondes_total counter")
+        lignes.append(f"train_sql_duree_secondes_total {registre.sql_duree_totale:.6f}")
+        lignes.append("# HELP train_sql_lentes_total Requêtes SQL au-delà du seuil SQL_LENT_MS.")
+        lignes.append("# TYPE train_sql_lentes_total counter")
+        lignes.append(f"train_sql_lentes_total {registre.sql_lentes}")
+    return "\n".join(lignes) + "\n"
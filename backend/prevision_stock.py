@@ -0,0 +1,147 @@
+"""
+Prévision des ruptures de stock des boîtes.
+
+Pour chaque (boîte, type de cycle), l'intervalle entre deux commandes est lissé
+par moyenne mobile exponentielle (EWMA). Le taux de consommation qui en découle,
+diminué de l'apport du simulateur (1 boîte toutes les `approvisionnement` secondes),
+donne le temps restant avant rupture du stock disponible (nbBoite moins les
+commandes encore à récupérer).
+
+L'état est reconstruit au démarrage sur JOURS_HISTORIQUE jours de commandes,
+puis mis à jour en O(1) à chaque scan (observer) : aucune relecture de l'historique.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+
+from database import Boite, Commande
+
+ALPHA = 0.3                 # Poids de la dernière observation dans l'EWMA
+INTERVALLE_MAX = 3600.0     # Un écart plus long (pause, nuit) est ramené à 1 h
+JOURS_HISTORIQUE = 7
+SEUIL_ALERTE_MINUTES = 15.0
+
+
+def estimer(intervalle, stock_disponible, approvisionnement, depuis_derniere=0.0):
+    """
+    Taux horaires et minutes avant rupture (None si le stock ne baisse pas).
+    Sans commande depuis plus longtemps que l'intervalle moyen, cet écart sert
+    d'intervalle : la prévision se détend quand la consommation s'arrête.
+    """
+    if intervalle:
+        intervalle = max(intervalle, depuis_derniere)
+    conso = 3600.0 / intervalle if intervalle else 0.0
+    appro = 3600.0 / approvisionnement if approvisionnement else 0.0
+    net = conso - appro
+
+    if stock_disponible <= 0 and conso > 0:
+        minutes = 0.0
+    elif net > 0:
+        minutes = stock_disponible / net * 60
+    else:
+        minutes = None
+    return {
+        "taux_horaire": round(conso, 3),
+        "appro_horaire": round(appro, 3),
+        "minutes_avant_rupture": round(minutes, 1) if minutes is not None else None,
+    }
+
+
+class PrevisionStock:
+    """État EWMA par (idBoite, type de cycle) ; un verrou car les routes sync tournent en threads."""
+    def __init__(self, alpha=ALPHA, seuil_minutes=SEUIL_ALERTE_MINUTES):
+        self.alpha = alpha
+        self.seuil_minutes = seuil_minutes
+        self.lock = threading.Lock()
+        self.etats = {}      # (idBoite, type) -> {"dernier": datetime, "intervalle": float | None, "n": int}
+        self.en_alerte = set()
+
+    def _mettre_a_jour(self, cle, date):
+        etat = self.etats.get(cle)
+        if etat is None:
+            self.etats[cle] = {"dernier": date, "intervalle": None, "n": 1}
+            return
+        ecart = min(max((date - etat["dernier"]).total_seconds(), 0.0), INTERVALLE_MAX)
+        if etat["intervalle"] is None:
+            etat["intervalle"] = ecart
+        else:
+            etat["intervalle"] = self.alpha * ecart + (1 - self.alpha) * etat["intervalle"]
+        etat["dernier"] = max(date, etat["dernier"])
+        etat["n"] += 1
+
+    def charger(self, db: Session, depuis=None):
+        """Reconstruit l'état à partir des commandes récentes (un seul parcours trié)."""
+        depuis = depuis or datetime.now() - timedelta(days=JOURS_HISTORIQUE)
+        commandes = db.query(Commande.idBoite, Commande.typeCommande, Commande.dateCommande).filter(
+            Commande.dateCommande >= depuis,
+            Commande.idBoite.isnot(None),
+        ).order_by(Commande.dateCommande)
+        with self.lock:
+            self.etats.clear()
+            self.en_alerte.clear()
+            for id_boite, type_cycle, date in commandes.yield_per(10_000):
+                self._mettre_a_jour((id_boite, type_cycle or "Normal"), date)
+        return len(self.etats)
+
+    def observer(self, id_boite, type_cycle, date, stock_disponible, approvisionnement, nouvelle_commande=True):
+        """
+        Intègre une nouvelle commande et réévalue la boîte. Retourne une alerte
+        (dict) quand la boîte passe sous le seuil, None sinon (une alerte par épisode).
+        Un scan regroupé dans une commande existante (nouvelle_commande=False) ne compte
+        pas dans l'intervalle, comme dans charger() qui relit une ligne par commande :
+        seule l'estimation est refaite avec le stock disponible à jour.
+        """
+        cle = (id_boite, type_cycle)
+        with self.lock:
+            if nouvelle_commande or cle not in self.etats:
+                self._mettre_a_jour(cle, date)
+            etat = self.etats[cle]
+            if etat["intervalle"] is None:
+                return None
+            estimation = estimer(etat["intervalle"], stock_disponible, approvisionnement)
+
+            minutes = estimation["minutes_avant_rupture"]
+            if minutes is None or minutes > self.seuil_minutes:
+                self.en_alerte.discard(cle)
+                return None
+            if cle in self.en_alerte:
+                return None
+            self.en_alerte.add(cle)
+        return {"idBoite": id_boite, "mode": type_cycle, "stock_disponible": stock_disponible, **estimation}
+
+    def previsions(self, db: Session, type_cycle="Normal", maintenant=None):
+        """Prévision de toutes les boîtes ayant un historique pour ce type de cycle, les plus urgentes d'abord."""
+        maintenant = maintenant or datetime.now()
+        with self.lock:
+            etats = {b: dict(e) for (b, t), e in self.etats.items() if t == type_cycle and e["intervalle"] is not None}
+        if not etats:
+            return []
+
+        en_attente = dict(db.query(Commande.idBoite, func.sum(Commande.quantite)).filter(
+            Commande.idBoite.in_(list(etats)),
+            Commande.statutCommande == "A récupérer",
+        ).group_by(Commande.idBoite).all())
+
+        resultat = []
+        for boite in db.query(Boite).options(joinedload(Boite.piece)).filter(Boite.idBoite.in_(list(etats))):
+            etat = etats[boite.idBoite]
+            disponible = (boite.nbBoite or 0) - en_attente.get(boite.idBoite, 0)
+            depuis = max((maintenant - etat["dernier"]).total_seconds(), 0.0)
+            estimation = estimer(etat["intervalle"], disponible, boite.approvisionnement, depuis)
+            minutes = estimation["minutes_avant_rupture"]
+            resultat.append({
+                "idBoite": boite.idBoite,
+                "code_barre": boite.code_barre,
+                "nom_piece": boite.piece.nomPiece if boite.piece else boite.code_barre,
+                "stock": boite.nbBoite,
+                "en_attente": en_attente.get(boite.idBoite, 0),
+                "stock_disponible": disponible,
+                **estimation,
+                "alerte": minutes is not None and minutes <= self.seuil_minutes,
+            })
+        resultat.sort(key=lambda p: (p["minutes_avant_rupture"] is None, p["minutes_avant_rupture"] or 0))
+        return resultat
+
+prevision = PrevisionStock()
@@ -0,0 +1,124 @@
+"""
+Tampon de relecture des diffusions WebSocket.
+
+Chaque diffusion porte un numéro de séquence croissant (compteur de l'état partagé,
+commun à tous les workers). Les derniers messages restent en mémoire dans un tampon
+circulaire de CAPACITE_MEMOIRE entrées ; les plus anciens sont déversés par lots dans
+la table ws_evenements de train.db (en JSON), qui en garde CAPACITE_DISQUE.
+ajouter() ne touche pas au disque : il renvoie le lot à déverser, que l'appelant écrit
+avec deverser() hors de la boucle d'évènements. En attendant, le lot reste relisible.
+
+Une tablette qui se reconnecte avec ?last_seq=N reçoit seulement les messages
+N+1.. qui la concernent. Si un numéro manque (trou trop ancien, redémarrage, base
+réinitialisée), depuis() renvoie None : le client doit tout recharger.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import database
+from encodage import MessageDiffuse
+
+CAPACITE_MEMOIRE = 1000   # Messages gardés en mémoire
+LOT_DEVERSEMENT = 250     # Messages déversés d'un coup quand le tampon est plein
+CAPACITE_DISQUE = 20_000  # Messages gardés dans ws_evenements
+
+_meta = MetaData()
+table_evenements = Table(
+    "ws_evenements", _meta,
+    Column("seq", Integer, primary_key=True, autoincrement=False),
+    Column("message", String, nullable=False),
+    Column("sujets", String),   # JSON
+)
+
+
+def premier_numero():
+    """Premier numéro d'un compteur neuf : l'heure en ms, toujours au-delà des numéros d'un lancement précédent."""
+    return int(time.time() * 1000)
+
+
+class TamponRelecture:
+    def __init__(self, capacite=CAPACITE_MEMOIRE, lot=LOT_DEVERSEMENT, capacite_disque=CAPACITE_DISQUE):
+        self.capacite = capacite
+        self.lot = lot
+        self.capacite_disque = capacite_disque
+        self.memoire = deque()   # (seq, MessageDiffuse, sujets), dans l'ordre d'arrivée
+        self.en_transit = {}     # seq -> entrée sortie de la mémoire, pas encore sur disque
+        self.verrou = threading.Lock()
+
+    def creer_table(self):
+        # Relu à chaque appel : utiliser_base() peut rediriger le moteur
+        _meta.create_all(database.engine)
+
+    def ajouter(self, seq, message, sujets=None):
+        """
+        Mémorise un message diffusé. Quand le tampon déborde, retourne le lot le plus
+        ancien à passer à deverser() (None sinon) ; il reste relisible jusque-là.
+        """
+        self.memoire.append((seq, message, sujets))
+        if len(self.memoire) <= self.capacite:
+            return None
+        lignes = [self.memoire.popleft() for _ in range(min(self.lot, len(self.memoire)))]
+        with self.verrou:
+            self.en_transit.update((ligne[0], ligne) for ligne in lignes)
+        return lignes
+
+    def deverser(self, lignes):
+        """Écrit un lot rendu par ajouter() dans ws_evenements (bloquant : à appeler dans un thread)."""
+        # INSERT OR IGNORE : avec plusieurs workers, chacun déverse les mêmes messages
+        with database.engine.begin() as conn:
+            conn.execute(
+                sqlite_insert(table_evenements).on_conflict_do_nothing(),
+                [{"seq": s, "message": m.encoder("json"), "sujets": json.dumps(j)} for s, m, j in lignes],
+            )
+            maximum = conn.execute(select(func.max(table_evenements.c.seq))).scalar()
+            conn.execute(delete(table_evenements).where(table_evenements.c.seq <= maximum - self.capacite_disque))
+        with self.verrou:
+            for seq, _, _ in lignes:
+                self.en_transit.pop(seq, None)
+
+    def _lire_disque(self, apres, avant):
+        e = table_evenements
+        with database.engine.connect() as conn:
+            lignes = conn.execute(
+                select(e.c.seq, e.c.message, e.c.sujets)
+                .where(e.c.seq > apres, e.c.seq < avant)
+                .order_by(e.c.seq)
+            ).all()
+        return [(s, MessageDiffuse.depuis_json(m), json.loads(j) if j else None) for s, m, j in lignes]
+
+    def depuis(self, last_seq, dernier):
+        """
+        Messages de numéro > last_seq, dans l'ordre, jusqu'à `dernier` (dernier numéro
+        attribué). None si la suite n'est pas complète : le client doit tout recharger.
+        Les messages encore en route vers ce worker (numéro attribué ailleurs) arriveront
+        en direct : seul un trou AVANT le dernier message connu force le rechargement.
+        """
+        if last_seq > dernier:
+            return None   # Compteur d'un autre lancement ou d'une autre base
+        with self.verrou:
+            en_memoire = list(self.en_transit.values()) + list(self.memoire)
+        memoire = sorted((e for e in en_memoire if e[0] > last_seq), key=lambda e: e[0])
+        plus_ancien = min((e[0] for e in en_memoire), default=dernier + 1)
+        manquants = memoire
+        if last_seq + 1 < plus_ancien:
+            manquants = self._lire_disque(last_seq, plus_ancien) + memoire
+        attendu = last_seq + 1
+        for seq, _, _ in manquants:
+            if seq != attendu:
+                return None
+            attendu += 1
+        if not manquants and last_seq < dernier and not en_memoire:
+            return None   # Rien en mémoire ni sur disque alors que des messages ont été émis
+        return manquants
+
+    def vider(self):
+        self.memoire.clear()
+        with self.verrou:
+            self.en_transit.clear()
+        with database.engine.begin() as conn:
+            conn.execute(delete(table_evenements))
@@ -1,9 +1,16 @@
 """
 Contient toutes les fonctions CRUD pour interagir avec la base SQLite via SQLAlchemy.
 """
-from database import SessionLocal, Stand, Piece, Boite, Case, Commande, Login, Train, Cycle
+from database import SessionLocal, Stand, Piece, Boite, Case, Commande, Login, Train, Cycle, AgregatCommandes, KpiCycle, ArchiveCycle, EmetteurScans
 from datetime import datetime, timezone
-from sqlalchemy import func
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+import agregats
+import archive
+import kpi
+from securite import hacher_mot_de_passe
+from stock import enregistrer_mouvement, enregistrer_mouvements, StockEpuise
 
 
 # ---------- TRAIN ----------
@@ -122,8 +129,11 @@ def create_boite(id_piece, code_barre, nbBoite, idMagasin=None):
     """
     db = SessionLocal()
     try:
-        boite = Boite(idPiece=id_piece, code_barre=code_barre, nbBoite=nbBoite, idMagasin=idMagasin)
+        boite = Boite(idPiece=id_piece, code_barre=code_barre, nbBoite=0, idMagasin=idMagasin)
         db.add(boite)
+        db.flush()
+        # Le stock initial entre dans le registre comme premier mouvement
+        enregistrer_mouvement(db, boite.idBoite, nbBoite, "creation")
         db.commit()
         db.refresh(boite)
         return boite
@@ -156,7 +166,8 @@ def incrementer_stock_global():
     """
     db = SessionLocal()
     try:
-        db.query(Boite).update({Boite.nbBoite: Boite.nbBoite + 1})
+        ids = [id_boite for (id_boite,) in db.query(Boite.idBoite)]
+        enregistrer_mouvements(db, [{"idBoite": i, "delta": 1, "motif": "approvisionnement"} for i in ids])
         db.commit()
         return True
     except Exception as e:
@@ -215,65 +226,284 @@ def supprimer_case(id_case):
 
 # ---------- COMMANDES ----------
 
+def _resume_commande(commande):
+    """Ce qu'il faut pour diffuser un changement de statut aux bons écrans."""
+    return {"idCommande": commande.idCommande, "idPoste": commande.idPoste,
+            "idMagasin": commande.idMagasin, "typeCommande": commande.typeCommande}
+
+def regrouper_commande(db, id_boite, id_poste, mode):
+    """
+    Ajoute une boîte à la commande encore "A récupérer" de cette boîte pour ce poste
+    (même mode), s'il y en a une. Un seul UPDATE conditionnel : si le train la prend
+    entre-temps, rien n'est modifié. Retourne (idCommande, quantite) ou None.
+    """
+    en_attente = select(func.min(Commande.idCommande)).where(
+        Commande.idBoite == id_boite,
+        Commande.idPoste == id_poste,
+        Commande.typeCommande == mode,
+        Commande.statutCommande == "A récupérer",
+    ).scalar_subquery()
+    ligne = db.execute(
+        update(Commande)
+        .where(Commande.idCommande == en_attente, Commande.statutCommande == "A récupérer")
+        .values(quantite=Commande.quantite + 1)
+        .returning(Commande.idCommande, Commande.quantite)
+        .execution_options(synchronize_session=False)
+    ).first()
+    return tuple(ligne) if ligne else None
+
 def supprimer_commande(id_commande):
     """
-    Annule une commande existante
+    Annule une commande existante. Retourne son résumé, ou False si elle n'existe pas.
     """
     db = SessionLocal()
     try:
         commande = db.query(Commande).filter(Commande.idCommande == id_commande).first()
         if not commande:
             return False
+        agregats.retirer_commandes(db, Commande.idCommande == id_commande)
         commande.statutCommande = "Annulée"
         commande.date_livraison = datetime.now()
+        resume = _resume_commande(commande)
         db.commit()
-        return True
+        return resume
     finally:
         db.close()
 
 def declarer_commande_manquante(id_commande):
     """
-    Marque une commande comme ayant un produit manquant
+    Marque une commande comme ayant un produit manquant. Retourne son résumé, ou False.
     """
     db = SessionLocal()
     try:
         commande = db.query(Commande).filter(Commande.idCommande == id_commande).first()
         if not commande:
             return False
+        agregats.retirer_commandes(db, Commande.idCommande == id_commande)
         commande.statutCommande = "Produit manquant"
         commande.date_livraison = datetime.now() 
+        resume = _resume_commande(commande)
         db.commit()
-        return True
+        kpi.en_cours.manquant(commande.typeCommande, commande.dateCommande, commande.idPoste, commande.idMagasin)
+        return resume
     finally:
         db.close()
         
+# Transitions du circuit : statut actuel -> (statut suivant, date horodatée)
+TRANSITIONS_STATUT = {
+    "A récupérer": ("A déposer", Commande.date_recuperation),
+    "A déposer": ("Commande finie", Commande.date_livraison),
+}
+
+def _scinder_recuperation(db, commande, quantite, emportees):
+    """
+    Récupération partielle d'une commande regroupée de `quantite` boîtes (sans commit) :
+    la commande ne garde que les `emportees` boîtes prises par le train, le reste repart
+    dans une nouvelle commande "A récupérer" du même poste, datée de la demande d'origine.
+    Retourne l'id de la nouvelle commande.
+    """
+    db.execute(
+        update(Commande).where(Commande.idCommande == commande.idCommande)
+        .values(quantite=emportees).execution_options(synchronize_session=False)
+    )
+    reste = Commande(idBoite=commande.idBoite, idMagasin=commande.idMagasin, idPoste=commande.idPoste,
+                     statutCommande="A récupérer", typeCommande=commande.typeCommande,
+                     dateCommande=commande.dateCommande, quantite=quantite - emportees)
+    db.add(reste)
+    db.flush()
+    return reste.idCommande
+
 def changer_statut_commande(id_commande):
     """
     Fait progresser le statut d'une commande (Récupération -> Dépôt -> Finie)
+    La transition est un UPDATE conditionnel sur le statut attendu : si deux
+    validations concurrentes arrivent, une seule fait avancer la commande et
+    décrémente le stock (de la quantité commandée). Si la boîte en contient moins,
+    le train emporte ce qu'il y a et le reste devient une nouvelle commande "A récupérer"
+    (résumé sous la clé "reste") ; la récupération échoue si la boîte est vide.
     """
     db = SessionLocal()
     try:
-        commande = db.query(Commande).filter(Commande.idCommande == id_commande).first()
+        commande = db.query(
+            Commande.idCommande, Commande.idBoite, Commande.statutCommande, Commande.typeCommande,
+            Commande.idPoste, Commande.idMagasin, Commande.dateCommande, Commande.date_recuperation,
+            Commande.quantite,
+        ).filter(Commande.idCommande == id_commande).first()
         if not commande:
             return {"status": "error", "message": "Commande introuvable"}
 
-        if commande.statutCommande == "A récupérer":
-            commande.statutCommande = "A déposer"
-            commande.date_recuperation = datetime.now() 
-            if commande.idBoite:
-                db.query(Boite).filter(Boite.idBoite == commande.idBoite).update(
-                    {Boite.nbBoite: Boite.nbBoite - 1}, 
-                    synchronize_session=False
-                )
-        elif commande.statutCommande == "A déposer":
-            commande.statutCommande = "Commande finie"
-            commande.date_livraison = datetime.now()
-        else:
+        if commande.statutCommande not in TRANSITIONS_STATUT:
             return {"status": "no_change", "message": f"Statut inchangé : {commande.statutCommande}"}
 
+        nouveau_statut, champ_date = TRANSITIONS_STATUT[commande.statutCommande]
+        maintenant = datetime.now()
+        maj = db.query(Commande).filter(
+            Commande.idCommande == id_commande,
+            Commande.statutCommande == commande.statutCommande,
+        ).update({Commande.statutCommande: nouveau_statut, champ_date: maintenant}, synchronize_session=False)
+        if not maj:
+            db.rollback()
+            return {"status": "no_change", "message": "Statut déjà modifié par une autre requête"}
+
+        if nouveau_statut == "Commande finie":
+            agregats.ajouter_commandes(db, Commande.idCommande == id_commande)
+
+        quantite, reste = commande.quantite or 1, None
+        if commande.statutCommande == "A récupérer" and commande.idBoite:
+            disponible = db.query(Boite.nbBoite).filter(Boite.idBoite == commande.idBoite).scalar() or 0
+            if 0 < disponible < quantite:
+                reste = _scinder_recuperation(db, commande, quantite, disponible)
+                quantite = disponible
+            try:
+                enregistrer_mouvement(db, commande.idBoite, -quantite, "recuperation", commande.idCommande)
+            except StockEpuise as e:
+                db.rollback()
+                return {"status": "stock_epuise", "message": str(e)}
+
         db.commit()
-        db.refresh(commande)
-        return {"status": "ok", "message": "OK", "commande": {"idCommande": commande.idCommande, "nouveau_statut": commande.statutCommande}}
+
+        # KPI du cycle en cours, mis à jour sans relire les commandes
+        cle_kpi = (commande.typeCommande, commande.dateCommande, commande.idPoste, commande.idMagasin)
+        if commande.statutCommande == "A récupérer" and commande.dateCommande:
+            kpi.en_cours.recuperation(*cle_kpi, (maintenant - commande.dateCommande).total_seconds())
+        elif nouveau_statut == "Commande finie" and commande.date_recuperation:
+            kpi.en_cours.livraison(*cle_kpi, (maintenant - commande.date_recuperation).total_seconds())
+        if reste:
+            kpi.en_cours.commande(*cle_kpi)
+        if reste:
+            reste = {**_resume_commande(commande), "idCommande": reste}
+        return {"status": "ok", "message": "OK", "reste": reste,
+                "commande": {**_resume_commande(commande), "nouveau_statut": nouveau_statut, "quantite": quantite}}
+    finally:
+        db.close()
+
+def _dans_le_stock(ids, commandes, plafonds):
+    """
+    Récupérations d'un lot qui tiennent dans le stock : pour une boîte plafonnée
+    (stock insuffisant lors d'un essai précédent), ses commandes sont prises par ordre
+    d'id tant que le stock suffit ; la première qui dépasse n'emporte que le reste du
+    stock, les suivantes attendent. Retourne (ids gardés, {id: boîtes emportées} des
+    récupérations partielles).
+    """
+    restant = dict(plafonds)
+    gardes, partielles = [], {}
+    for i in sorted(ids):
+        id_boite = commandes[i].idBoite
+        if id_boite in restant:
+            quantite = commandes[i].quantite or 1
+            if not restant[id_boite]:
+                continue
+            if quantite > restant[id_boite]:
+                partielles[i] = restant[id_boite]
+                quantite = restant[id_boite]
+            restant[id_boite] -= quantite
+        gardes.append(i)
+    return gardes, partielles
+
+def _avancer_lot(db, commandes, plafonds, maintenant):
+    """
+    Transitions et sorties de stock d'un lot (sans commit) : un UPDATE conditionnel par
+    statut de départ, un seul appel à enregistrer_mouvements pour les récupérations.
+    Retourne ([(commande, nouveau_statut, quantite)] des commandes effectivement avancées,
+    {id récupérée en partie: id de la commande créée pour le reste}).
+    """
+    avancees, restes = [], {}
+    for statut, (nouveau_statut, champ_date) in TRANSITIONS_STATUT.items():
+        ids = [c.idCommande for c in commandes.values() if c.statutCommande == statut]
+        partielles = {}
+        if statut == "A récupérer":
+            ids, partielles = _dans_le_stock(ids, commandes, plafonds)
+        if not ids:
+            continue
+        quantites = dict(db.execute(
+            update(Commande)
+            .where(Commande.idCommande.in_(ids), Commande.statutCommande == statut)
+            .values({Commande.statutCommande: nouveau_statut, champ_date: maintenant})
+            .returning(Commande.idCommande, Commande.quantite)
+            .execution_options(synchronize_session=False)
+        ).all())
+        if not quantites:
+            continue
+        for i in partielles.keys() & quantites.keys():
+            restes[i] = _scinder_recuperation(db, commandes[i], quantites[i] or 1, partielles[i])
+            quantites[i] = partielles[i]
+        if nouveau_statut == "Commande finie":
+            agregats.ajouter_commandes(db, Commande.idCommande.in_(list(quantites)))
+        if statut == "A récupérer":
+            enregistrer_mouvements(db, [
+                {"idBoite": commandes[i].idBoite, "delta": -(q or 1), "motif": "recuperation", "idCommande": i}
+                for i, q in quantites.items() if commandes[i].idBoite
+            ], date=maintenant)
+        avancees += [(commandes[i], nouveau_statut, q) for i, q in quantites.items()]
+    return avancees, restes
+
+def changer_statuts_commandes(ids=None, id_magasin=None, mode="Normal"):
+    """
+    Fait progresser d'un cran plusieurs commandes en une transaction (arrêt du train) :
+    celles de `ids`, ou toutes les commandes à récupérer au magasin `id_magasin`.
+    Mêmes règles que changer_statut_commande, commande par commande : une commande
+    introuvable ou déjà avancée est rejetée sans bloquer les autres ; si une boîte ne
+    suffit pas à toutes ses récupérations, les premières (par id) passent dans la limite du stock.
+    Retourne {"commandes": [résumé + nouveau_statut + quantite], "rejets": [{idCommande, status, message}],
+    "restes": [résumés des commandes créées par les récupérations partielles]}.
+    """
+    db = SessionLocal()
+    try:
+        requete = db.query(
+            Commande.idCommande, Commande.idBoite, Commande.statutCommande, Commande.typeCommande,
+            Commande.idPoste, Commande.idMagasin, Commande.dateCommande, Commande.date_recuperation,
+            Commande.quantite,
+        )
+        if ids is not None:
+            requete = requete.filter(Commande.idCommande.in_(ids))
+        else:
+            requete = requete.filter(
+                Commande.idMagasin == id_magasin,
+                Commande.typeCommande == mode,
+                Commande.statutCommande == "A récupérer",
+            )
+        commandes = {c.idCommande: c for c in requete.all()}
+        rejets = [{"idCommande": i, "status": "error", "message": "Commande introuvable"}
+                  for i in dict.fromkeys(ids or []) if i not in commandes]
+
+        # Stock insuffisant : la transaction est annulée et rejouée en ne prenant, pour cette
+        # boîte, que les récupérations couvertes par son stock (les dépôts ne sont pas touchés)
+        plafonds, epuisees = {}, {}
+        maintenant = datetime.now()
+        while True:
+            try:
+                avancees, restes = _avancer_lot(db, commandes, plafonds, maintenant)
+                db.commit()
+                break
+            except StockEpuise as e:
+                db.rollback()
+                plafonds[e.id_boite] = db.query(Boite.nbBoite).filter(Boite.idBoite == e.id_boite).scalar() or 0
+                epuisees[e.id_boite] = str(e)
+
+        ids_avancees = {c.idCommande for c, _, _ in avancees}
+        for c in commandes.values():
+            if c.idCommande in ids_avancees:
+                continue
+            if c.statutCommande == "A récupérer" and c.idBoite in epuisees:
+                rejets.append({"idCommande": c.idCommande, "status": "stock_epuise", "message": epuisees[c.idBoite]})
+            else:
+                rejets.append({"idCommande": c.idCommande, "status": "no_change", "message": f"Statut inchangé : {c.statutCommande}"})
+
+        # KPI du cycle en cours, comme pour une commande seule
+        for c, nouveau_statut, quantite in avancees:
+            cle_kpi = (c.typeCommande, c.dateCommande, c.idPoste, c.idMagasin)
+            if c.statutCommande == "A récupérer" and c.dateCommande:
+                kpi.en_cours.recuperation(*cle_kpi, (maintenant - c.dateCommande).total_seconds())
+            elif nouveau_statut == "Commande finie" and c.date_recuperation:
+                kpi.en_cours.livraison(*cle_kpi, (maintenant - c.date_recuperation).total_seconds())
+            if c.idCommande in restes:
+                kpi.en_cours.commande(*cle_kpi)
+        return {
+            "commandes": [{**_resume_commande(c), "nouveau_statut": n, "quantite": q} for c, n, q in avancees],
+            "rejets": rejets,
+            "restes": [{**_resume_commande(c), "idCommande": restes[c.idCommande]}
+                       for c, _, _ in avancees if c.idCommande in restes],
+        }
     finally:
         db.close()
 
@@ -333,14 +563,52 @@ def get_commandes_en_cours(mode="Normal"):
     finally:
         db.close()
 
+# ---------- INGESTION ----------
+
+def ouvrir_emetteur(id_emetteur):
+    """
+    Enregistre un canal d'ingestion s'il est nouveau ; retourne le dernier numéro de scan
+    déjà enregistré pour lui (l'émetteur ne renverra que les suivants).
+    """
+    db = SessionLocal()
+    try:
+        db.execute(sqlite_insert(EmetteurScans).values(idEmetteur=id_emetteur, dernier_seq=0).on_conflict_do_nothing())
+        db.commit()
+        return db.query(EmetteurScans.dernier_seq).filter(EmetteurScans.idEmetteur == id_emetteur).scalar()
+    finally:
+        db.close()
+
+def avancer_emetteur(db, id_emetteur, seq):
+    """
+    Passe le dernier numéro de l'émetteur à `seq` dans la transaction du scan (sans commit).
+    False si ce numéro est déjà enregistré : c'est un renvoi, le scan ne doit pas être rejoué.
+    """
+    return db.execute(
+        update(EmetteurScans)
+        .where(EmetteurScans.idEmetteur == id_emetteur, EmetteurScans.dernier_seq < seq)
+        .values(dernier_seq=seq, date_maj=datetime.now())
+    ).rowcount == 1
+
+def noter_emetteur(id_emetteur, seq):
+    """
+    Avance le dernier numéro de l'émetteur dans sa propre transaction : pour les scans
+    accusés sans rien écrire (doublon, rejet), qui ne doivent pas être renvoyés non plus.
+    """
+    db = SessionLocal()
+    try:
+        avancer_emetteur(db, id_emetteur, seq)
+        db.commit()
+    finally:
+        db.close()
+
 # ---------- LOGIN ----------
 def create_user(username, password, email):
     """
-    Crée un nouvel utilisateur pour l'interface
+    Crée un nouvel utilisateur pour l'interface (mot de passe stocké haché)
     """
     db = SessionLocal()
     try:
-        user = Login(username=username, password=password, email=email)
+        user = Login(username=username, password=hacher_mot_de_passe(password), email=email)
         db.add(user)
         db.commit()
         db.refresh(user)
@@ -369,62 +637,72 @@ def get_all_users():
         db.close()
 
 # ---------- STATS ----------
+def _quantites_par_nom_piece(db, debut, fin, axe):
+    """Quantités livrées par (stand, nom de pièce), à partir des agrégats (voir agregats.py)."""
+    quantites = agregats.quantites_par_piece(db, debut, fin, axe)
+    ids_pieces = {id_piece for _, id_piece in quantites}
+    noms = dict(db.query(Piece.idPiece, Piece.nomPiece).filter(Piece.idPiece.in_(ids_pieces))) if ids_pieces else {}
+
+    par_nom = {}
+    for (id_stand, id_piece), q in quantites.items():
+        if id_piece in noms:
+            cle = (id_stand, noms[id_piece])
+            par_nom[cle] = par_nom.get(cle, 0) + q
+    return par_nom
+
 def get_pieces_arrivees_postes(debut, fin):
     """
     Récupère les statistiques des pièces livrées aux postes sur une période
+    (quantités livrées, lues dans les agrégats horaires et journaliers)
     """
     db = SessionLocal()
     try:
-        result = (
-            db.query(
-                Commande.idPoste,
-                Piece.nomPiece, 
-                func.sum(Boite.nbBoite).label("quantite")
-            )
-            .join(Boite, Boite.idBoite == Commande.idBoite)
-            .join(Piece, Piece.idPiece == Boite.idPiece)
-            .filter(
-                Commande.statutCommande == "Commande finie",
-                Commande.dateCommande >= debut,
-                Commande.dateCommande <= fin
-            )
-            .group_by(Commande.idPoste, Piece.nomPiece)
-            .all()
-        )
-        return [{"idPoste": r.idPoste, "nomPiece": r.nomPiece, "quantite": r.quantite} for r in result]
+        quantites = _quantites_par_nom_piece(db, debut, fin, "poste")
+        return [{"idPoste": poste, "nomPiece": nom, "quantite": q} for (poste, nom), q in quantites.items()]
     finally:
         db.close()
 
 def get_boites_recuperees_magasins(debut, fin):
     """
     Récupère les statistiques des boîtes sorties des magasins sur une période
+    (quantités livrées, lues dans les agrégats horaires et journaliers)
     """
     db = SessionLocal()
     try:
-        result = (
-            db.query(
-                Commande.idMagasin,          
-                Piece.nomPiece,             
-                func.sum(Boite.nbBoite).label("quantite") 
-            )
-            .join(Boite, Boite.idBoite == Commande.idBoite)
-            .join(Piece, Piece.idPiece == Boite.idPiece)
-            .filter(
-                Commande.statutCommande == "Commande finie",
-                Commande.dateCommande >= debut,
-                Commande.dateCommande <= fin
-            )
-            .group_by(Commande.idMagasin, Piece.nomPiece)
-            .all()
-        )
-        return [{"idMagasin": r.idMagasin, "nomPiece": r.nomPiece, "quantite": r.quantite} for r in result]
+        quantites = _quantites_par_nom_piece(db, debut, fin, "magasin")
+        return [{"idMagasin": magasin, "nomPiece": nom, "quantite": q} for (magasin, nom), q in quantites.items()]
     finally:
         db.close()
 
 # ---------- LOGS ----------
+def _requete_logs(commandes, mode, debut, fin):
+    """
+    Commandes d'un mode entre deux dates avec les noms utiles aux logs.
+    `commandes` est la table principale ou sa copie d'archive (voir archive.py).
+    """
+    poste, magasin = aliased(Stand), aliased(Stand)
+    return select(
+        commandes.c.dateCommande, commandes.c.date_recuperation, commandes.c.date_livraison,
+        commandes.c.statutCommande, commandes.c.quantite, Boite.idBoite, Boite.code_barre, Piece.nomPiece,
+        poste.nomStand.label("poste_nom"), magasin.nomStand.label("mag_nom"),
+    ).select_from(commandes).outerjoin(
+        Boite, Boite.idBoite == commandes.c.idBoite
+    ).outerjoin(
+        Piece, Piece.idPiece == Boite.idPiece
+    ).outerjoin(
+        poste, poste.idStand == commandes.c.idPoste
+    ).outerjoin(
+        magasin, magasin.idStand == commandes.c.idMagasin
+    ).where(
+        commandes.c.typeCommande == mode,
+        commandes.c.dateCommande >= debut,
+        commandes.c.dateCommande <= fin,
+    )
+
 def get_commandes_cycle_logs(debut_cycle: datetime, mode="Normal"):
     """
     Génère les logs textuels d'activité pour un cycle spécifique
+    (lus dans le fichier d'archive si le cycle a été archivé)
     """
     db = SessionLocal()
     try:
@@ -434,7 +712,7 @@ def get_commandes_cycle_logs(debut_cycle: datetime, mode="Normal"):
         cycle = db.query(Cycle).filter(
             func.strftime('%Y-%m-%d %H:%M:%S', Cycle.date_debut) == target_id_str,
             Cycle.type_cycle == mode
-        ).first()
+        ).first() or archive.trouver_cycle(db, debut_cycle, mode)
         
         if not cycle:
             return [f"Cycle introuvable : {target_id_str}"]
@@ -443,48 +721,47 @@ def get_commandes_cycle_logs(debut_cycle: datetime, mode="Normal"):
         fin_safe = (cycle.date_fin or datetime.now()).replace(tzinfo=None)
 
         # On récupère les commandes du mode en question dans cette tranche horaire
-        all_commandes = db.query(Commande).filter(
-            Commande.typeCommande == mode
-        ).order_by(Commande.dateCommande.desc()).all()
+        lignes = db.execute(_requete_logs(Commande.__table__, mode, debut_safe, fin_safe)).all()
+        if isinstance(cycle, ArchiveCycle):
+            lignes += archive.lire(cycle.fichier, _requete_logs(archive.commandes_archive, mode, debut_safe, fin_safe))
         
         logs_events = []
         # On définit le petit suffixe si c'est personnalisé
         suffixe = " (Personnalisé)" if mode == "Personnalisé" else ""
         
-        for c in all_commandes:
-            if not c.dateCommande: continue
+        for c in lignes:
             c_date = c.dateCommande.replace(tzinfo=None)
+            nom_piece = "Inconnu"
+            if c.idBoite:
+                nom_piece = c.nomPiece or c.code_barre or "Boîte"
+            if (c.quantite or 1) > 1:
+                nom_piece = f"{nom_piece} x{c.quantite}"
             
-            if debut_safe <= c_date <= fin_safe:
-                nom_piece = "Inconnu"
-                if c.boite:
-                    nom_piece = c.boite.piece.nomPiece if c.boite.piece else (c.boite.code_barre or "Boîte")
-                
-                poste_nom = c.poste.nomStand if c.poste else "?"
-                mag_nom = c.magasin.nomStand if c.magasin else "?"
+            poste_nom = c.poste_nom or "?"
+            mag_nom = c.mag_nom or "?"
+
+            # On ajoute le suffixe à la fin de chaque message
+            logs_events.append({
+                "time": c_date,
+                "msg": f"[{c_date.strftime('%H:%M:%S')}] Demande : {nom_piece} (par {poste_nom}){suffixe}"
+            })
 
-                # On ajoute le suffixe à la fin de chaque message
+            if c.date_recuperation:
+                r_date = c.date_recuperation.replace(tzinfo=None)
                 logs_events.append({
-                    "time": c_date,
-                    "msg": f"[{c_date.strftime('%H:%M:%S')}] Demande : {nom_piece} (par {poste_nom}){suffixe}"
+                    "time": r_date,
+                    "msg": f"[{r_date.strftime('%H:%M:%S')}] Retrait : {nom_piece} (au {mag_nom}){suffixe}"
                 })
 
-                if c.date_recuperation:
-                    r_date = c.date_recuperation.replace(tzinfo=None)
-                    logs_events.append({
-                        "time": r_date,
-                        "msg": f"[{r_date.strftime('%H:%M:%S')}] Retrait : {nom_piece} (au {mag_nom}){suffixe}"
-                    })
-
-                if c.date_livraison:
-                    l_date = c.date_livraison.replace(tzinfo=None)
-                    statut_label = "Annulé" if c.statutCommande == "Annulée" else "Livré"
-                    lieu = f" (au {poste_nom})" if statut_label == "Livré" else ""
-                    
-                    logs_events.append({
-                        "time": l_date,
-                        "msg": f"[{l_date.strftime('%H:%M:%S')}] {statut_label} : {nom_piece}{lieu}{suffixe}"
-                    })
+            if c.date_livraison:
+                l_date = c.date_livraison.replace(tzinfo=None)
+                statut_label = "Annulé" if c.statutCommande == "Annulée" else "Livré"
+                lieu = f" (au {poste_nom})" if statut_label == "Livré" else ""
+                
+                logs_events.append({
+                    "time": l_date,
+                    "msg": f"[{l_date.strftime('%H:%M:%S')}] {statut_label} : {nom_piece}{lieu}{suffixe}"
+                })
 
         logs_events.sort(key=lambda x: x["time"], reverse=True)
         final_logs = [e["msg"] for e in logs_events]
@@ -500,6 +777,7 @@ def get_commandes_cycle_logs(debut_cycle: datetime, mode="Normal"):
 def get_commandes_cycle(debut_cycle: datetime, mode="Normal"):
     """
     Récupère les commandes terminées durant un cycle précis
+    (objets détachés reconstruits depuis l'archive si le cycle a été archivé)
     """
     db = SessionLocal()
     try:
@@ -513,7 +791,17 @@ def get_commandes_cycle(debut_cycle: datetime, mode="Normal"):
         ).first()
         
         if not cycle:
-            return []
+            entree = archive.trouver_cycle(db, debut_cycle, mode)
+            if not entree:
+                return []
+            commandes = archive.commandes_archive
+            lignes = archive.lire(entree.fichier, select(commandes).where(
+                commandes.c.typeCommande == mode,
+                commandes.c.statutCommande == "Commande finie",
+                commandes.c.dateCommande >= entree.date_debut,
+                commandes.c.dateCommande <= entree.date_fin,
+            ).order_by(commandes.c.dateCommande.asc()))
+            return [Commande(**ligne._mapping) for ligne in lignes]
 
         fin_cycle = cycle.date_fin or datetime.now(timezone.utc)
 
@@ -526,12 +814,53 @@ def get_commandes_cycle(debut_cycle: datetime, mode="Normal"):
     finally:
         db.close()
 
-def get_all_cycles(mode="Normal"):
-    """Récupère tous les cycles filtrés par mode"""
+def get_commandes_archivees(mode="Normal", debut_cycle=None):
+    """
+    Commandes des cycles archivés d'un mode (ou du seul cycle commencé à `debut_cycle`),
+    relues dans leurs fichiers mensuels : [(entrée ArchiveCycle, ligne)]. Chaque ligne a
+    les colonnes de la commande, plus nomPiece et code_barre. Un fichier est lu une fois.
+    """
+    db = SessionLocal()
+    try:
+        if debut_cycle is not None:
+            entree = archive.trouver_cycle(db, debut_cycle, mode)
+            entrees = [entree] if entree else []
+        else:
+            entrees = db.query(ArchiveCycle).filter(ArchiveCycle.type_cycle == mode).all()
+    finally:
+        db.close()
+
+    par_fichier = {}
+    for entree in entrees:
+        par_fichier.setdefault(entree.fichier, []).append(entree)
+
+    commandes = archive.commandes_archive
+    resultat = []
+    for fichier, liste in par_fichier.items():
+        lignes = archive.lire(fichier, select(commandes, Piece.nomPiece, Boite.code_barre).select_from(commandes).outerjoin(
+            Boite, Boite.idBoite == commandes.c.idBoite
+        ).outerjoin(
+            Piece, Piece.idPiece == Boite.idPiece
+        ).where(
+            commandes.c.typeCommande == mode,
+            commandes.c.dateCommande >= min(e.date_debut for e in liste),
+            commandes.c.dateCommande <= max(e.date_fin for e in liste),
+        ))
+        for ligne in lignes:
+            entree = next((e for e in liste if e.date_debut <= ligne.dateCommande <= e.date_fin), None)
+            if entree:
+                resultat.append((entree, ligne))
+    return resultat
+
+def get_all_cycles(mode="Normal", limite=None):
+    """Récupère tous les cycles filtrés par mode, archivés compris (du plus récent au plus ancien)"""
     db = SessionLocal()
     try:
         # On filtre par type_cycle
-        return db.query(Cycle).filter(Cycle.type_cycle == mode).order_by(Cycle.date_debut.desc()).all()
+        cycles = db.query(Cycle).filter(Cycle.type_cycle == mode).order_by(Cycle.date_debut.desc()).limit(limite).all()
+        archives = db.query(ArchiveCycle).filter(ArchiveCycle.type_cycle == mode).order_by(ArchiveCycle.date_debut.desc()).limit(limite).all()
+        tous = sorted(cycles + archives, key=lambda c: c.date_debut, reverse=True)
+        return tous[:limite] if limite else tous
     finally:
         db.close()
 
@@ -574,10 +903,16 @@ def clear_production_data():
     db = SessionLocal()
     try:
         db.query(Case).delete()
+        db.query(AgregatCommandes).delete()
         db.query(Commande).delete()
+        db.query(KpiCycle).delete()
         db.query(Cycle).delete()
+        archive.supprimer_archives(db)
         
         db.commit()
+        # Fichiers effacés seulement une fois le vidage validé : un échec les laisse intacts
+        archive.supprimer_fichiers()
+        kpi.en_cours.charger(db)
         return True
     except Exception as e:
         print(f"Erreur lors du vidage des tables : {e}")
@@ -627,6 +962,7 @@ def creer_commande_personnalisee(id_boite, id_poste, statut="A récupérer"):
         db.add(nouvelle_commande)
         db.commit()
         db.refresh(nouvelle_commande)
+        kpi.en_cours.commande("Personnalisé", nouvelle_commande.dateCommande, id_poste, boite.idMagasin)
         return nouvelle_commande
     finally:
         db.close()
@@ -635,6 +971,7 @@ def supprimer_commandes_personnalisees():
     db = SessionLocal()
     try:
         # On supprime uniquement les commandes marquées "Personnalisé"
+        agregats.retirer_commandes(db, Commande.typeCommande == "Personnalisé")
         db.query(Commande).filter(Commande.typeCommande == "Personnalisé").delete()
         db.commit()
         return True
@@ -0,0 +1,209 @@
+"""
+Authentification de l'espace d'administration.
+
+- Mots de passe stockés hachés avec scrypt (hashlib), sel aléatoire par utilisateur,
+  au format "scrypt$n$r$p$sel$empreinte" (base64). migrer_mots_de_passe() hache au
+  démarrage les mots de passe encore en clair des anciennes bases.
+- La vérification (scrypt coûte ~16 Mo et quelques dizaines de ms) tourne dans un
+  pool de threads borné : la boucle d'évènements n'est jamais bloquée et une rafale
+  de tablettes ne peut pas épuiser la mémoire. Un succès récent est mis en cache
+  (clé HMAC du mot de passe, jamais le mot de passe lui-même) pour les reconnexions.
+- Une connexion réussie renvoie un jeton de session signé (HMAC-SHA256, expiration
+  incluse) : les pages d'admin le présentent au lieu de se réauthentifier en base.
+- Un limiteur par IP (seau à jetons) borne le coût d'une attaque par force brute : seuls
+  les échecs consomment des jetons, une tablette qui se reconnecte n'est jamais bloquée.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import BASE_DIR, SessionLocal, Login
+
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+TAILLE_SEL = 16
+DUREE_JETON = 8 * 3600           # Secondes
+DUREE_CACHE = 300                # Secondes pendant lesquelles un succès évite scrypt
+TENTATIVES_MAX = 10              # Rafale d'échecs autorisée par IP
+RECHARGE_PAR_SECONDE = 1 / 6     # Puis un échec toutes les 6 s
+FICHIER_SECRET = os.path.join(BASE_DIR, "secret_session.key")
+
+# Pool dédié : au plus 4 calculs scrypt simultanés (4 x 16 Mo)
+pool_verification = ThreadPoolExecutor(max_workers=4, thread_name_prefix="scrypt")
+
+
+def _b64(donnees: bytes):
+    return base64.urlsafe_b64encode(donnees).rstrip(b"=").decode()
+
+def _deb64(texte: str):
+    return base64.urlsafe_b64decode(texte + "=" * (-len(texte) % 4))
+
+def _charger_secret():
+    """
+    Clé de signature des jetons : TRAIN_SECRET si défini, sinon un fichier créé au
+    premier lancement (partagé par tous les workers, survit aux redémarrages).
+    """
+    if os.environ.get("TRAIN_SECRET"):
+        return os.environ["TRAIN_SECRET"].encode()
+    try:
+        fd = os.open(FICHIER_SECRET, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        pass
+    with open(FICHIER_SECRET) as f:
+        return f.read().strip().encode()
+
+SECRET = _charger_secret()
+
+
+# ---------- MOTS DE PASSE ----------
+
+def hacher_mot_de_passe(mot_de_passe: str):
+    sel = secrets.token_bytes(TAILLE_SEL)
+    empreinte = hashlib.scrypt(mot_de_passe.encode(), salt=sel, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(sel)}${_b64(empreinte)}"
+
+def est_hache(stocke):
+    return bool(stocke) and stocke.startswith("scrypt$")
+
+def verifier_mot_de_passe(mot_de_passe: str, stocke: str):
+    """Compare en temps constant ; un format inconnu (mot de passe en clair) est refusé."""
+    if not est_hache(stocke):
+        return False
+    try:
+        _, n, r, p, sel, empreinte = stocke.split("$")
+        calcule = hashlib.scrypt(mot_de_passe.encode(), salt=_deb64(sel), n=int(n), r=int(r), p=int(p),
+                                 dklen=len(_deb64(empreinte)))
+    except ValueError:
+        return False
+    return hmac.compare_digest(calcule, _deb64(empreinte))
+
+# Vérifié quand l'utilisateur n'existe pas : même durée de réponse, pas d'énumération des comptes
+_HASH_LEURRE = hacher_mot_de_passe(secrets.token_hex(8))
+
+def migrer_mots_de_passe(db):
+    """Hache les mots de passe encore stockés en clair (sans commit). Retourne le nombre migré."""
+    nb = 0
+    for user in db.query(Login).all():
+        if user.password is not None and not est_hache(user.password):
+            user.password = hacher_mot_de_passe(user.password)
+            nb += 1
+    return nb
+
+
+class CacheVerifications:
+    """Succès récents : (utilisateur, HMAC du mot de passe) -> (expiration, hash stocké)."""
+    def __init__(self, duree=DUREE_CACHE):
+        self.duree = duree
+        self.lock = threading.Lock()
+        self.entrees = {}
+
+    def _cle(self, username, mot_de_passe):
+        return username, hmac.new(SECRET, mot_de_passe.encode(), hashlib.sha256).digest()
+
+    def valide(self, username, mot_de_passe, stocke):
+        with self.lock:
+            entree = self.entrees.get(self._cle(username, mot_de_passe))
+        # Un changement de mot de passe (hash stocké différent) invalide l'entrée
+        return entree is not None and entree[0] > time.monotonic() and entree[1] == stocke
+
+    def ajouter(self, username, mot_de_passe, stocke):
+        with self.lock:
+            maintenant = time.monotonic()
+            if len(self.entrees) > 1000:
+                self.entrees = {k: v for k, v in self.entrees.items() if v[0] > maintenant}
+            self.entrees[self._cle(username, mot_de_passe)] = (maintenant + self.duree, stocke)
+
+    def vider(self):
+        with self.lock:
+            self.entrees.clear()
+
+cache_verifications = CacheVerifications()
+
+def authentifier(username: str, mot_de_passe: str):
+    """Vérifie des identifiants (à appeler dans pool_verification). Retourne True/False."""
+    db = SessionLocal()
+    try:
+        stocke = db.query(Login.password).filter(Login.username == username).scalar()
+    finally:
+        db.close()
+    if stocke is not None and cache_verifications.valide(username, mot_de_passe, stocke):
+        return True
+    ok = verifier_mot_de_passe(mot_de_passe, stocke if stocke is not None else _HASH_LEURRE)
+    if ok and stocke is not None:
+        cache_verifications.ajouter(username, mot_de_passe, stocke)
+        return True
+    return False
+
+
+# ---------- JETONS DE SESSION ----------
+
+def creer_jeton(username: str, duree=DUREE_JETON):
+    """Jeton "charge.signature" : charge = {"sub", "exp"} en base64, signature HMAC-SHA256."""
+    charge = _b64(json.dumps({"sub": username, "exp": int(time.time()) + duree}, separators=(",", ":")).encode())
+    signature = _b64(hmac.new(SECRET, charge.encode(), hashlib.sha256).digest())
+    return f"{charge}.{signature}"
+
+def verifier_jeton(jeton: str):
+    """Contenu du jeton s'il est bien signé et non expiré, None sinon."""
+    try:
+        charge, signature = jeton.split(".")
+        attendue = _b64(hmac.new(SECRET, charge.encode(), hashlib.sha256).digest())
+        if not hmac.compare_digest(signature, attendue):
+            return None
+        contenu = json.loads(_deb64(charge))
+    except (ValueError, AttributeError):
+        return None
+    if contenu.get("exp", 0) < time.time():
+        return None
+    return contenu
+
+
+# ---------- LIMITEUR DE DÉBIT ----------
+
+class LimiteurDebit:
+    """
+    Seau à jetons par IP : `capacite` échecs d'affilée, puis `recharge` par seconde.
+    attente() vérifie avant la tentative sans rien consommer, noter_echec() la facture.
+    """
+    def __init__(self, capacite=TENTATIVES_MAX, recharge=RECHARGE_PAR_SECONDE):
+        self.capacite = capacite
+        self.recharge = recharge
+        self.lock = threading.Lock()
+        self.seaux = {}   # ip -> (jetons, dernier instant)
+
+    def _jetons(self, ip, maintenant):
+        jetons, dernier = self.seaux.get(ip, (self.capacite, maintenant))
+        return min(self.capacite, jetons + (maintenant - dernier) * self.recharge)
+
+    def attente(self, ip):
+        """0 si une tentative est permise, sinon le délai d'attente en secondes (rien n'est consommé)."""
+        with self.lock:
+            jetons = self._jetons(ip, time.monotonic())
+        return 0 if jetons >= 1 else (1 - jetons) / self.recharge
+
+    def noter_echec(self, ip):
+        """Consomme un jeton pour une tentative échouée."""
+        maintenant = time.monotonic()
+        with self.lock:
+            self.seaux[ip] = (self._jetons(ip, maintenant) - 1, maintenant)
+            if len(self.seaux) > 10_000:
+                self._purger(maintenant)
+
+    def _purger(self, maintenant):
+        # Un seau qui serait rechargé entièrement n'a plus d'utilité
+        plein = self.capacite / self.recharge
+        self.seaux = {ip: s for ip, s in self.seaux.items() if maintenant - s[1] < plein}
+
+    def reinitialiser(self):
+        with self.lock:
+            self.seaux.clear()
+
+limiteur_login = LimiteurDebit()
@@ -1,24 +1,45 @@
 #!/usr/bin/env python3
 """
-sender.py - Multi-zapettes vers serveur FastAPI (HTTP)
+sender.py - Multi-zapettes vers serveur FastAPI
+Zapettes série (CDC, pyserial) et HID-POS (hidapi, voir lecteur_hid.py).
 Filtre les ports pour ignorer le port interne ttyS0.
+
+Les scans partent sur un canal WebSocket persistant (/ws/ingestion) : numérotés
+côté sender, accusés par lots par le serveur, renvoyés après une coupure sans
+risque de doublon. Sans le paquet websockets, repli sur un POST /scan par scan.
 """
 
+import json
+import socket
 import threading
 import time
+import uuid
+from collections import deque
 import serial
 import serial.tools.list_ports
 import requests
+from traces import nouvelle_trace
+import lecteur_hid
+
+try:
+    from websockets.sync.client import connect as connecter_ws
+except ImportError:
+    connecter_ws = None
 
 # Configuration
 SERVER_HOST = "http://127.0.0.1:8000"
 SCAN_ENDPOINT = f"{SERVER_HOST}/scan"
+INGESTION_ENDPOINT = SERVER_HOST.replace("http", "ws", 1) + "/ws/ingestion"
 READ_TIMEOUT = 1.0
 RECONNECT_DELAY = 2.0
+ATTENTE_MAX = 10_000  # Scans gardés pendant une coupure du serveur
 
-def send_scan(barcode, device_id):
+def send_scan(barcode, device_id, trace=None):
     """Envoie un code-barres scanné au serveur FastAPI via HTTP"""
-    payload = {"code_barre": barcode, "poste": device_id}
+    trace = trace or nouvelle_trace()
+    trace["t_envoi"], trace["h_envoi"] = time.monotonic(), time.time()
+    # Clé d'idempotence : un renvoi de ce même scan ne crée pas de seconde commande
+    payload = {"code_barre": barcode, "poste": device_id, "trace": trace, "cle_idempotence": trace["id"]}
     try:
         res = requests.post(SCAN_ENDPOINT, json=payload, timeout=3)
         if res.ok:
@@ -30,6 +51,86 @@ def send_scan(barcode, device_id):
     except Exception as e:
         print(f"[EXC] Erreur envoi (zapette {device_id}): {e}")
 
+class CanalIngestion:
+    """
+    Connexion persistante vers /ws/ingestion, partagée par toutes les zapettes.
+    Chaque scan reçoit un numéro croissant et reste en attente jusqu'à l'accusé du
+    serveur. À la reconnexion, le serveur annonce le dernier numéro enregistré et
+    seuls les suivants sont renvoyés. L'identifiant d'émetteur est propre à ce
+    processus : un redémarrage du sender repart de 1 sous un nouvel identifiant.
+    """
+    def __init__(self, url=INGESTION_ENDPOINT, emetteur=None):
+        self.url = url
+        self.emetteur = emetteur or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.seq = 0
+        self.en_attente = deque()   # Scans non accusés, dans l'ordre des numéros
+        self.cond = threading.Condition()
+
+    def envoyer(self, barcode, device_id, trace=None):
+        with self.cond:
+            self.seq += 1
+            self.en_attente.append({"seq": self.seq, "code_barre": barcode, "poste": device_id,
+                                    "trace": trace or nouvelle_trace()})
+            if len(self.en_attente) > ATTENTE_MAX:
+                perdu = self.en_attente.popleft()
+                print(f"[⚠️] File pleine, scan perdu : {perdu['code_barre']}")
+            self.cond.notify()
+
+    def _accuser(self, seq):
+        with self.cond:
+            while self.en_attente and self.en_attente[0]["seq"] <= seq:
+                self.en_attente.popleft()
+
+    def _traiter(self, message):
+        if message.get("type") != "ack":
+            return
+        self._accuser(message["seq"])
+        for rejet in message.get("rejets", []):
+            print(f"[ERROR ❌] Scan {rejet['seq']} refusé ({rejet['status']}) : {rejet['detail']}")
+
+    def _session(self, ws):
+        bienvenue = json.loads(ws.recv(timeout=5))
+        self._accuser(bienvenue["dernier_seq"])
+        transmis = bienvenue["dernier_seq"]
+        print(f"[OPEN] Canal d'ingestion ouvert ({self.emetteur}, {len(self.en_attente)} scan(s) à renvoyer)")
+        while True:
+            with self.cond:
+                if not self.en_attente or self.en_attente[-1]["seq"] <= transmis:
+                    self.cond.wait(timeout=0.05)
+                a_envoyer = [scan for scan in self.en_attente if scan["seq"] > transmis]
+            if a_envoyer:
+                t_envoi, h_envoi = time.monotonic(), time.time()
+                for scan in a_envoyer:
+                    scan["trace"]["t_envoi"], scan["trace"]["h_envoi"] = t_envoi, h_envoi
+                ws.send(json.dumps(a_envoyer))
+                transmis = a_envoyer[-1]["seq"]
+            # Accusés déjà arrivés, sans attendre
+            while True:
+                try:
+                    self._traiter(json.loads(ws.recv(timeout=0)))
+                except TimeoutError:
+                    break
+
+    def boucle(self):
+        while True:
+            try:
+                with connecter_ws(f"{self.url}?emetteur={self.emetteur}") as ws:
+                    self._session(ws)
+            except Exception as e:
+                print(f"[⚠️] Canal d'ingestion indisponible ({e}), nouvelle tentative dans {RECONNECT_DELAY}s")
+            time.sleep(RECONNECT_DELAY)
+
+    def demarrer(self):
+        threading.Thread(target=self.boucle, daemon=True).start()
+
+canal = None  # CanalIngestion démarré par main(), sinon envoi HTTP
+
+def transmettre(barcode, device_id, trace=None):
+    if canal is not None:
+        canal.envoyer(barcode, device_id, trace)
+    else:
+        send_scan(barcode, device_id, trace)
+
 def serial_reader_thread(port_info, device_id):
     """Lit les scans sur un port série"""
     port_name = port_info.device
@@ -48,9 +149,13 @@ def serial_reader_thread(port_info, device_id):
             with ser:
                 print(f"[OPEN] {port_name} ouvert (zapette {device_id})")
                 buffer = b""
+                trace = None
                 while True:
                     chunk = ser.read(1) 
                     if chunk:
+                        if not buffer:
+                            # Premier octet du code-barres : début de la trace
+                            trace = nouvelle_trace()
                         buffer += chunk
                         ser.timeout = 0.05 
                         more = ser.read(128)
@@ -62,7 +167,7 @@ def serial_reader_thread(port_info, device_id):
                             barcode = buffer.decode("utf-8", errors="ignore").strip()
                             buffer = b""
                             if barcode:
-                                send_scan(barcode, device_id)
+                                transmettre(barcode, device_id, trace)
         except Exception:
             time.sleep(RECONNECT_DELAY)
             
@@ -89,8 +194,18 @@ def discover_and_start_listeners():
     return threads
 
 def main():
+    global canal
     print("[INFO] Sender démarré — détection des zapettes USB uniquement...")
+    if connecter_ws is not None:
+        canal = CanalIngestion()
+        canal.demarrer()
+    else:
+        print("[INFO] Paquet websockets absent : envoi HTTP scan par scan.")
     threads = discover_and_start_listeners()
+    # Scanners HID-POS : même chemin d'envoi, numérotés après les zapettes série
+    if lecteur_hid.hid is None:
+        print("[INFO] Paquet hidapi absent : zapettes HID-POS ignorées.")
+    threads += lecteur_hid.demarrer_lecteurs(len(threads) + 1, transmettre)
     if not threads:
         print("[INFO] Fin du programme (aucune zapette).")
         return
@@ -5,45 +5,90 @@ et lance les tâches de fond.
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
+import base64
 import hashlib
-from database import Commande, SessionLocal, Stand, Piece, SessionLocal, data_db, drop_db, init_db, Boite, Case, Stand, Cycle
-from datetime import datetime
+from database import Commande, SessionLocal, Stand, Piece, SessionLocal, data_db, drop_db, init_db, Boite, Case, Stand, Cycle, ArchiveCycle
+from datetime import datetime, timedelta
 import asyncio
 import json
 import logging
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
-import sqlite3
 import os 
 import requetes
 from pydantic import BaseModel 
 from sqlalchemy import func
-from update_grid import traiter_fichier_config
+from sqlalchemy.exc import SQLAlchemyError
+from update_grid import traiter_fichier_config, get_layout_etagere, invalider_layout, traiter_import_multiple, decouper_classeur, lire_archive_zip
 from contextlib import asynccontextmanager
 import traceback
 import csv
 from io import StringIO
 from fastapi.responses import StreamingResponse
+from metriques import MiddlewareMetriques, exporter_prometheus
+import traces
+import agregats
+from prevision_stock import prevision
+import kpi
+import archive
+import securite
+from etat_partage import creer_etat, DUREE_BAIL
+from relecture import TamponRelecture, premier_numero
+from encodage import MessageDiffuse, verifier_format
+from doublons import filtre_scans
+from stock import enregistrer_mouvement, enregistrer_mouvements, inventorier, compacter, stock_a, historique
+
+INTERVALLE_COMPACTION = 3600  # secondes entre deux compactions du registre de stock
 
 update_signal = asyncio.Event()
 logging.basicConfig(level=logging.INFO)
 
+# Mode actif, diffusions et leadership partagés entre workers (TRAIN_ETAT=sqlite avec --workers N)
+etat = creer_etat()
+# Plusieurs workers : l'accumulateur d'un worker ne voit pas les scans des autres, les KPI en cours sont relus en base
+kpi.en_cours.incremental = not etat.distribue
+if etat.distribue:
+    filtre_scans.partager(etat)   # Anti-rebond commun : une double lecture peut arriver sur deux workers
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logging.info("Initialisation de la base de données...")
     init_db()
     data_db()
-
-    task = asyncio.create_task(simulation_apport_boites())
+    migrer_mots_de_passe()
+    invalider_layout()
+    if etat.tenter_bail("leader", DUREE_BAIL):
+        executer_compaction_stock()  # Amorce le registre de stock des boîtes existantes
+    charger_previsions()
+    db = SessionLocal()
+    try:
+        if agregats.reconstruire_si_vide(db):
+            db.commit()
+            logging.info("[STATS] Agrégats des commandes reconstruits")
+        kpi.en_cours.charger(db)
+    finally:
+        db.close()
+    manager.tampon.creer_table()
+
+    etat.abonner("ws", lambda enveloppe: manager.diffuser_local(**json.loads(enveloppe)))
+    etat.abonner("appro", lambda _: update_signal.set())
+    etat.abonner("layout", lambda ids: [invalider_layout(i) for i in json.loads(ids)])
+    etat.abonner("prevision", observer_scan_distant)
+    await etat.demarrer()
+    task_leader = asyncio.create_task(maintenir_leadership())
     logging.info("Base prête")
     
     yield
     
     logging.info("Arrêt du serveur...")
-    task.cancel() 
+    task_leader.cancel()
+    await etat.arreter()
 
 app = FastAPI(lifespan=lifespan)
-current_app_mode = "Normal"
+
+def mode_actif():
+    """Mode de l'application (Normal ou Personnalisé), commun à tous les workers."""
+    return etat.lire("mode", "Normal")
 
 # --- Autoriser le front React ---
 origins = [
@@ -64,50 +109,199 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Instrumentation (latence par route + requêtes SQL par requête) ---
+app.add_middleware(MiddlewareMetriques)
+
 
 # --- Gestion WebSocket ---
 class ConnectionManager:
     """
     Gère les connexions WebSocket actives pour transmettre les scans
     de codes-barres aux clients.
+    Chaque client s'abonne à des sujets (postes, magasins, mode) ; un index
+    sujet -> sockets donne directement les destinataires d'un message, sans
+    parcourir tous les clients de l'usine.
+    Chaque diffusion est numérotée ("seq") et gardée dans un tampon de relecture :
+    un client qui se reconnecte avec ?last_seq=N reçoit seulement ce qu'il a manqué.
+    Chaque client choisit son encodage (json, msgpack) ; un message est encodé une
+    fois par encodage utilisé, pas une fois par socket.
     """
     def __init__(self):
         self.active: List[WebSocket] = []
         self.lock = asyncio.Lock()
-
-    async def connect(self, websocket: WebSocket):
+        self.abonnements = {}   # ws -> (clés de stand, mode) ; clé "*" = tous
+        self.par_stand = {}     # "poste:1" / "magasin:7" / "*" -> set(ws)
+        self.par_mode = {}      # "Normal" / "Personnalisé" / "*" -> set(ws)
+        self.formats = {}       # ws -> encodage choisi à la connexion
+        self.tampon = TamponRelecture()
+
+    @staticmethod
+    def cles_stand(postes=(), magasins=()):
+        cles = {f"poste:{p}" for p in postes} | {f"magasin:{m}" for m in magasins}
+        return cles or {"*"}
+
+    def _indexer(self, websocket, cles, mode):
+        for cle in cles:
+            self.par_stand.setdefault(cle, set()).add(websocket)
+        self.par_mode.setdefault(mode or "*", set()).add(websocket)
+        self.abonnements[websocket] = (cles, mode or "*")
+
+    def _desindexer(self, websocket):
+        cles, mode = self.abonnements.pop(websocket, ((), "*"))
+        for cle in cles:
+            self.par_stand.get(cle, set()).discard(websocket)
+        self.par_mode.get(mode, set()).discard(websocket)
+
+    async def connect(self, websocket: WebSocket, cles=("*",), mode=None, last_seq=None, format="json"):
         await websocket.accept()
+        dernier = None
+        if last_seq is not None:
+            dernier = int(await asyncio.to_thread(etat.lire, "seq_ws", 0))
         async with self.lock:
             self.active.append(websocket)
-        logging.info("WebSocket client connected")
+            self.formats[websocket] = format
+            self._indexer(websocket, set(cles), mode)
+            if last_seq is not None:
+                # Sous le verrou : aucune diffusion ne peut se glisser entre la relecture et le direct
+                await self._rejouer(websocket, last_seq, dernier)
+        logging.info(f"WebSocket client connected ({', '.join(sorted(cles))}, mode {mode or 'tous'})")
+
+    async def _rejouer(self, websocket, last_seq, dernier):
+        manquants = await asyncio.to_thread(self.tampon.depuis, last_seq, dernier)
+        if manquants is None:
+            await self.repondre(websocket, {"type": "resync", "seq": dernier})
+            return
+        for _, message, sujets in manquants:
+            if self.concerne(websocket, sujets):
+                await message.envoyer(websocket, self.formats.get(websocket, "json"))
+
+    async def repondre(self, websocket, donnees):
+        """Message pour ce seul client (accusé, resync), dans son encodage."""
+        await MessageDiffuse(donnees).envoyer(websocket, self.formats.get(websocket, "json"))
+
+    async def abonner(self, websocket: WebSocket, cles, mode=None):
+        """Remplace les abonnements d'un client déjà connecté."""
+        async with self.lock:
+            if websocket in self.abonnements:
+                self._desindexer(websocket)
+                self._indexer(websocket, set(cles), mode)
 
     async def disconnect(self, websocket: WebSocket):
         async with self.lock:
             if websocket in self.active:
                 self.active.remove(websocket)
+            self.formats.pop(websocket, None)
+            self._desindexer(websocket)
         logging.info("WebSocket client disconnected")
 
-    async def broadcast(self, message: str):
+    @staticmethod
+    def _cles_stands(sujets):
+        """Clés d'abonnement visées ; "poste" et "magasin" peuvent être des listes (message groupé)."""
+        cles = set()
+        for type_stand in ("poste", "magasin"):
+            valeur = sujets.get(type_stand)
+            for id_stand in (valeur if isinstance(valeur, list) else [valeur]):
+                if id_stand is not None:
+                    cles.add(f"{type_stand}:{id_stand}")
+        return cles
+
+    def destinataires(self, sujets=None):
+        """
+        Sockets intéressées par un message. sujets : {"poste", "magasin", "mode"} ;
+        un message sans poste ni magasin (ou sans sujets) concerne tous les stands.
+        """
+        sujets = sujets or {}
+        if sujets.get("poste") is None and sujets.get("magasin") is None:
+            cibles = set(self.abonnements)
+        else:
+            cibles = set(self.par_stand.get("*", ()))
+            for cle in self._cles_stands(sujets):
+                cibles |= self.par_stand.get(cle, set())
+        if sujets.get("mode"):
+            cibles &= self.par_mode.get("*", set()) | self.par_mode.get(sujets["mode"], set())
+        return cibles
+
+    def concerne(self, websocket, sujets=None):
+        """Même règle que destinataires(), pour un seul client (relecture)."""
+        sujets = sujets or {}
+        cles, mode = self.abonnements.get(websocket, ((), "*"))
+        if sujets.get("poste") is not None or sujets.get("magasin") is not None:
+            if not cles & ({"*"} | self._cles_stands(sujets)):
+                return False
+        return not sujets.get("mode") or mode in ("*", sujets["mode"])
+
+    async def broadcast(self, donnees: dict, sujets=None):
+        """Numérote, diffuse aux sockets abonnées de ce worker, puis aux autres workers via l'état partagé."""
+        async with self.lock:
+            if etat.distribue:
+                seq = await asyncio.to_thread(etat.incrementer, "seq_ws", premier_numero())
+            else:
+                seq = etat.incrementer("seq_ws", premier_numero())
+            message = MessageDiffuse({**donnees, "seq": seq})
+            lot = await self._envoyer(message, sujets, seq)
+        if lot:
+            # Déversement du tampon sur disque : hors du verrou et hors de la boucle
+            await asyncio.to_thread(self.tampon.deverser, lot)
+        if etat.distribue:
+            await asyncio.to_thread(etat.publier, "ws", json.dumps({"message": message.encoder("json"), "sujets": sujets, "seq": seq}))
+
+    async def diffuser_local(self, message: str, sujets=None, seq=None):
+        """Message reçu d'un autre worker (texte JSON), diffusé aux sockets de celui-ci."""
         async with self.lock:
-            to_remove = []
-            for ws in self.active:
-                try:
-                    await ws.send_text(message)
-                except Exception:
-                    to_remove.append(ws)
-            for ws in to_remove:
-                if ws in self.active:
-                    self.active.remove(ws)
+            lot = await self._envoyer(MessageDiffuse.depuis_json(message), sujets, seq)
+        if lot:
+            await asyncio.to_thread(self.tampon.deverser, lot)
+
+    async def _envoyer(self, message: MessageDiffuse, sujets, seq):
+        """Envoie aux abonnés ; retourne le lot que le tampon de relecture doit déverser, s'il y en a un."""
+        lot = self.tampon.ajouter(seq, message, sujets) if seq is not None else None
+        to_remove = []
+        for ws in list(self.destinataires(sujets)):
+            try:
+                await message.envoyer(ws, self.formats.get(ws, "json"))
+            except Exception:
+                to_remove.append(ws)
+        for ws in to_remove:
+            if ws in self.active:
+                self.active.remove(ws)
+            self.formats.pop(ws, None)
+            self._desindexer(ws)
+        return lot
 
 manager = ConnectionManager()
 
+def lire_abonnement(params):
+    """Sujets demandés par un client : ?poste=1&poste=2&magasin_id=7&mode=Normal (ou le même dict en JSON)."""
+    def liste(cle):
+        valeurs = params.getlist(cle) if hasattr(params, "getlist") else params.get(cle) or []
+        return [int(v) for v in ([valeurs] if isinstance(valeurs, (int, str)) else valeurs) if str(v).strip()]
+    return manager.cles_stand(liste("poste"), liste("magasin_id")), params.get("mode") or None
+
 # --- Endpoint WebSocket ---
 @app.websocket("/ws/scans")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    try:
+        cles, mode = lire_abonnement(websocket.query_params)
+        # Reconnexion : dernier numéro reçu, pour ne rejouer que les messages manqués
+        last_seq = websocket.query_params.get("last_seq")
+        last_seq = int(last_seq) if last_seq else None
+        format = verifier_format(websocket.query_params.get("format"))
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await manager.connect(websocket, cles, mode, last_seq, format)
     try:
         while True:
-            await websocket.receive_text()
+            texte = await websocket.receive_text()
+            # {"action": "abonner", "poste": [...], "magasin_id": [...], "mode": "..."} change les sujets suivis
+            try:
+                demande = json.loads(texte)
+                if isinstance(demande, dict) and demande.get("action") == "abonner":
+                    cles, mode = lire_abonnement(demande)
+                    await manager.abonner(websocket, cles, mode)
+                    await manager.repondre(websocket, {"type": "abonnement", "sujets": sorted(cles), "mode": mode})
+            except ValueError:
+                pass
     except WebSocketDisconnect:
         await manager.disconnect(websocket)
 
@@ -123,21 +317,90 @@ async def upload_config(payload: ConfigPayload):
     db = SessionLocal()
     try:
         # On appelle la fonction d'affichage
-        return traiter_fichier_config(payload.csv_content, payload.posteId, db)
+        resultat = traiter_fichier_config(payload.csv_content, payload.posteId, db)
+        if etat.distribue:
+            await asyncio.to_thread(etat.publier, "layout", json.dumps([payload.posteId]))
+        return resultat
+    finally:
+        db.close()
+
+class ConfigMultiplePayload(BaseModel):
+    csv_content: Optional[str] = None  # Classeur : sections "#STAND,<id>" suivies du CSV du stand
+    zip_base64: Optional[str] = None   # Archive de CSV nommés d'après le stand (etagere_4.csv)
+    dry_run: bool = False
+
+@app.post("/api/admin/upload-config-multiple")
+def upload_config_multiple(payload: ConfigMultiplePayload):
+    """
+    Configure plusieurs stands en une fois (changement de ligne).
+    Avec dry_run, renvoie le rapport de validation et le bilan des cases sans rien modifier.
+    """
+    if payload.zip_base64:
+        try:
+            donnees = base64.b64decode(payload.zip_base64, validate=True)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="zip_base64 n'est pas du base64 valide.")
+        fichiers = lire_archive_zip(donnees)
+    elif payload.csv_content:
+        fichiers = decouper_classeur(payload.csv_content)
+    else:
+        raise HTTPException(status_code=400, detail="Fournir csv_content ou zip_base64.")
+
+    db = SessionLocal()
+    try:
+        rapport = traiter_import_multiple(fichiers, db, dry_run=payload.dry_run)
+        if not payload.dry_run and rapport["status"] == "ok":
+            etat.publier("layout", json.dumps([stand_id for stand_id, _ in fichiers]))
+        return rapport
     finally:
         db.close()
 
+@app.get("/api/stands/{stand_id}/layout")
+def get_stand_layout(stand_id: int, request: Request):
+    """
+    Renvoie la disposition de l'étagère d'un stand (servie depuis le cache mémoire).
+    L'ETag est l'empreinte de la disposition : le navigateur revalide avec If-None-Match.
+    """
+    resultat = get_layout_etagere(stand_id)
+    if not resultat:
+        raise HTTPException(status_code=404, detail="Aucune étagère configurée pour ce stand")
+
+    contenu, empreinte = resultat
+    etag = f'"{empreinte}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=contenu, media_type="application/json", headers=headers)
+
 @app.post("/scan")
 async def recevoir_scan(request: Request):
     """
-    Appelé par sender.py. 
+    Appelé par sender.py (sans canal d'ingestion) et les outils de test.
+    La clé d'idempotence peut venir du corps ("cle_idempotence") ou de l'en-tête Idempotency-Key.
+    """
+    data = await request.json()
+    if not data.get("cle_idempotence") and request.headers.get("idempotency-key"):
+        data["cle_idempotence"] = request.headers["idempotency-key"]
+    return await enregistrer_scan(data)
+
+async def enregistrer_scan(data, reprise=None):
+    """
     Identifie la boîte scannée, vérifie si elle appartient au bon poste, 
     enregistre la commande en base et notifie le front via WebSocket.
+    Si la même boîte est déjà demandée par ce poste et pas encore récupérée, le scan
+    s'ajoute à cette commande (quantite + 1) au lieu d'en créer une autre.
+    reprise = (émetteur, seq) pour un scan du canal d'ingestion : un numéro déjà
+    enregistré est ignoré (renvoi après reconnexion), dans la transaction même du scan.
+    Un rebond (même poste et code-barres dans la fenêtre de doublons) ou une clé
+    d'idempotence déjà vue est accusé sans rien écrire ni diffuser.
     """
-    global current_app_mode # On utilise bien la variable globale
-    data = await request.json()
+    # Mode commun à tous les workers : en multi-worker, lecture SQLite hors de la boucle d'évènements
+    current_app_mode = await asyncio.to_thread(mode_actif) if etat.distribue else mode_actif()
     poste_id = data.get("poste")
     code_barre = data.get("code_barre")
+    cle_idempotence = data.get("cle_idempotence")
+    trace_id = traces.registre.demarrer(data.get("trace"), poste_id, code_barre)
+    reserve = False
 
     db = SessionLocal()
     try:
@@ -151,17 +414,37 @@ async def recevoir_scan(request: Request):
             if boite.idPoste is not None and boite.idPoste != poste_id:
                 raise HTTPException(status_code=403, detail="Cet objet n'est pas affecté à ce poste")
 
+        reserve, id_existant = filtre_scans.reserver(poste_id, code_barre, cle_idempotence)
+        if not reserve:
+            return {"status": "ok", "detail": "doublon ignoré", "doublon": True,
+                    "id_commande": id_existant, "trace_id": trace_id}
+
         case_magasin = db.query(Case).filter_by(idBoite=boite.idBoite, idStand=boite.idMagasin).first()
         magasin_nom, ligne, colonne = (case_magasin.Stand.nomStand, case_magasin.ligne, case_magasin.colonne) if case_magasin else ("Non localisé", "-", "-")
 
-        nouvelle_commande = Commande(idBoite=boite.idBoite, idMagasin=boite.idMagasin, idPoste=poste_id, statutCommande="A récupérer", typeCommande=current_app_mode)
-
-        db.add(nouvelle_commande)
+        date_scan = datetime.now()
+        regroupee = requetes.regrouper_commande(db, boite.idBoite, poste_id, current_app_mode)
+        if regroupee:
+            id_commande, quantite = regroupee
+        else:
+            nouvelle_commande = Commande(idBoite=boite.idBoite, idMagasin=boite.idMagasin, idPoste=poste_id, statutCommande="A récupérer",
+                                         typeCommande=current_app_mode, dateCommande=date_scan, quantite=1)
+            db.add(nouvelle_commande)
+            db.flush()
+            id_commande, quantite = nouvelle_commande.idCommande, 1
+        if reprise is not None and not requetes.avancer_emetteur(db, *reprise):
+            db.rollback()
+            return {"status": "doublon", "detail": "scan déjà enregistré"}
         db.commit()
-        db.refresh(nouvelle_commande)
+        filtre_scans.confirmer(poste_id, code_barre, cle_idempotence, id_commande)
+        reserve = False
+        traces.registre.marquer(trace_id, "t_base")
+        if not regroupee:
+            kpi.en_cours.commande(current_app_mode, date_scan, poste_id, boite.idMagasin)
         
         message = {
-            "id_commande": nouvelle_commande.idCommande,
+            "id_commande": id_commande,
+            "quantite": quantite,
             "mode": current_app_mode, # <--- Corrigé (ne pas mettre 'mode' tout court)
             "poste": poste_id,
             "code_barre": code_barre,
@@ -171,24 +454,152 @@ async def recevoir_scan(request: Request):
             "ligne": ligne,
             "colonne": colonne,
             "stock": boite.nbBoite,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "trace_id": trace_id
         }
-        await manager.broadcast(json.dumps(message))
-        return {"status": "ok", "detail": "scan enregistré"}
+        await manager.broadcast(message, {"poste": poste_id, "magasin": boite.idMagasin, "mode": current_app_mode})
+        traces.registre.marquer(trace_id, "t_broadcast")
+
+        # Prévision de rupture mise à jour avec ce scan ; alerte poussée si la boîte va manquer
+        en_attente = db.query(func.coalesce(func.sum(Commande.quantite), 0)).filter(
+            Commande.idBoite == boite.idBoite, Commande.statutCommande == "A récupérer"
+        ).scalar()
+        alerte = prevision.observer(
+            boite.idBoite, current_app_mode, date_scan,
+            (boite.nbBoite or 0) - en_attente, boite.approvisionnement, not regroupee,
+        )
+        if etat.distribue:
+            # Les autres workers tiennent leur propre EWMA : ils observent aussi ce scan
+            await asyncio.to_thread(etat.publier, "prevision", json.dumps({
+                "idBoite": boite.idBoite, "mode": current_app_mode, "date": date_scan.isoformat(),
+                "stock": (boite.nbBoite or 0) - en_attente, "appro": boite.approvisionnement,
+                "nouvelle": not regroupee,
+            }))
+        if alerte:
+            alerte.update({"type": "alerte_stock", "code_barre": code_barre, "nom_piece": message["nom_piece"],
+                           "poste": poste_id, "magasin_id": boite.idMagasin})
+            await manager.broadcast(alerte, {"poste": poste_id, "magasin": boite.idMagasin, "mode": current_app_mode})
+        return {"status": "ok", "detail": "scan enregistré", "id_commande": id_commande, "quantite": quantite, "trace_id": trace_id}
 
     except HTTPException as he:
         raise he # On laisse remonter l'erreur 404 ou 403 telle quelle
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
+        if reserve:
+            # Rien n'a été écrit : le scan pourra être retenté
+            filtre_scans.liberer(poste_id, code_barre, cle_idempotence)
         db.close()
 
+TAILLE_LOT_ACK = 50   # Scans au plus par accusé du canal d'ingestion
+
+@app.websocket("/ws/ingestion")
+async def canal_ingestion(websocket: WebSocket):
+    """
+    Canal persistant de sender.py : ?emetteur=<identifiant stable du processus>.
+    Trames : un scan {"seq", "poste", "code_barre", "trace"} ou une liste de scans,
+    seq croissant par émetteur. À la connexion, le serveur annonce le dernier seq
+    enregistré ({"type": "bienvenue"}) ; l'émetteur renvoie ce qui n'a pas été accusé.
+    Les scans sont traités dans l'ordre et accusés par lots : {"type": "ack", "seq": n,
+    "rejets": [...]} couvre tous les numéros <= n (rejets : scans refusés, à ne pas renvoyer).
+    """
+    emetteur = websocket.query_params.get("emetteur")
+    if not emetteur:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    dernier = await asyncio.to_thread(requetes.ouvrir_emetteur, emetteur)
+    await websocket.send_json({"type": "bienvenue", "dernier_seq": dernier})
+
+    # Lecture et traitement découplés : ce qui s'accumule pendant un scan part dans le même accusé
+    file = asyncio.Queue()
+    async def lire():
+        try:
+            while True:
+                trame = await websocket.receive_json()
+                for scan in (trame if isinstance(trame, list) else [trame]):
+                    await file.put(scan)
+        except (WebSocketDisconnect, ValueError):
+            pass
+        finally:
+            await file.put(None)
+    lecteur = asyncio.create_task(lire())
+
+    try:
+        fin = False
+        while not fin:
+            lot = [await file.get()]
+            while not file.empty() and len(lot) < TAILLE_LOT_ACK:
+                lot.append(file.get_nowait())
+            fin = None in lot
+            rejets = []
+            sans_ecriture = False   # Scan accusé sans commande : son numéro reste à enregistrer
+            for scan in lot:
+                if scan is None:
+                    break
+                seq = scan.get("seq") if isinstance(scan, dict) else None
+                if not isinstance(seq, int):
+                    rejets.append({"seq": seq, "status": 400, "detail": "seq manquant"})
+                    continue
+                if seq > dernier:
+                    try:
+                        resultat = await enregistrer_scan(scan, (emetteur, seq))
+                        sans_ecriture |= bool(resultat.get("doublon"))
+                    except HTTPException as e:
+                        if e.status_code >= 500:
+                            # Panne côté serveur : pas d'accusé, l'émetteur renverra ce scan à la reconnexion
+                            if sans_ecriture:
+                                await asyncio.to_thread(requetes.noter_emetteur, emetteur, dernier)
+                            await websocket.close(code=1011)
+                            return
+                        rejets.append({"seq": seq, "status": e.status_code, "detail": e.detail})
+                        sans_ecriture = True
+                    dernier = seq
+            if sans_ecriture:
+                # Même socket fermée : sinon l'émetteur renverrait ces scans, peut-être hors fenêtre de rebond
+                await asyncio.to_thread(requetes.noter_emetteur, emetteur, dernier)
+            if not fin:
+                await websocket.send_json({"type": "ack", "seq": dernier, "rejets": rejets})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        lecteur.cancel()
+
+@app.post("/api/traces/{trace_id}/affichage")
+def accuser_affichage(trace_id: str):
+    """
+    Appelé par l'écran (Circuit.jsx) quand le scan tracé est affiché.
+    """
+    if not traces.registre.marquer(trace_id, "t_affichage"):
+        raise HTTPException(status_code=404, detail="Trace inconnue")
+    return {"status": "ok"}
+
+@app.get("/api/traces/latence")
+def get_latence_scans():
+    """
+    Répartition des durées par étape (lecture, envoi, base, broadcast, affichage) des derniers scans.
+    """
+    return traces.registre.repartition()
+
+@app.get("/api/traces/lentes")
+def get_scans_lents(limite: int = 10):
+    """
+    Scans récents les plus lents, avec la durée de chaque étape.
+    """
+    return traces.registre.plus_lentes(limite)
+
 @app.post("/api/set-active-mode")
 async def set_active_mode(request: Request):
-    global current_app_mode
     data = await request.json()
-    current_app_mode = data.get("mode", "Normal")
-    return {"status": "ok", "current_mode": current_app_mode}
+    mode = data.get("mode", "Normal")
+    await asyncio.to_thread(etat.ecrire, "mode", mode)
+    return {"status": "ok", "current_mode": mode}
+
+def observer_scan_distant(message):
+    """Scan reçu par un autre worker : met à jour la prévision locale (sans alerte, déjà émise)."""
+    scan = json.loads(message)
+    prevision.observer(scan["idBoite"], scan["mode"], datetime.fromisoformat(scan["date"]), scan["stock"], scan["appro"],
+                       scan.get("nouvelle", True))
 
 
 async def simulation_apport_boites():
@@ -202,98 +613,200 @@ async def simulation_apport_boites():
 
     while True:
         await asyncio.sleep(1) # Tick de 1 seconde
+        tick_approvisionnement(timers)
+
+def tick_approvisionnement(timers):
+    """
+    Exécute un tick (1 seconde) de la simulation d'approvisionnement.
+    timers : {id_boite: secondes_restantes}, modifié sur place.
+    """
+    # --- ÉTAPE 1 : GESTION DU SIGNAL (MISE À JOUR DÉLAIS) ---
+    if update_signal.is_set():
+        logging.info("[APPRO] Signal reçu : Synchronisation des nouveaux délais...")
         
-        # --- ÉTAPE 1 : GESTION DU SIGNAL (MISE À JOUR DÉLAIS) ---
-        if update_signal.is_set():
-            logging.info("[APPRO] Signal reçu : Synchronisation des nouveaux délais...")
-            
-            # On demande à requetes.py le nouveau délai pour chaque boîte suivie
-            for bid in list(timers.keys()):
-                nouveau_delai = requetes.get_approvisionnement_boite(bid)
-                if nouveau_delai is not None:
-                    # Si le nouveau délai est plus court que le temps restant, on ajuste
-                    if timers[bid] > nouveau_delai:
-                        timers[bid] = nouveau_delai
+        # On demande à requetes.py le nouveau délai pour chaque boîte suivie
+        for bid in list(timers.keys()):
+            nouveau_delai = requetes.get_approvisionnement_boite(bid)
+            if nouveau_delai is not None:
+                # Si le nouveau délai est plus court que le temps restant, on ajuste
+                if timers[bid] > nouveau_delai:
+                    timers[bid] = nouveau_delai
+        
+        update_signal.clear() # On baisse le flag
+        logging.info("[APPRO] Synchronisation terminée.")
+
+    # --- ÉTAPE 2 : DÉCOMPTE ET MISE À JOUR DU STOCK ---
+    db_update_needed = False
+    ids_finis = []
+
+    # On parcourt les compteurs en mémoire
+    for boite_id in list(timers.keys()):
+        timers[boite_id] -= 1
+        if timers[boite_id] <= 0:
+            ids_finis.append(boite_id)
+            db_update_needed = True
+
+    # On n'ouvre la base de données QUE si nécessaire
+    if db_update_needed or not timers:
+        db = SessionLocal()
+        try:
+            # Récupération des boîtes pour incrémentation ou initialisation
+            boites = db.query(Boite).all()
+            arrivees = []
             
-            update_signal.clear() # On baisse le flag
-            logging.info("[APPRO] Synchronisation terminée.")
-
-        # --- ÉTAPE 2 : DÉCOMPTE ET MISE À JOUR DU STOCK ---
-        db_update_needed = False
-        ids_finis = []
-
-        # On parcourt les compteurs en mémoire
-        for boite_id in list(timers.keys()):
-            timers[boite_id] -= 1
-            if timers[boite_id] <= 0:
-                ids_finis.append(boite_id)
-                db_update_needed = True
-
-        # On n'ouvre la base de données QUE si nécessaire
-        if db_update_needed or not timers:
-            db = SessionLocal()
-            try:
-                # Récupération des boîtes pour incrémentation ou initialisation
-                boites = db.query(Boite).all()
+            for b in boites:
+                # Initialisation des nouvelles boîtes arrivées en BD
+                if b.idBoite not in timers:
+                    timers[b.idBoite] = b.approvisionnement
                 
-                for b in boites:
-                    # Initialisation des nouvelles boîtes arrivées en BD
-                    if b.idBoite not in timers:
-                        timers[b.idBoite] = b.approvisionnement
+                # Si le délai est expiré pour cette boîte
+                if b.idBoite in ids_finis:
+                    arrivees.append({"idBoite": b.idBoite, "delta": 1, "motif": "approvisionnement"})
+                    timers[b.idBoite] = b.approvisionnement # Reset du compteur avec la valeur BD
                     
-                    # Si le délai est expiré pour cette boîte
-                    if b.idBoite in ids_finis:
-                        b.nbBoite += 1 # Incrémentation du stock
-                        timers[b.idBoite] = b.approvisionnement # Reset du compteur avec la valeur BD
-                        
-                        nom = b.piece.nomPiece if b.piece else b.code_barre
-                        logging.info(f"[APPRO] +1 stock pour {nom} (ID:{b.idBoite})")
-
-                db.commit() # Sauvegarde globale des stocks incrémentés
+                    nom = b.piece.nomPiece if b.piece else b.code_barre
+                    logging.info(f"[APPRO] +1 stock pour {nom} (ID:{b.idBoite})")
+
+            # Incrémentation du stock via le registre des mouvements
+            enregistrer_mouvements(db, arrivees)
+            db.commit() # Sauvegarde globale des stocks incrémentés
+        except Exception as e:
+            logging.error(f"[APPRO] Erreur lors de l'incrémentation : {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+def migrer_mots_de_passe():
+    """Hache les mots de passe encore stockés en clair (anciennes bases)."""
+    db = SessionLocal()
+    try:
+        nb = securite.migrer_mots_de_passe(db)
+        if nb:
+            db.commit()
+            logging.info(f"[LOGIN] {nb} mot(s) de passe haché(s)")
+    finally:
+        db.close()
+
+def charger_previsions():
+    """Reconstruit l'état des prévisions de rupture depuis les commandes récentes."""
+    db = SessionLocal()
+    try:
+        nb = prevision.charger(db)
+        logging.info(f"[PREVISION] {nb} séries de consommation chargées")
+    finally:
+        db.close()
+
+def executer_compaction_stock():
+    """Compaction du registre de stock (instantanés + purge des vieux mouvements)."""
+    db = SessionLocal()
+    try:
+        bilan = compacter(db)
+        db.commit()
+        logging.info(f"[STOCK] Compaction : {bilan}")
+        return bilan
+    except Exception as e:
+        logging.error(f"[STOCK] Erreur lors de la compaction : {e}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+
+def executer_archivage(retention_jours=archive.RETENTION_JOURS):
+    """Déplace les cycles anciens vers les fichiers d'archive mensuels."""
+    try:
+        bilan = archive.archiver(retention_jours)
+        if bilan["cycles"]:
+            logging.info(f"[ARCHIVE] Archivage : {bilan}")
+        return bilan
+    except Exception as e:
+        logging.error(f"[ARCHIVE] Erreur lors de l'archivage : {e}")
+        return None
+
+async def maintenir_leadership():
+    """
+    Renouvelle le bail "leader" ; seul son titulaire fait tourner la simulation
+    d'approvisionnement et la maintenance. Si le leader s'arrête, un autre worker
+    prend la main à l'expiration du bail.
+    """
+    taches = []
+    try:
+        while True:
+            try:
+                leader = await asyncio.to_thread(etat.tenter_bail, "leader", DUREE_BAIL)
             except Exception as e:
-                logging.error(f"[APPRO] Erreur lors de l'incrémentation : {e}")
-                db.rollback()
-            finally:
-                db.close()
+                logging.error(f"[LEADER] Renouvellement du bail impossible : {e}")
+                leader = False
+            if leader and not taches:
+                logging.info("[LEADER] Ce worker pilote la simulation et la maintenance")
+                taches = [asyncio.create_task(simulation_apport_boites()), asyncio.create_task(compaction_stock_periodique())]
+            elif not leader and taches:
+                logging.info("[LEADER] Bail perdu : arrêt de la simulation sur ce worker")
+                for t in taches:
+                    t.cancel()
+                taches = []
+            await asyncio.sleep(DUREE_BAIL / 3)
+    finally:
+        for t in taches:
+            t.cancel()
+        if taches:
+            etat.liberer_bail("leader")
+
+async def compaction_stock_periodique():
+    """Lance la compaction du registre de stock (et l'archivage des vieux cycles) toutes les INTERVALLE_COMPACTION secondes."""
+    while True:
+        await asyncio.sleep(INTERVALLE_COMPACTION)
+        await asyncio.to_thread(executer_compaction_stock)
+        await asyncio.to_thread(executer_archivage)
 
 @app.get("/")
 async def root():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """Expose les métriques de latence et de requêtes SQL au format Prometheus"""
+    return Response(content=exporter_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 class LoginRequest(BaseModel):
     username: str
     password: str
 
 @app.post("/api/login")
-def login(creds: LoginRequest):
+async def login(creds: LoginRequest, request: Request):
     """
-    Vérifie les identifiants fournis (nom d'utilisateur et mot de passe)
-    dans la base de données SQLite pour autoriser l'accès à l'administration.
+    Vérifie les identifiants fournis (nom d'utilisateur et mot de passe haché en base)
+    pour autoriser l'accès à l'administration et renvoie un jeton de session signé.
+    Le calcul scrypt tourne dans le pool de securite, pas dans la boucle d'évènements.
+    Seuls les échecs sont décomptés par le limiteur de l'IP.
     """
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(base_dir, "train.db")
-    
-    
-    
-    conn = None
+    ip = request.client.host if request.client else "inconnue"
+    attente = securite.limiteur_login.attente(ip)
+    if attente:
+        raise HTTPException(status_code=429, detail="Trop de tentatives, réessayez plus tard",
+                            headers={"Retry-After": str(int(attente) + 1)})
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM login WHERE username = ? AND password = ?", (creds.username, creds.password))
-        user = cursor.fetchone()
-        
-        if user:
-            return {"message": "Login successful"}
-        else:
-            raise HTTPException(status_code=401, detail="Identifiants incorrects")
-            
-    except sqlite3.Error as e:
+        ok = await asyncio.get_running_loop().run_in_executor(
+            securite.pool_verification, securite.authentifier, creds.username, creds.password
+        )
+    except SQLAlchemyError as e:
+        logging.error(f"[LOGIN] Erreur base : {e}")
         raise HTTPException(status_code=500, detail="Erreur serveur")
-    finally:
-        if conn:
-            conn.close()
+
+    if not ok:
+        securite.limiteur_login.noter_echec(ip)
+        raise HTTPException(status_code=401, detail="Identifiants incorrects")
+    return {"message": "Login successful", "token": securite.creer_jeton(creds.username),
+            "expire_dans": securite.DUREE_JETON}
+
+@app.get("/api/session")
+def verifier_session(request: Request):
+    """Valide le jeton présenté (en-tête Authorization: Bearer) sans relire la base."""
+    entete = request.headers.get("Authorization", "")
+    contenu = securite.verifier_jeton(entete[7:]) if entete.startswith("Bearer ") else None
+    if not contenu:
+        raise HTTPException(status_code=401, detail="Session invalide ou expirée")
+    return {"username": contenu["sub"], "exp": contenu["exp"]}
 
 class MultiDelayUpdate(BaseModel):
     updates: List[dict] # Liste de {idBoite: int, delai: int}
@@ -330,6 +843,7 @@ def update_delais_appro(payload: MultiDelayUpdate):
             requetes.update_approvisionnement_boite(item["idBoite"], item["delai"])
         
         update_signal.set() 
+        etat.publier("appro", "")  # La simulation tourne peut-être sur un autre worker
         
         return {"status": "ok", "message": "Délais mis à jour"}
     except Exception as e:
@@ -338,16 +852,27 @@ def update_delais_appro(payload: MultiDelayUpdate):
 
 # --- backend/server.py ---
 @app.get("/api/admin/dashboard")
-def get_admin_dashboard(mode: str = "Normal"):
+def get_admin_dashboard(mode: str = "Normal", cycle_id: Optional[str] = None):
     """
     Récupère et agrège les données nécessaires à l'affichage de l'historique.
+    Les cycles archivés sont relus dans leurs fichiers mensuels, comme pour les logs.
+    Avec cycle_id, seul l'historique de ce cycle est renvoyé.
     """
     db = SessionLocal()
     try:
         stands = db.query(Stand).all()
         stands_map = {s.idStand: s.nomStand for s in stands}
 
+        debut_cycle = None
+        if cycle_id and cycle_id != "Total":
+            try:
+                debut_cycle = datetime.strptime(cycle_id, "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                debut_cycle = None
+
+        # Cycles archivés compris : leurs commandes encore ouvertes sont restées dans la base principale
         cycles = db.query(Cycle).filter(Cycle.type_cycle == mode).all()
+        cycles += db.query(ArchiveCycle).filter(ArchiveCycle.type_cycle == mode).all()
         
         if not cycles:
              return {"stands": [{"id": s.idStand, "nom": s.nomStand} for s in stands], "historique": []}
@@ -358,24 +883,7 @@ def get_admin_dashboard(mode: str = "Normal"):
 
         grouped_history = {} 
 
-        for c in commandes:
-            cycle_id = None
-            if c.dateCommande and cycles:
-                cmd_date = c.dateCommande.replace(tzinfo=None) if c.dateCommande.tzinfo else c.dateCommande
-                
-                for cy in cycles:
-                    debut = cy.date_debut.replace(tzinfo=None) if cy.date_debut else None
-                    fin = cy.date_fin.replace(tzinfo=None) if cy.date_fin else now
-                    
-                    if debut and debut <= cmd_date <= fin:
-                        cycle_id = cy.date_debut.strftime("%Y-%m-%d %H:%M:%S")
-                        break
-
-            nom_objet = "Objet Inconnu"
-            if c.boite:
-                if c.boite.piece: nom_objet = c.boite.piece.nomPiece
-                elif c.boite.code_barre: nom_objet = c.boite.code_barre
-
+        def ajouter(c, nom_objet, cycle_id):
             if c.dateCommande:
                 heure_str = c.dateCommande.strftime("%H:%M")
                 date_complete = c.dateCommande.strftime("%d/%m %H:%M")
@@ -387,13 +895,13 @@ def get_admin_dashboard(mode: str = "Normal"):
             key = (nom_objet, c.idMagasin, c.idPoste, c.statutCommande, cycle_id)
             
             if key in grouped_history:
-                grouped_history[key]["count"] += 1
+                grouped_history[key]["count"] += c.quantite or 1
                 if raw_date > grouped_history[key]["raw_date"]:
                      grouped_history[key]["raw_date"] = raw_date
                      grouped_history[key]["date_full"] = date_complete
             else:
                 grouped_history[key] = {
-                    "count": 1,
+                    "count": c.quantite or 1,
                     "raw_date": raw_date,
                     "id": c.idCommande,
                     "objet": nom_objet,
@@ -407,9 +915,35 @@ def get_admin_dashboard(mode: str = "Normal"):
                     "dest_nom": stands_map.get(c.idPoste, "Inconnu"),
                 }
 
+        for c in commandes:
+            cycle_id_commande = None
+            if c.dateCommande and cycles:
+                cmd_date = c.dateCommande.replace(tzinfo=None) if c.dateCommande.tzinfo else c.dateCommande
+                
+                for cy in cycles:
+                    debut = cy.date_debut.replace(tzinfo=None) if cy.date_debut else None
+                    fin = cy.date_fin.replace(tzinfo=None) if cy.date_fin else now
+                    
+                    if debut and debut <= cmd_date <= fin:
+                        cycle_id_commande = cy.date_debut.strftime("%Y-%m-%d %H:%M:%S")
+                        break
+
+            nom_objet = "Objet Inconnu"
+            if c.boite:
+                if c.boite.piece: nom_objet = c.boite.piece.nomPiece
+                elif c.boite.code_barre: nom_objet = c.boite.code_barre
+
+            ajouter(c, nom_objet, cycle_id_commande)
+
+        # Commandes terminées des cycles archivés, relues dans leurs fichiers
+        for entree, c in requetes.get_commandes_archivees(mode, debut_cycle):
+            ajouter(c, c.nomPiece or c.code_barre or "Objet Inconnu", entree.date_debut.strftime("%Y-%m-%d %H:%M:%S"))
+
         historique_fmt = []
         for item in grouped_history.values():
             del item["raw_date"]
+            if cycle_id and cycle_id != "Total" and item["cycle_id"] != cycle_id:
+                continue
             historique_fmt.append(item)
             
         historique_fmt.sort(key=lambda x: x["date_full"], reverse=True)
@@ -432,7 +966,7 @@ def get_cycles_list(mode: str = "Normal"): # On récupère le mode
     db = SessionLocal()
     try:
         # On filtre les cycles par le mode (Normal ou Personnalisé)
-        cycles_db = db.query(Cycle).filter(Cycle.type_cycle == mode).order_by(Cycle.date_debut.desc()).limit(20).all()
+        cycles_db = requetes.get_all_cycles(mode=mode, limite=20)
         
         cycles_fmt = []
         for c in cycles_db:
@@ -479,8 +1013,44 @@ def get_cycle_logs(cycle_id: str, mode: str = "Normal"):
         print(f"Erreur Logs: {e}")
         return {"logs": []}
 
+@app.get("/api/admin/kpi/{cycle_id}")
+def get_cycle_kpi(cycle_id: str, mode: str = "Normal"):
+    """
+    KPI du cycle cycle_id (date de début, comme pour les logs) : délais, cadence et
+    taux de produits manquants, globaux et par stand. Lu dans le cache pour un cycle
+    terminé, depuis l'accumulateur incrémental pour le cycle en cours.
+    """
+    try:
+        date_obj = datetime.strptime(cycle_id, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Identifiant de cycle invalide")
+
+    db = SessionLocal()
+    try:
+        cycle = db.query(Cycle).filter(
+            Cycle.type_cycle == mode,
+            Cycle.date_debut >= date_obj,
+            Cycle.date_debut < date_obj + timedelta(seconds=1),
+        ).first()
+        if cycle:
+            return kpi.kpi_cycle(db, cycle)
+        # Cycle archivé : KPI figés au moment de l'archivage
+        entree = archive.trouver_cycle(db, date_obj, mode)
+        resultat = archive.kpi_cycle_archive(entree) if entree else None
+        if resultat is None:
+            raise HTTPException(status_code=404, detail="Cycle introuvable")
+        return resultat
+    finally:
+        db.close()
+
 @app.post("/api/cycle/start")
-def start_cycle(mode: str = "Normal"):
+async def start_cycle(mode: str = "Normal"):
+    resultat = await asyncio.to_thread(demarrer_cycle, mode)
+    if resultat["status"] == "ok":
+        await manager.broadcast({"type": "cycle", "mode": mode, "actif": True}, {"mode": mode})
+    return resultat
+
+def demarrer_cycle(mode):
     db = SessionLocal()
     try:
         # On vérifie s'il y a déjà un cycle actif pour le mode précis
@@ -494,12 +1064,19 @@ def start_cycle(mode: str = "Normal"):
         )
         db.add(nouveau)
         db.commit()
+        kpi.en_cours.demarrer(nouveau)
         return {"status": "ok", "date_debut": nouveau.date_debut}
     finally:
         db.close()
 
 @app.post("/api/cycle/stop")
-def stop_cycle():
+async def stop_cycle():
+    resultat = await asyncio.to_thread(arreter_cycle)
+    if resultat["status"] == "ok":
+        await manager.broadcast({"type": "cycle", "mode": resultat["mode"], "actif": False}, {"mode": resultat["mode"]})
+    return resultat
+
+def arreter_cycle():
     db = SessionLocal()
     try:
         # On cherche n'importe quel cycle qui n'a pas de date_fin
@@ -508,8 +1085,11 @@ def stop_cycle():
             return {"status": "error", "message": "Aucun cycle actif"}
         
         actif.date_fin = datetime.now()
+        # KPI définitifs calculés une fois, à la clôture
+        kpi.calculer_et_stocker(db, actif)
         db.commit()
-        return {"status": "ok"}
+        kpi.en_cours.arreter(actif.type_cycle)
+        return {"status": "ok", "mode": actif.type_cycle}
     finally:
         db.close()
 
@@ -542,58 +1122,127 @@ def get_commandes_en_cours(mode: str = "Normal"): # On récupère le mode du fet
             Commande.typeCommande == mode
         ).all()
         
-        taches = []
-        for c in commandes:
-            stock = c.boite.nbBoite if c.boite else 0
-            
-            # On récupère le code-barre pour l'affichage des cases
-            vrai_code_barre = c.boite.code_barre if c.boite else "Inconnu"
-            
-            # Récupération du nom de la pièce
-            nom_piece = "Inconnu"
-            if c.boite and c.boite.piece:
-                nom_piece = c.boite.piece.nomPiece
-            else:
-                nom_piece = vrai_code_barre
-
-            ligne, colonne = 1, 1
-            if c.boite and c.boite.Cases:
-                case = c.boite.Cases[0]
-                ligne = case.ligne
-                colonne = case.colonne
-
-            taches.append({
-                "id": c.idCommande,
-                "poste": str(c.idPoste),
-                "magasin_id": str(c.idMagasin) if c.idMagasin else "7",
-                "code_barre": vrai_code_barre,
-                "nom_piece": nom_piece,
-                "statut": c.statutCommande,
-                "ligne": ligne,
-                "colonne": colonne,
-                "stock": stock,
-                "timestamp": c.dateCommande.isoformat() if c.dateCommande else None
-            })
-            
-        return taches
+        return [tache_commande(c) for c in commandes]
     finally:
         db.close()
 
+def tache_commande(c):
+    """Commande telle que l'affichent les écrans (liste en cours et évènement nouvelle_commande)."""
+    stock = c.boite.nbBoite if c.boite else 0
+
+    # On récupère le code-barre pour l'affichage des cases
+    vrai_code_barre = c.boite.code_barre if c.boite else "Inconnu"
+
+    # Récupération du nom de la pièce
+    nom_piece = "Inconnu"
+    if c.boite and c.boite.piece:
+        nom_piece = c.boite.piece.nomPiece
+    else:
+        nom_piece = vrai_code_barre
+
+    ligne, colonne = 1, 1
+    if c.boite and c.boite.Cases:
+        case = c.boite.Cases[0]
+        ligne = case.ligne
+        colonne = case.colonne
+
+    return {
+        "id": c.idCommande,
+        "poste": str(c.idPoste),
+        "magasin_id": str(c.idMagasin) if c.idMagasin else "7",
+        "code_barre": vrai_code_barre,
+        "nom_piece": nom_piece,
+        "statut": c.statutCommande,
+        "ligne": ligne,
+        "colonne": colonne,
+        "stock": stock,
+        "quantite": c.quantite or 1,
+        "timestamp": c.dateCommande.isoformat() if c.dateCommande else None
+    }
+
 class StatutUpdate(BaseModel):
     nouveau_statut: str
 
+async def diffuser_statut(commande, statut):
+    """Évènement statut_commande : les écrans mettent la tâche à jour sans recharger la liste."""
+    await manager.broadcast(
+        {"type": "statut_commande", "id_commande": commande["idCommande"], "statut": statut,
+         "quantite": commande.get("quantite"),
+         "poste": commande["idPoste"], "magasin_id": commande["idMagasin"], "mode": commande["typeCommande"]},
+        {"poste": commande["idPoste"], "magasin": commande["idMagasin"], "mode": commande["typeCommande"]},
+    )
+
+class StatutsLot(BaseModel):
+    ids: Optional[List[int]] = None    # Commandes à faire avancer...
+    id_magasin: Optional[int] = None   # ... ou toutes celles à récupérer à ce magasin
+    mode: str = "Normal"
+
+async def diffuser_statuts(commandes):
+    """Évènement statuts_commandes : un seul message par mode pour tout un arrêt du train."""
+    par_mode = {}
+    for c in commandes:
+        par_mode.setdefault(c["typeCommande"], []).append(c)
+    for mode, lot in par_mode.items():
+        await manager.broadcast(
+            {"type": "statuts_commandes", "mode": mode, "commandes": [
+                {"id_commande": c["idCommande"], "statut": c["nouveau_statut"], "quantite": c["quantite"],
+                 "poste": c["idPoste"], "magasin_id": c["idMagasin"]} for c in lot
+            ]},
+            {"poste": sorted({c["idPoste"] for c in lot if c["idPoste"] is not None}),
+             "magasin": sorted({c["idMagasin"] for c in lot if c["idMagasin"] is not None}), "mode": mode},
+        )
+
+async def diffuser_restes(restes):
+    """Évènement nouvelle_commande pour les boîtes restées à récupérer après une récupération partielle."""
+    for reste in restes:
+        tache = await asyncio.to_thread(lire_tache, reste["idCommande"])
+        await manager.broadcast({"type": "nouvelle_commande", "mode": reste["typeCommande"], **tache},
+                                {"poste": reste["idPoste"], "magasin": reste["idMagasin"], "mode": reste["typeCommande"]})
+
+@app.put("/api/commandes/statut")
+async def update_statuts(lot: StatutsLot):
+    """
+    Fait avancer plusieurs commandes en un aller-retour (arrêt du train à un stand) :
+    une transaction, un évènement WebSocket. Les commandes refusées (introuvables,
+    déjà avancées, boîte vide) sont listées dans "rejets", les autres avancent quand même.
+    """
+    if (lot.ids is None) == (lot.id_magasin is None):
+        raise HTTPException(status_code=400, detail="Indiquer soit ids, soit id_magasin")
+    try:
+        resultat = await asyncio.to_thread(requetes.changer_statuts_commandes, lot.ids, lot.id_magasin, lot.mode)
+        if resultat["commandes"]:
+            await diffuser_statuts(resultat["commandes"])
+        await diffuser_restes(resultat["restes"])
+        return {
+            "status": "ok",
+            "commandes": [{"id_commande": c["idCommande"], "nouveau_statut": c["nouveau_statut"], "quantite": c["quantite"]}
+                          for c in resultat["commandes"]],
+            "rejets": resultat["rejets"],
+            "restes": [r["idCommande"] for r in resultat["restes"]],
+        }
+    except Exception as e:
+        print(f"Erreur serveur update statuts: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.put("/api/commande/{id_commande}/statut")
-def update_statut(id_commande: int, update: StatutUpdate):
+async def update_statut(id_commande: int, update: StatutUpdate):
     """
     Appelle la requête qui permet de changer le statut de la commande id_commande
     """
     try:
-        resultat = requetes.changer_statut_commande(id_commande)
+        resultat = await asyncio.to_thread(requetes.changer_statut_commande, id_commande)
         
         if resultat.get("status") == "error":
             raise HTTPException(status_code=404, detail=resultat.get("message", "Commande introuvable"))
-            
-        return {"status": "ok", "nouveau_statut": resultat["commande"]["nouveau_statut"]}
+        if resultat.get("status") == "stock_epuise":
+            raise HTTPException(status_code=409, detail=resultat["message"])
+
+        await diffuser_statut(resultat["commande"], resultat["commande"]["nouveau_statut"])
+        if resultat["reste"]:
+            await diffuser_restes([resultat["reste"]])
+        return {"status": "ok", "nouveau_statut": resultat["commande"]["nouveau_statut"],
+                "quantite": resultat["commande"]["quantite"],
+                "reste": resultat["reste"]["idCommande"] if resultat["reste"] else None}
 
     except HTTPException as he:
         raise he # Empêche le bloc Exception de transformer la 404 en 500
@@ -617,14 +1266,15 @@ def get_stands():
     
 
 @app.put("/api/commande/{id_commande}/manquant")
-def set_commande_manquant(id_commande: int):
+async def set_commande_manquant(id_commande: int):
     """
     Appelle la requête qui change le statut de la commande en Produit manquant
     """
     try:
-        succes = requetes.declarer_commande_manquante(id_commande)
-        if not succes:
+        commande = await asyncio.to_thread(requetes.declarer_commande_manquante, id_commande)
+        if not commande:
             raise HTTPException(status_code=404, detail="Commande introuvable")
+        await diffuser_statut(commande, "Produit manquant")
         return {"status": "ok"}
     except HTTPException as he:
         raise he
@@ -633,15 +1283,16 @@ def set_commande_manquant(id_commande: int):
         raise HTTPException(status_code=500, detail=str(e))
         
 @app.delete("/api/commande/{id_commande}")
-def delete_commande_endpoint(id_commande: int):
+async def delete_commande_endpoint(id_commande: int):
     """
     Appelle la requête qui change le statut de la commande en Annulée
     """
     try:
-        succes = requetes.supprimer_commande(id_commande)
-        if not succes:
+        commande = await asyncio.to_thread(requetes.supprimer_commande, id_commande)
+        if not commande:
             raise HTTPException(status_code=404, detail="Commande introuvable")
-            
+        await diffuser_statut(commande, "Annulée")
+
         return {"status": "ok", "message": f"Commande {id_commande} supprimée"}
         
     except HTTPException as he:
@@ -662,13 +1313,14 @@ def get_train_position(mode: str = "Normal"):
     return {"position": pos}
 
 @app.put("/api/train/position")
-def update_train_position(update: TrainPosUpdate, mode: str = "Normal"): # On ajoute mode ici
+async def update_train_position(update: TrainPosUpdate, mode: str = "Normal"): # On ajoute mode ici
     """
     Appelle la requête qui change la change la position du train à update.position
     """
     try:
         # On passe update.position ET le mode à ta fonction de requête
-        nouvelle_pos = requetes.update_position_train(update.position, mode=mode)
+        nouvelle_pos = await asyncio.to_thread(requetes.update_position_train, update.position, mode)
+        await manager.broadcast({"type": "train_position", "mode": mode, "position": nouvelle_pos}, {"mode": mode})
         return {"status": "ok", "position": nouvelle_pos}
     except Exception as e:
         print(f"Erreur update train: {e}")
@@ -677,9 +1329,10 @@ def update_train_position(update: TrainPosUpdate, mode: str = "Normal"): # On aj
 @app.post("/api/admin/clear")
 async def clear_database_endpoint():
     try:
-        success = requetes.clear_production_data()
+        success = await asyncio.to_thread(requetes.clear_production_data)
         if not success:
             raise HTTPException(status_code=500, detail="Erreur technique lors du vidage")
+        await manager.broadcast({"type": "commandes_videes", "mode": None})
         return {"status": "ok", "message": "La base de données de production a été vidée."}
             
     except Exception as e:
@@ -692,17 +1345,28 @@ class CustomOrderPayload(BaseModel):
     statut: str
 
 @app.post("/api/admin/custom-order")
-def post_custom_order(payload: CustomOrderPayload):
+async def post_custom_order(payload: CustomOrderPayload):
     # On appelle la fonction de requetes.py
-    res = requetes.creer_commande_personnalisee(
+    res = await asyncio.to_thread(
+        requetes.creer_commande_personnalisee,
         payload.idBoite, 
         payload.idPoste, 
         payload.statut
     )
     if not res:
         raise HTTPException(status_code=400, detail="Erreur lors de la création")
+    tache = await asyncio.to_thread(lire_tache, res.idCommande)
+    await manager.broadcast({"type": "nouvelle_commande", "mode": "Personnalisé", **tache},
+                            {"poste": payload.idPoste, "magasin": res.idMagasin, "mode": "Personnalisé"})
     return {"status": "ok"}
 
+def lire_tache(id_commande):
+    db = SessionLocal()
+    try:
+        return tache_commande(db.get(Commande, id_commande))
+    finally:
+        db.close()
+
 @app.get("/api/admin/stocks")
 def get_admin_stocks():
     """Route appelée par le Frontend pour remplir la liste des objets"""
@@ -715,8 +1379,9 @@ def get_admin_stocks():
         return []
     
 @app.delete("/api/admin/custom-order/all")
-def clear_custom_orders():
-    if requetes.supprimer_commandes_personnalisees():
+async def clear_custom_orders():
+    if await asyncio.to_thread(requetes.supprimer_commandes_personnalisees):
+        await manager.broadcast({"type": "commandes_videes", "mode": "Personnalisé"}, {"mode": "Personnalisé"})
         return {"status": "ok"}
     raise HTTPException(status_code=500, detail="Erreur lors du vidage")
 
@@ -731,7 +1396,7 @@ def export_csv(type: str, mode: str = "Normal", cycle_id: str = None):
     writer = csv.writer(output, delimiter=';')
 
     if type == "dashboard":
-        data = get_admin_dashboard(mode)
+        data = get_admin_dashboard(mode, cycle_id)
         # En-têtes clairs pour les outils de stats
         writer.writerow(["Horodatage", "ID_Cycle", "Objet", "Quantite", "Source", "Destination", "Statut"])
         
@@ -790,12 +1455,15 @@ async def create_piece_et_boite(request: Request):
         nouvelle_boite = Boite(
             idPiece=nouvelle_piece.idPiece,
             code_barre=cb,
-            nbBoite=10,
+            nbBoite=0,
             idMagasin=None,
             idPoste=None,
             approvisionnement=120
         )
         db.add(nouvelle_boite)
+        db.flush()
+        # Stock initial de 10 journalisé dans le registre
+        enregistrer_mouvement(db, nouvelle_boite.idBoite, 10, "creation")
         
         db.commit()
         return {"status": "ok", "message": "Pièce et Boîte créées avec succès"}
@@ -822,19 +1490,74 @@ async def get_boites_details():
     finally:
         db.close()
 
+class StockBoiteUpdate(BaseModel):
+    idBoite: int
+    nbBoite: int
+
 @app.post("/api/admin/update-stock-boite")
-async def update_stock_boite(request: Request):
-    data = await request.json()
-    id_boite = data.get("idBoite")
-    nouveau_nb = data.get("nbBoite")
-    
+def update_stock_boite(payload: StockBoiteUpdate):
+    """Inventaire d'une boîte : fixe son stock à la valeur comptée."""
+    if payload.nbBoite < 0:
+        raise HTTPException(status_code=400, detail="Le stock ne peut pas être négatif")
+
     db = SessionLocal()
     try:
-        boite = db.query(Boite).filter(Boite.idBoite == id_boite).first()
-        if boite:
-            boite.nbBoite = nouveau_nb
-            db.commit()
-            return {"status": "ok"}
-        raise HTTPException(status_code=404, detail="Boîte non trouvée")
+        # L'écart avec le stock courant est journalisé (écriture optimiste, voir stock.inventorier)
+        if inventorier(db, payload.idBoite, payload.nbBoite) is None:
+            raise HTTPException(status_code=404, detail="Boîte non trouvée")
+        db.commit()
+        return {"status": "ok"}
+    finally:
+        db.close()
+
+@app.get("/api/stock/forecast")
+def get_prevision_stock(mode: str = "Normal"):
+    """
+    Prévision de rupture par boîte pour un type de cycle : consommation lissée (EWMA),
+    apport du simulateur et minutes avant rupture, les plus urgentes d'abord.
+    """
+    db = SessionLocal()
+    try:
+        return prevision.previsions(db, mode)
+    finally:
+        db.close()
+
+@app.get("/api/stock/{id_boite}")
+def get_stock_boite(id_boite: int, date: Optional[datetime] = None):
+    """Stock d'une boîte, maintenant ou à l'instant `date` (reconstitué depuis le registre)."""
+    db = SessionLocal()
+    try:
+        valeur = stock_a(db, id_boite, date)
+        if valeur is None:
+            raise HTTPException(status_code=404, detail="Aucun historique de stock pour cette boîte à cette date")
+        return {"idBoite": id_boite, "date": (date or datetime.now()).isoformat(), "stock": valeur}
     finally:
         db.close()
+
+@app.get("/api/stock/{id_boite}/historique")
+def get_historique_stock(id_boite: int, debut: Optional[datetime] = None, fin: Optional[datetime] = None):
+    """Courbe de stock d'une boîte (par défaut sur les dernières 24 h)."""
+    db = SessionLocal()
+    try:
+        debut = debut or datetime.now() - timedelta(days=1)
+        return historique(db, id_boite, debut, fin)
+    finally:
+        db.close()
+
+@app.post("/api/admin/archiver")
+def archiver_cycles(retention_jours: int = archive.RETENTION_JOURS):
+    """Archive tout de suite les cycles clos depuis plus de retention_jours jours."""
+    if retention_jours < 0:
+        raise HTTPException(status_code=400, detail="retention_jours doit être positif")
+    bilan = executer_archivage(retention_jours)
+    if bilan is None:
+        raise HTTPException(status_code=500, detail="Erreur lors de l'archivage des cycles")
+    return bilan
+
+@app.post("/api/admin/stock/compacter")
+def compacter_stock():
+    """Déclenche la compaction du registre de stock sans attendre la tâche périodique."""
+    bilan = executer_compaction_stock()
+    if bilan is None:
+        raise HTTPException(status_code=500, detail="Erreur lors de la compaction du registre de stock")
+    return bilan
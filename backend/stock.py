@@ -0,0 +1,272 @@
+"""
+Registre du stock des boîtes : journal de mouvements en ajout seul et instantanés.
+
+- Toute écriture de stock (récupération -1, approvisionnement +1, inventaire,
+  création) passe par enregistrer_mouvements : le mouvement est ajouté au journal
+  et Boite.nbBoite, valeur courante matérialisée, est ajusté dans la même transaction.
+- stock_a() reconstitue le stock d'une boîte à n'importe quel instant : dernier
+  instantané antérieur + mouvements postérieurs, lus sur l'index (idBoite, date).
+- historique() renvoie la courbe de stock d'une période en un seul parcours d'index.
+- compacter() prend un instantané des boîtes qui ont bougé, réaligne le journal sur
+  les écritures faites hors registre, puis purge les mouvements couverts par un
+  instantané plus ancien que la rétention.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from database import Boite, InstantaneStock, MouvementStock
+
+RETENTION_JOURS = 30
+
+
+class StockEpuise(Exception):
+    """Une sortie de stock ferait passer une boîte sous zéro."""
+    def __init__(self, id_boite, demande):
+        self.id_boite = id_boite
+        self.demande = demande
+        super().__init__(f"Stock épuisé pour la boîte {id_boite} ({demande} demandée(s))")
+
+
+def enregistrer_mouvements(db: Session, mouvements, date=None):
+    """
+    Ajoute des mouvements au journal et ajuste Boite.nbBoite, sans commit.
+    `mouvements` : liste de dicts {"idBoite", "delta", "motif", "idCommande" (optionnel)}.
+    Les sorties sont des UPDATE conditionnels (nbBoite + delta >= 0) : si le stock ne
+    suffit pas, StockEpuise est levée et l'appelant doit annuler la transaction.
+    Retourne {idBoite: nouveau stock} pour les boîtes décrémentées.
+    """
+    if not mouvements:
+        return {}
+    date = date or datetime.now()
+
+    par_boite = {}
+    for m in mouvements:
+        par_boite[m["idBoite"]] = par_boite.get(m["idBoite"], 0) + m["delta"]
+
+    boites = Boite.__table__
+    restants = {}
+    # Sorties : une par boîte, atomique (pas de lecture préalable, donc pas de mise à jour perdue)
+    for id_boite, delta in par_boite.items():
+        if delta < 0:
+            ligne = db.execute(
+                update(boites)
+                .where(boites.c.idBoite == id_boite, func.coalesce(boites.c.nbBoite, 0) + delta >= 0)
+                .values(nbBoite=func.coalesce(boites.c.nbBoite, 0) + delta)
+                .returning(boites.c.nbBoite)
+            ).first()
+            if ligne is None:
+                raise StockEpuise(id_boite, -delta)
+            restants[id_boite] = ligne[0]
+
+    # Entrées : un seul executemany
+    params = [{"b_id": id_boite, "b_delta": delta} for id_boite, delta in par_boite.items() if delta > 0]
+    if params:
+        db.execute(
+            update(boites)
+            .where(boites.c.idBoite == bindparam("b_id"))
+            .values(nbBoite=func.coalesce(boites.c.nbBoite, 0) + bindparam("b_delta")),
+            params,
+        )
+
+    db.execute(insert(MouvementStock), [
+        {
+            "idBoite": m["idBoite"],
+            "date": date,
+            "delta": m["delta"],
+            "motif": m["motif"],
+            "idCommande": m.get("idCommande"),
+        }
+        for m in mouvements
+    ])
+    return restants
+
+def enregistrer_mouvement(db: Session, id_boite, delta, motif, id_commande=None):
+    """Raccourci pour un seul mouvement (voir enregistrer_mouvements)."""
+    return enregistrer_mouvements(db, [{"idBoite": id_boite, "delta": delta, "motif": motif, "idCommande": id_commande}])
+
+def inventorier(db: Session, id_boite, nouveau_nb, essais=5):
+    """
+    Fixe le stock d'une boîte à une valeur comptée : l'écart avec le stock courant
+    est journalisé comme mouvement "inventaire". Écriture optimiste : le nouveau
+    stock n'est posé que si nbBoite n'a pas bougé depuis la lecture, sinon on relit.
+    Retourne l'écart, None si la boîte n'existe pas.
+    """
+    boites = Boite.__table__
+    for _ in range(essais):
+        boite = db.query(Boite.idBoite, Boite.nbBoite).filter(Boite.idBoite == id_boite).first()
+        if not boite:
+            return None
+        delta = int(nouveau_nb) - (boite.nbBoite or 0)
+        if not delta:
+            return 0
+        maj = db.execute(
+            update(boites)
+            .where(boites.c.idBoite == id_boite, boites.c.nbBoite.is_(boite.nbBoite))
+            .values(nbBoite=int(nouveau_nb))
+        ).rowcount
+        if maj:
+            db.execute(insert(MouvementStock), [{
+                "idBoite": id_boite, "date": datetime.now(), "delta": delta, "motif": "inventaire",
+            }])
+            return delta
+    raise RuntimeError(f"Inventaire de la boîte {id_boite} impossible : stock modifié en continu")
+
+
+# ---------- LECTURE ----------
+
+def stock_a(db: Session, id_boite, date=None):
+    """
+    Stock d'une boîte à l'instant `date` (maintenant si None) :
+    dernier instantané antérieur + somme des mouvements qui le suivent.
+    Avant la rétention, seuls les instantanés subsistent : la valeur est celle du
+    dernier instantané. Retourne None si la boîte n'a aucun historique à cette date.
+    """
+    q = db.query(InstantaneStock.nbBoite, InstantaneStock.idMouvement).filter(InstantaneStock.idBoite == id_boite)
+    if date is not None:
+        q = q.filter(InstantaneStock.date <= date)
+    instantane = q.order_by(InstantaneStock.date.desc(), InstantaneStock.idInstantane.desc()).first()
+    base, dernier_mouvement = instantane if instantane else (0, 0)
+
+    q = db.query(func.coalesce(func.sum(MouvementStock.delta), 0), func.count(MouvementStock.idMouvement)).filter(
+        MouvementStock.idBoite == id_boite,
+        MouvementStock.idMouvement > dernier_mouvement,
+    )
+    if date is not None:
+        q = q.filter(MouvementStock.date <= date)
+    somme, nb = q.one()
+
+    if instantane is None and nb == 0:
+        return None
+    return base + somme
+
+def historique(db: Session, id_boite, debut, fin=None):
+    """
+    Courbe de stock d'une boîte entre `debut` et `fin` : valeur au début puis un point
+    par mouvement (un parcours de l'index (idBoite, date)).
+    """
+    fin = fin or datetime.now()
+    stock = stock_a(db, id_boite, debut)
+    if stock is None:
+        # L'historique de la boîte commence après `debut` : la courbe part de son premier instantané
+        premier = db.query(InstantaneStock.date, InstantaneStock.nbBoite).filter(
+            InstantaneStock.idBoite == id_boite,
+            InstantaneStock.date > debut,
+            InstantaneStock.date <= fin,
+        ).order_by(InstantaneStock.date, InstantaneStock.idInstantane).first()
+        debut, stock = premier if premier else (debut, 0)
+    initial = stock
+    points = []
+    mouvements = db.query(MouvementStock.date, MouvementStock.delta, MouvementStock.motif).filter(
+        MouvementStock.idBoite == id_boite,
+        MouvementStock.date > debut,
+        MouvementStock.date <= fin,
+    ).order_by(MouvementStock.date, MouvementStock.idMouvement)
+    for date, delta, motif in mouvements:
+        stock += delta
+        points.append({"date": date.isoformat(), "delta": delta, "motif": motif, "stock": stock})
+    return {"idBoite": id_boite, "debut": debut.isoformat(), "fin": fin.isoformat(), "stock_initial": initial, "points": points}
+
+
+# ---------- INSTANTANÉS ET COMPACTION ----------
+
+def amorcer(db: Session, date=None):
+    """
+    Crée l'instantané de départ des boîtes sans aucun historique (boîtes créées
+    avant le registre ou insérées directement en base), à partir de Boite.nbBoite.
+    """
+    date = date or datetime.now()
+    avec_historique = select(InstantaneStock.idBoite).union(select(MouvementStock.idBoite))
+    sans_historique = select(Boite.idBoite, func.coalesce(Boite.nbBoite, 0)).where(Boite.idBoite.not_in(avec_historique))
+    lignes = [
+        {"idBoite": id_boite, "date": date, "nbBoite": nb, "idMouvement": 0}
+        for id_boite, nb in db.execute(sans_historique)
+    ]
+    if lignes:
+        db.execute(insert(InstantaneStock), lignes)
+    return len(lignes)
+
+def _derniers_instantanes(db: Session):
+    """{idBoite: (nbBoite, idMouvement)} du dernier instantané de chaque boîte."""
+    derniers_ids = select(func.max(InstantaneStock.idInstantane)).group_by(InstantaneStock.idBoite)
+    return {
+        id_boite: (nb, id_mv)
+        for id_boite, nb, id_mv in db.query(
+            InstantaneStock.idBoite, InstantaneStock.nbBoite, InstantaneStock.idMouvement
+        ).filter(InstantaneStock.idInstantane.in_(derniers_ids))
+    }
+
+def _mouvements_non_couverts(db: Session, derniers):
+    """{idBoite: (somme des deltas, dernier idMouvement)} des mouvements postérieurs au dernier instantané."""
+    resultat = {}
+    for id_boite, id_mv, delta in db.query(
+        MouvementStock.idBoite, MouvementStock.idMouvement, MouvementStock.delta
+    ).filter(MouvementStock.idMouvement > min((v[1] for v in derniers.values()), default=0)):
+        if id_mv > derniers.get(id_boite, (0, 0))[1]:
+            somme, dernier = resultat.get(id_boite, (0, 0))
+            resultat[id_boite] = (somme + delta, max(dernier, id_mv))
+    return resultat
+
+def prendre_instantanes(db: Session, date=None):
+    """
+    Instantané de chaque boîte ayant des mouvements depuis son dernier instantané.
+    Les écarts entre le journal et Boite.nbBoite (écriture faite hors registre)
+    sont d'abord journalisés comme mouvements "ecart" pour que le journal reste exact.
+    Retourne (nb_instantanes, nb_ecarts).
+    """
+    date = date or datetime.now()
+    derniers = _derniers_instantanes(db)
+    non_couverts = _mouvements_non_couverts(db, derniers)
+
+    derives = {id_boite: nb for id_boite, (nb, _) in derniers.items()}
+    for id_boite, (somme, _) in non_couverts.items():
+        derives[id_boite] = derives.get(id_boite, 0) + somme
+
+    ecarts = []
+    for id_boite, nb in db.query(Boite.idBoite, Boite.nbBoite).filter(Boite.idBoite.in_(list(derives))):
+        if (nb or 0) != derives[id_boite]:
+            logging.warning(f"[STOCK] Écart sur la boîte {id_boite} : journal {derives[id_boite]}, nbBoite {nb}")
+            ecarts.append({"idBoite": id_boite, "date": date, "delta": (nb or 0) - derives[id_boite], "motif": "ecart"})
+    if ecarts:
+        # Journalisé sans retoucher nbBoite, qui fait foi ici
+        db.execute(insert(MouvementStock), ecarts)
+        non_couverts = _mouvements_non_couverts(db, derniers)
+        for e in ecarts:
+            derives[e["idBoite"]] += e["delta"]
+
+    lignes = [
+        {"idBoite": id_boite, "date": date, "nbBoite": derives[id_boite], "idMouvement": id_mv}
+        for id_boite, (_, id_mv) in non_couverts.items()
+    ]
+    if lignes:
+        db.execute(insert(InstantaneStock), lignes)
+    return len(lignes), len(ecarts)
+
+def compacter(db: Session, retention_jours=RETENTION_JOURS, date=None):
+    """
+    Tâche de compaction (sans commit) : amorçage des nouvelles boîtes, instantanés,
+    puis suppression des mouvements plus anciens que la rétention déjà couverts
+    par un instantané lui aussi antérieur à la limite.
+    """
+    date = date or datetime.now()
+    amorcees = amorcer(db, date)
+    nb_instantanes, nb_ecarts = prendre_instantanes(db, date)
+
+    limite = date - timedelta(days=retention_jours)
+    mv = MouvementStock.__table__
+    couverture = select(func.max(InstantaneStock.idMouvement)).where(
+        InstantaneStock.idBoite == mv.c.idBoite,
+        InstantaneStock.date < limite,
+    ).scalar_subquery()
+    supprimes = db.execute(
+        mv.delete().where(mv.c.date < limite, mv.c.idMouvement <= couverture)
+    ).rowcount
+
+    return {
+        "amorcees": amorcees,
+        "instantanes": nb_instantanes,
+        "ecarts": nb_ecarts,
+        "mouvements_supprimes": supprimes,
+    }
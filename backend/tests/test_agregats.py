@@ -0,0 +1,68 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+import agregats
+import requetes
+from database import SessionLocal, Boite, Commande
+from generation_donnees import generer_base
+
+
+def _brut(db, debut, fin, colonne):
+    """Quantités calculées directement sur commandes (référence)."""
+    lignes = db.query(colonne, Boite.idPiece, func.count(Commande.idCommande)).join(
+        Boite, Boite.idBoite == Commande.idBoite
+    ).filter(
+        Commande.statutCommande == "Commande finie",
+        Commande.dateCommande >= debut,
+        Commande.dateCommande <= fin,
+    ).group_by(colonne, Boite.idPiece)
+    return {(stand, piece): q for stand, piece, q in lignes}
+
+def test_decouper_periode():
+    """Mois, jours puis heures entiers, puis lecture directe des bornes."""
+    debut, fin = datetime(2024, 1, 1, 22, 30), datetime(2024, 1, 4, 1, 15)
+    d = agregats.decouper_periode(debut, fin)
+    assert d["mois"] == []
+    assert d["jours"] == [(datetime(2024, 1, 2), datetime(2024, 1, 4))]
+    assert d["heures"] == [(datetime(2024, 1, 1, 23), datetime(2024, 1, 2)), (datetime(2024, 1, 4), datetime(2024, 1, 4, 1))]
+    assert d["direct"] == [(debut, datetime(2024, 1, 1, 23), False), (datetime(2024, 1, 4, 1), fin, True)]
+
+    annee = agregats.decouper_periode(datetime(2023, 12, 30, 12), datetime(2024, 3, 2, 6))
+    assert annee["mois"] == [(datetime(2024, 1, 1), datetime(2024, 3, 1))]
+    assert annee["jours"] == [(datetime(2023, 12, 31), datetime(2024, 1, 1)), (datetime(2024, 3, 1), datetime(2024, 3, 2))]
+
+    court = agregats.decouper_periode(datetime(2024, 1, 1, 8, 10), datetime(2024, 1, 1, 8, 50))
+    assert court == {"mois": [], "jours": [], "heures": [], "direct": [(datetime(2024, 1, 1, 8, 10), datetime(2024, 1, 1, 8, 50), True)]}
+
+def test_agregats_identiques_au_calcul_direct():
+    """Sur des bornes quelconques, agrégats + bornes directes = calcul complet sur commandes."""
+    generer_base(nb_pieces=20, nb_stands=7, nb_cycles=6, nb_commandes=3000)
+    rng = random.Random(1)
+    db = SessionLocal()
+    try:
+        premiere, derniere = db.query(func.min(Commande.dateCommande), func.max(Commande.dateCommande)).one()
+        etendue = (derniere - premiere).total_seconds()
+        for _ in range(10):
+            a = premiere + timedelta(seconds=rng.random() * etendue)
+            b = a + timedelta(seconds=rng.random() * (derniere - a).total_seconds())
+            assert agregats.quantites_par_piece(db, a, b, "poste") == _brut(db, a, b, Commande.idPoste)
+            assert agregats.quantites_par_piece(db, a, b, "magasin") == _brut(db, a, b, Commande.idMagasin)
+    finally:
+        db.close()
+
+def test_agregats_tenus_a_jour_par_les_transitions():
+    """Finir une commande l'ajoute aux agrégats ; l'annuler l'en retire."""
+    generer_base(nb_pieces=5, nb_stands=7, nb_cycles=1, nb_commandes=0)
+    cmd = requetes.creer_commande_personnalisee(1, 1)
+    debut, fin = datetime.now() - timedelta(days=2), datetime.now() + timedelta(days=1)
+    requetes.changer_statut_commande(cmd.idCommande)
+    assert requetes.get_pieces_arrivees_postes(debut, fin) == []
+
+    requetes.changer_statut_commande(cmd.idCommande)
+    stats = requetes.get_pieces_arrivees_postes(debut, fin)
+    assert [(s["idPoste"], s["quantite"]) for s in stats] == [(1, 1)]
+
+    requetes.supprimer_commande(cmd.idCommande)
+    assert requetes.get_boites_recuperees_magasins(debut, fin) == []
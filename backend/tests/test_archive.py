@@ -0,0 +1,108 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+import archive
+import kpi
+import requetes
+from database import SessionLocal, reset_db, data_db, ArchiveCycle, Commande, Cycle, KpiCycle
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """Deux vieux cycles (janvier et février) et un cycle récent, archives dans un dossier temporaire."""
+    monkeypatch.setattr(archive, "DOSSIER_ARCHIVES", str(tmp_path))
+    reset_db()
+    data_db()
+    db = SessionLocal()
+    debuts = [datetime(2024, 1, 10, 8), datetime(2024, 2, 5, 8), datetime.now() - timedelta(hours=2)]
+    for debut in debuts:
+        db.add(Cycle(date_debut=debut, date_fin=debut + timedelta(hours=1), type_cycle="Normal"))
+        for i, statut in enumerate(["Commande finie", "Commande finie", "Produit manquant", "A récupérer"]):
+            date = debut + timedelta(minutes=10 * i)
+            db.add(Commande(
+                idBoite=1, idPoste=1, idMagasin=5, typeCommande="Normal", statutCommande=statut, dateCommande=date,
+                date_recuperation=date + timedelta(minutes=2) if statut != "A récupérer" else None,
+                date_livraison=date + timedelta(minutes=5) if statut != "A récupérer" else None,
+            ))
+    db.commit()
+    yield db, debuts, tmp_path
+    db.close()
+
+def test_archivage_par_mois_et_lecture_transparente(base):
+    db, debuts, dossier = base
+    ancien = debuts[0].strftime("%Y-%m-%d %H:%M:%S")
+    logs_avant = requetes.get_commandes_cycle_logs(debuts[0])
+
+    bilan = archive.archiver(retention_jours=30)
+    assert bilan == {"cycles": 2, "commandes": 6, "fichiers": ["archive_2024_01.db", "archive_2024_02.db"]}
+    assert sorted(os.listdir(dossier)) == bilan["fichiers"]
+
+    # Base chaude : le cycle récent et les commandes ouvertes seulement
+    assert db.query(Cycle).count() == 1
+    assert db.query(Commande).count() == 4 + 2
+    assert db.query(KpiCycle).count() == 0
+    assert db.query(ArchiveCycle).count() == 2
+
+    # Les anciens cycle_id restent lisibles
+    assert requetes.get_commandes_cycle_logs(debuts[0]) == logs_avant
+    assert [c.statutCommande for c in requetes.get_commandes_cycle(debuts[0])] == ["Commande finie"] * 2
+    assert [c.date_debut for c in requetes.get_all_cycles()] == sorted(debuts, reverse=True)
+    entree = archive.trouver_cycle(db, datetime.strptime(ancien, "%Y-%m-%d %H:%M:%S"))
+    resultat = archive.kpi_cycle_archive(entree)
+    assert resultat["global"]["nb_commandes"] == 4 and resultat["global"]["nb_manquants"] == 1
+
+    # Deuxième passage : rien à déplacer, fichiers intacts
+    assert archive.archiver(retention_jours=30)["cycles"] == 0
+    assert len(requetes.get_commandes_cycle(debuts[1])) == 2
+
+def test_archivage_api_et_remise_a_zero(base, monkeypatch):
+    from fastapi.testclient import TestClient
+    from server import app
+
+    db, debuts, dossier = base
+    ancien = debuts[1].strftime("%Y-%m-%d %H:%M:%S")
+    with TestClient(app) as client:
+        assert client.post("/api/admin/archiver?retention_jours=-1").status_code == 400
+        assert client.post("/api/admin/archiver?retention_jours=30").json()["cycles"] == 2
+        assert client.get(f"/api/admin/kpi/{ancien}?mode=Normal").json()["global"]["nb_commandes"] == 4
+        assert any("Livré" in l for l in client.get(f"/api/admin/logs/{ancien}?mode=Normal").json()["logs"])
+        assert ancien in [c["id"] for c in client.get("/api/admin/cycles?mode=Normal").json()]
+
+    # Vidage annulé (commit en échec) : index et fichiers d'archive restent cohérents
+    def commit_en_echec(self):
+        raise RuntimeError("base verrouillée")
+    with monkeypatch.context() as m:
+        m.setattr(Session, "commit", commit_en_echec)
+        assert not requetes.clear_production_data()
+    assert len(os.listdir(dossier)) == 2
+    assert debuts[1] in [c.date_debut for c in requetes.get_all_cycles()]
+
+    assert requetes.clear_production_data()
+    assert os.listdir(dossier) == []
+    assert requetes.get_all_cycles() == []
+
+def test_tableau_de_bord_et_csv_incluent_les_archives(base):
+    """Un cycle archivé garde son historique dans le tableau de bord et dans l'export CSV."""
+    from fastapi.testclient import TestClient
+    from server import app
+
+    db, debuts, dossier = base
+    ancien = debuts[0].strftime("%Y-%m-%d %H:%M:%S")
+    with TestClient(app) as client:
+        avant = client.get("/api/admin/dashboard?mode=Normal").json()["historique"]
+        assert client.post("/api/admin/archiver?retention_jours=30").json()["cycles"] == 2
+
+        apres = client.get("/api/admin/dashboard?mode=Normal").json()["historique"]
+        cle = lambda h: (str(h["cycle_id"]), h["objet"], h["statut"], h["count"])
+        assert sorted(map(cle, apres)) == sorted(map(cle, avant))
+
+        du_cycle = client.get(f"/api/admin/dashboard?mode=Normal&cycle_id={ancien}").json()["historique"]
+        assert {h["cycle_id"] for h in du_cycle} == {ancien}
+        assert sorted((h["statut"], h["count"]) for h in du_cycle) == [("A récupérer", 1), ("Commande finie", 2), ("Produit manquant", 1)]
+
+        csv = client.get(f"/api/admin/export-csv?type=dashboard&mode=Normal&cycle_id={ancien}").text
+        lignes = [l for l in csv.splitlines()[1:] if l]
+        assert len(lignes) == 3 and all(ancien in l for l in lignes)
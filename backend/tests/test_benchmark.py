@@ -0,0 +1,19 @@
+from benchmark import comparer_a_reference, generer_csv_etagere
+
+def test_comparer_a_reference_detecte_regression():
+    """Seules les mesures dont la médiane dépasse le seuil sont signalées."""
+    reference = {"1000": {"scan": {"mediane_ms": 10.0}, "dashboard": {"mediane_ms": 100.0}}}
+    resultats = {"1000": {"scan": {"mediane_ms": 11.0}, "dashboard": {"mediane_ms": 150.0}, "nouveau": {"mediane_ms": 5.0}}}
+
+    regressions = comparer_a_reference(resultats, reference, seuil=0.2)
+
+    assert len(regressions) == 1
+    assert regressions[0]["mesure"] == "dashboard"
+    assert regressions[0]["ratio"] == 1.5
+
+def test_generer_csv_etagere_dimensions():
+    csv_content = generer_csv_etagere(["A", "B"], nb_lignes=4, nb_colonnes=6)
+    lignes = csv_content.splitlines()
+    assert lignes[0] == "Magasin benchmark"
+    assert len(lignes) == 5
+    assert all(len(l.split(",")) == 6 for l in lignes[1:])
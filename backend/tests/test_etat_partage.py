@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+import etat_partage
+from etat_partage import EtatLocal, EtatSqlite, creer_etat
+
+
+def test_deux_workers_sqlite():
+    """Deux workers : valeur partagée, diffusion vers l'autre seulement, un seul leader à la fois."""
+    a, b = EtatSqlite(intervalle=0.01), EtatSqlite(intervalle=0.01)
+    with a.engine.begin() as conn:
+        conn.execute(etat_partage.table_baux.delete())
+        conn.execute(etat_partage.table_valeurs.delete().where(etat_partage.table_valeurs.c.cle == "compteur"))
+
+    a.ecrire("mode", "Personnalisé")
+    assert b.lire("mode") == "Personnalisé"
+    assert b.lire("absent", "Normal") == "Normal"
+    assert a.incrementer("compteur", 500) == 500 and b.incrementer("compteur", 500) == 501
+
+    recus_a, recus_b = [], []
+    a.abonner("ws", recus_a.append)
+    b.abonner("ws", recus_b.append)
+
+    async def scenario():
+        await a.demarrer()
+        await b.demarrer()
+        for i in range(3):
+            a.publier("ws", f"msg{i}")
+        for _ in range(100):
+            if len(recus_b) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await a.arreter()
+        await b.arreter()
+    asyncio.run(scenario())
+    assert recus_b == ["msg0", "msg1", "msg2"]
+    assert recus_a == []
+
+    assert a.tenter_bail("leader", duree=0.2)
+    assert not b.tenter_bail("leader", duree=0.2)
+    assert a.tenter_bail("leader", duree=0.2)  # renouvellement
+    time.sleep(0.25)
+    assert b.tenter_bail("leader", duree=10)   # bail expiré : b prend la main
+    assert not a.tenter_bail("leader")
+    b.liberer_bail("leader")
+    assert a.tenter_bail("leader")
+
+def test_anti_rebond_commun_aux_workers():
+    """Une double lecture reçue par deux workers n'est écrite qu'une fois ; la réservation expire."""
+    from doublons import FiltreDoublons
+
+    a, b = EtatSqlite(), EtatSqlite()
+    filtre_a, filtre_b = FiltreDoublons(fenetre=0.2), FiltreDoublons(fenetre=0.2)
+    filtre_a.partager(a)
+    filtre_b.partager(b)
+    filtre_a.vider()
+
+    assert filtre_a.reserver(1, "VIS-0004") == (True, None)
+    assert filtre_b.reserver(1, "VIS-0004") == (False, None)      # premier scan encore en cours
+    filtre_a.confirmer(1, "VIS-0004", None, 42)
+    assert filtre_b.reserver(1, "VIS-0004") == (False, 42)
+    assert filtre_b.reserver(2, "VIS-0004") == (True, None)       # autre poste
+    filtre_b.liberer(2, "VIS-0004")
+    assert filtre_a.reserver(2, "VIS-0004") == (True, None)
+
+    time.sleep(0.25)
+    assert filtre_b.reserver(1, "VIS-0004") == (True, None)       # fenêtre écoulée
+
+def test_etat_local_et_choix_du_backend(monkeypatch):
+    local = creer_etat("local")
+    assert isinstance(local, EtatLocal) and not local.distribue
+    local.ecrire("mode", "Normal")
+    assert local.lire("mode") == "Normal" and local.tenter_bail("leader")
+    assert [local.incrementer("seq", 10) for _ in range(3)] == [10, 11, 12]
+
+    monkeypatch.setenv("TRAIN_ETAT", "sqlite")
+    assert isinstance(creer_etat(), EtatSqlite)
+    with pytest.raises(ValueError):
+        creer_etat("redis")
@@ -0,0 +1,25 @@
+from database import SessionLocal, Boite, Case, Commande, Cycle, Stand
+from generation_donnees import generer_base
+
+def test_generer_base_volumes_et_coherence():
+    """La base générée respecte les volumes demandés et les règles métier."""
+    resume = generer_base(nb_pieces=30, nb_stands=7, nb_cycles=5, nb_commandes=500)
+    assert resume["commandes"] == 500
+
+    db = SessionLocal()
+    try:
+        assert db.query(Boite).count() == 30
+        assert db.query(Stand).filter(Stand.categorie == 0).count() == 3
+        assert db.query(Case).count() == 30
+        assert db.query(Commande).count() == 500
+
+        # Un seul cycle ouvert, et les commandes en attente n'existent que dans celui-ci
+        ouverts = db.query(Cycle).filter(Cycle.date_fin == None).all()
+        assert len(ouverts) == 1
+        en_attente = db.query(Commande).filter(Commande.statutCommande.in_(["A récupérer", "A déposer"])).all()
+        assert all(c.dateCommande >= ouverts[0].date_debut for c in en_attente)
+
+        # Les SKU suivent la logique de generer_sku
+        assert db.query(Boite).filter_by(idBoite=3).first().code_barre == "VIS-0003"
+    finally:
+        db.close()
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime, timedelta
+
+import kpi
+import requetes
+from database import SessionLocal, reset_db, data_db, Cycle, KpiCycle
+
+
+def test_repartition():
+    """Quantiles au rang inférieur sur une liste triée, None sans valeur."""
+    assert kpi._repartition([]) is None
+    r = kpi._repartition([float(i) for i in range(1, 101)])
+    assert (r["p50"], r["p90"], r["p95"], r["max"], r["nb"]) == (51.0, 91.0, 96.0, 100.0, 100)
+
+def test_kpi_incremental_identique_au_calcul_de_cloture():
+    """L'accumulateur du cycle en cours donne les mêmes KPI que le recalcul sur les commandes."""
+    reset_db()
+    data_db()
+    db = SessionLocal()
+    try:
+        cycle = Cycle(date_debut=datetime.now() - timedelta(seconds=1), type_cycle="Personnalisé")
+        db.add(cycle)
+        db.commit()
+        kpi.en_cours.demarrer(cycle)
+
+        ids = [requetes.creer_commande_personnalisee(b, poste).idCommande for b, poste in [(1, 1), (2, 1), (3, 2), (4, 2)]]
+        for id_commande in ids[:3]:
+            requetes.changer_statut_commande(id_commande)   # récupération
+        requetes.changer_statut_commande(ids[0])            # livraison
+        requetes.declarer_commande_manquante(ids[3])
+
+        live = kpi.kpi_cycle(db, cycle)
+        assert live["en_cours"] is True
+        assert live["global"]["nb_commandes"] == 4
+        assert live["global"]["demande_recuperation"]["nb"] == 3
+        assert live["global"]["recuperation_livraison"]["nb"] == 1
+        assert live["postes"]["2"]["taux_manquant"] == 0.5
+
+        # Mêmes durées et compteurs ; seule la cadence horaire dépend de l'instant de lecture
+        recalcul = kpi.accumuler_cycle(db, cycle).resultat(cycle)
+        sans_cadence = lambda r: [
+            {c: v for c, v in bloc.items() if c != "commandes_par_heure"}
+            for bloc in [r["global"], *r["postes"].values(), *r["magasins"].values()]
+        ]
+        assert sans_cadence(recalcul) == sans_cadence(live)
+
+        # Clôture : calcul unique, mis en cache, l'accumulateur est libéré
+        cycle.date_fin = datetime.now()
+        kpi.calculer_et_stocker(db, cycle)
+        db.commit()
+        kpi.en_cours.arreter(cycle.type_cycle)
+        cache = json.loads(db.get(KpiCycle, cycle.idCycle).resultat)
+        assert cache["en_cours"] is False and cache["global"]["nb_commandes"] == 4
+        assert kpi.kpi_cycle(db, cycle) == cache
+
+        # Une commande d'un autre cycle n'alimente plus rien
+        requetes.creer_commande_personnalisee(1, 1)
+        assert json.loads(db.get(KpiCycle, cycle.idCycle).resultat)["global"]["nb_commandes"] == 4
+    finally:
+        db.close()
@@ -0,0 +1,60 @@
+import types
+
+import lecteur_hid
+from lecteur_hid import DecodeurHidPos, identifiants_configures, lister_scanners
+
+
+def rapport(donnees: bytes, suite=False):
+    """Rapport "Scanned Data" HID-POS de 64 octets."""
+    r = bytearray(64)
+    r[0], r[1] = 0x02, len(donnees)
+    r[2:5] = b"]E0"
+    r[5:5 + len(donnees)] = donnees
+    r[63] = 0x01 if suite else 0x00
+    return list(r)
+
+def test_decodeur_hid_pos():
+    """Un code dans un rapport, un code sur deux rapports, les autres rapports ignorés."""
+    decodeur = DecodeurHidPos()
+    assert decodeur.ajouter(rapport(b"VIS-0004\r")) == "VIS-0004"
+    assert decodeur.ajouter([0x04, 1, 0, 0, 0, 0]) is None   # autre rapport (état, etc.)
+    assert decodeur.ajouter(rapport(b"A" * 56, suite=True)) is None
+    assert decodeur.ajouter(rapport(b"BC")) == "A" * 56 + "BC"
+    assert not decodeur.morceaux
+
+def test_enumeration_scanners(monkeypatch):
+    """Page d'usage POS ou VID:PID configuré ; un seul lecteur par chemin."""
+    peripheriques = [
+        {"path": b"1", "vendor_id": 0x0c2e, "product_id": 0x0b61, "usage_page": 0x8C},
+        {"path": b"1", "vendor_id": 0x0c2e, "product_id": 0x0b61, "usage_page": 0x8C},
+        {"path": b"2", "vendor_id": 0x05e0, "product_id": 0x1200, "usage_page": 0x01},
+        {"path": b"3", "vendor_id": 0x046d, "product_id": 0xc52b, "usage_page": 0x01},  # souris
+    ]
+    monkeypatch.setattr(lecteur_hid, "hid", types.SimpleNamespace(enumerate=lambda: peripheriques))
+    assert identifiants_configures("05e0:1200, ") == {(0x05e0, 0x1200)}
+    assert [i["path"] for i in lister_scanners({(0x05e0, 0x1200)})] == [b"1", b"2"]
+    assert [i["path"] for i in lister_scanners(set())] == [b"1"]
+
+    monkeypatch.setattr(lecteur_hid, "hid", None)
+    assert lister_scanners() == []
+
+def test_erreur_ouverture_affichee(monkeypatch, capsys):
+    """Un scanner qu'on ne peut pas ouvrir (droits) est signalé à chaque tentative, pas ignoré en silence."""
+    class Peripherique:
+        def open_path(self, chemin):
+            raise OSError("open failed")
+
+    class Arret(Exception):
+        pass
+
+    def dormir(_):
+        raise Arret   # Une seule tentative
+
+    monkeypatch.setattr(lecteur_hid, "hid", types.SimpleNamespace(device=Peripherique))
+    monkeypatch.setattr(lecteur_hid.time, "sleep", dormir)
+    info = {"path": b"1", "vendor_id": 0x0c2e, "product_id": 0x0b61, "product_string": "Xenon"}
+    try:
+        lecteur_hid.lire_scanner(info, 3, lambda *a: None)
+    except Arret:
+        pass
+    assert "[⚠️] Xenon 0c2e:0b61 indisponible (zapette 3) : open failed" in capsys.readouterr().out
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from prevision_stock import PrevisionStock, estimer
+
+
+def test_estimer_rupture_et_apport():
+    """Le temps avant rupture tient compte de l'apport ; sans baisse nette il n'y a pas de rupture."""
+    # 60 boîtes/h consommées, 6/h apportées : 10 boîtes durent 10 / 54 h
+    assert estimer(60, 10, 600)["minutes_avant_rupture"] == 11.1
+    assert estimer(600, 10, 60)["minutes_avant_rupture"] is None
+    assert estimer(60, 0, 600)["minutes_avant_rupture"] == 0.0
+    # Plus de commande depuis 1 h : l'intervalle effectif s'allonge
+    assert estimer(60, 10, 0, depuis_derniere=3600)["taux_horaire"] == 1.0
+
+def test_observer_incremental_une_alerte_par_episode():
+    """L'EWMA est mise à jour scan par scan et l'alerte n'est émise qu'au franchissement du seuil."""
+    p = PrevisionStock(alpha=0.5, seuil_minutes=15)
+    t = datetime(2024, 1, 1, 8)
+    assert p.observer(1, "Normal", t, 10, 600) is None           # première commande : pas d'intervalle
+    alerte = p.observer(1, "Normal", t + timedelta(seconds=60), 10, 600)
+    assert alerte["minutes_avant_rupture"] == 11.1
+    assert p.observer(1, "Normal", t + timedelta(seconds=120), 9, 600) is None  # déjà signalée
+
+    # Une longue pause fait remonter l'intervalle lissé : fin de l'épisode
+    assert p.observer(1, "Normal", t + timedelta(hours=2), 9, 600) is None
+    assert p.etats[(1, "Normal")]["intervalle"] == 0.5 * 3600 + 0.5 * 60
+    # Le type de cycle a sa propre série
+    assert (1, "Personnalisé") not in p.etats
+
+def test_scan_regroupe_meme_mesure_qu_apres_redemarrage():
+    """Un scan ajouté à une commande existante ne change pas l'intervalle : charger() ne le reverrait pas."""
+    p = PrevisionStock(alpha=0.5, seuil_minutes=15)
+    t = datetime(2024, 1, 1, 8)
+    p.observer(1, "Normal", t, 10, 0)
+    p.observer(1, "Normal", t + timedelta(seconds=600), 10, 0)
+    intervalle = p.etats[(1, "Normal")]["intervalle"]
+
+    # Regroupé : même intervalle, mais le stock disponible plus bas est bien réévalué
+    alerte = p.observer(1, "Normal", t + timedelta(seconds=601), 1, 0, nouvelle_commande=False)
+    assert p.etats[(1, "Normal")]["intervalle"] == intervalle and p.etats[(1, "Normal")]["n"] == 2
+    assert alerte is not None and alerte["stock_disponible"] == 1
@@ -0,0 +1,29 @@
+from encodage import MessageDiffuse
+from relecture import TamponRelecture
+
+
+def test_relecture_memoire_disque_et_trou():
+    """Les messages déversés sur disque sont relus ; un trou dans la suite impose un rechargement."""
+    tampon = TamponRelecture(capacite=4, lot=2, capacite_disque=5)
+    tampon.creer_table()
+    tampon.vider()
+    for seq in range(101, 109):
+        lot = tampon.ajouter(seq, MessageDiffuse({"n": seq}), {"poste": seq % 2})
+        if lot:
+            tampon.deverser(lot)
+    # Lot sorti de la mémoire mais pas encore écrit : toujours relu
+    lot = tampon.ajouter(109, MessageDiffuse({"n": 109}), {"poste": 1})
+    assert [s for s, _, _ in lot] == [105, 106]
+    assert tampon.ajouter(110, MessageDiffuse({"n": 110}), {"poste": 0}) is None
+    assert len(tampon.memoire) <= 4
+    assert [m.donnees["n"] for _, m, _ in tampon.depuis(104, 110)] == list(range(105, 111))
+    tampon.deverser(lot)
+    assert not tampon.en_transit
+
+    assert [m.donnees["n"] for _, m, _ in tampon.depuis(107, 110)] == [108, 109, 110]  # mémoire seule
+    relus = tampon.depuis(104, 110)                                                # disque + mémoire
+    assert [m.donnees["n"] for _, m, _ in relus] == [105, 106, 107, 108, 109, 110]
+    assert tampon.depuis(110, 110) == []
+    assert tampon.depuis(100, 110) is None   # 101 est sorti du disque (capacite_disque)
+    assert tampon.depuis(120, 110) is None   # compteur d'un autre lancement
+    tampon.vider()
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import securite
+from database import SessionLocal, reset_db, Login
+
+
+def test_hachage_et_migration():
+    """scrypt salé (deux hachages différents), refus du clair, migration des anciennes bases."""
+    h1, h2 = securite.hacher_mot_de_passe("secret"), securite.hacher_mot_de_passe("secret")
+    assert h1 != h2
+    assert securite.verifier_mot_de_passe("secret", h1)
+    assert not securite.verifier_mot_de_passe("autre", h1)
+    assert not securite.verifier_mot_de_passe("secret", "secret")
+
+    reset_db()
+    db = SessionLocal()
+    try:
+        db.add(Login(username="ancien", password="clair", email=""))
+        db.commit()
+        assert securite.migrer_mots_de_passe(db) == 1
+        db.commit()
+        assert securite.migrer_mots_de_passe(db) == 0
+    finally:
+        db.close()
+    securite.cache_verifications.vider()
+    assert securite.authentifier("ancien", "clair")
+    assert not securite.authentifier("ancien", "faux")
+    assert not securite.authentifier("inconnu", "clair")
+
+def test_rafale_de_connexions_et_jeton_expire(monkeypatch):
+    """Une rafale de tablettes reste servie : les reconnexions passent par le cache, pas par scrypt."""
+    reset_db()
+    db = SessionLocal()
+    db.add(Login(username="ancien", password=securite.hacher_mot_de_passe("clair"), email=""))
+    db.commit()
+    db.close()
+    securite.cache_verifications.vider()
+    appels = []
+    verifier = securite.verifier_mot_de_passe
+    monkeypatch.setattr(securite, "verifier_mot_de_passe", lambda *a: appels.append(a) or verifier(*a))
+    assert securite.authentifier("ancien", "clair")
+    with ThreadPoolExecutor(8) as pool:
+        assert all(pool.map(lambda _: securite.authentifier("ancien", "clair"), range(200)))
+    assert len(appels) == 1
+
+    assert securite.verifier_jeton(securite.creer_jeton("ancien", duree=-1)) is None
+    assert securite.verifier_jeton("pas.un-jeton") is None
+
+    limiteur = securite.LimiteurDebit(capacite=2, recharge=1)
+    assert [limiteur.attente("ip") for _ in range(5)] == [0] * 5     # vérifier ne consomme rien
+    limiteur.noter_echec("ip")
+    limiteur.noter_echec("ip")
+    assert limiteur.attente("ip") > 0 and limiteur.attente("autre") == 0
@@ -8,12 +8,18 @@ from sqlalchemy import insert
 from server import app
 from database import SessionLocal, reset_db, data_db, Stand, Piece, Boite, Commande, Cycle, Login
 import requetes
+import traces
+from doublons import filtre_scans
 
 @pytest.fixture(scope="function")
-def client():
+def client(monkeypatch):
     """Réinitialise la base et utilise les données initiales de database.py."""
     reset_db()
     data_db()  # Remplit automatiquement les pièces, boîtes, stands (1-7) et l'utilisateur 'test'
+    # Les tests rescannent volontairement le même code : pas de fenêtre anti-rebond (voir test_scan_doublons)
+    filtre_scans.vider()
+    monkeypatch.setattr(filtre_scans.rebonds, "duree", 0)
+    traces.registre.vider()
     
     with TestClient(app) as c:
         yield c
@@ -397,9 +403,13 @@ def test_get_commandes_en_cours_orphan(client):
     assert any(c["nom_piece"] == "Inconnu" for c in res.json())
 
 def test_login_database_crash(client, monkeypatch):
-    """Simule une erreur SQLite pour couvrir le bloc except sqlite3.Error."""
-    # On force une erreur en pointant vers un fichier impossible à ouvrir
-    monkeypatch.setattr("os.path.join", lambda *args: "/path/invalid/db.db")
+    """Simule une erreur de base pendant la vérification pour couvrir la réponse 500."""
+    from sqlalchemy.exc import OperationalError
+    import securite
+
+    def session_cassee():
+        raise OperationalError("SELECT", {}, Exception("base inaccessible"))
+    monkeypatch.setattr(securite, "SessionLocal", session_cassee)
     
     res = client.post("/api/login", json={"username": "test", "password": "123"})
     assert res.status_code == 500
@@ -492,4 +502,475 @@ def test_update_statut_server_error(client, monkeypatch):
     
     assert res.status_code == 500
     # On vérifie que le message d'erreur propagé est bien celui de l'exception
-    assert res.json()["detail"] == "Erreur Interne"
\ No newline at end of file
+    assert res.json()["detail"] == "Erreur Interne"
+
+
+def test_metrics_prometheus(client):
+    """Vérifie que /metrics expose la latence par route et le nombre de requêtes SQL."""
+    client.get("/api/commandes/en_cours?mode=Normal")
+    client.put("/api/commande/9999/manquant")
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    texte = res.text
+    assert 'train_http_duree_secondes_count{methode="GET",route="/api/commandes/en_cours",statut="200"}' in texte
+    # Le modèle de chemin est utilisé, pas l'URL avec l'identifiant
+    assert 'route="/api/commande/{id_commande}/manquant",statut="404"' in texte
+    assert 'train_http_requetes_sql_count{methode="GET",route="/api/commandes/en_cours"}' in texte
+    assert "train_sql_requetes_total" in texte
+
+def test_trace_scan_bout_en_bout(client):
+    """Un scan tracé alimente la répartition par étape et la liste des scans lents."""
+    import time
+    p = requetes.create_piece("Trace")
+    requetes.create_boite(p.idPiece, "CB-TRACE", 10, idMagasin=7)
+
+    t = time.monotonic()
+    trace = {"id": "trace-test", "t_lecture": t - 0.01, "t_envoi": t - 0.005, "h_envoi": time.time() - 0.005}
+    res = client.post("/scan", json={"poste": 1, "code_barre": "CB-TRACE", "trace": trace})
+    assert res.json()["trace_id"] == "trace-test"
+
+    assert client.post("/api/traces/trace-test/affichage").status_code == 200
+    premier_affichage = traces.registre.traces["trace-test"]["t_affichage"]
+    # Deuxième écran : l'affichage mesuré reste celui du premier
+    assert client.post("/api/traces/trace-test/affichage").status_code == 200
+    assert traces.registre.traces["trace-test"]["t_affichage"] == premier_affichage
+    assert client.post("/api/traces/inconnue/affichage").status_code == 404
+
+    etapes = client.get("/api/traces/latence").json()["etapes"]
+    for nom in ("lecture_envoi", "envoi_reception", "reception_base", "base_broadcast", "broadcast_affichage", "total"):
+        assert etapes[nom]["nb"] == 1
+
+    lentes = client.get("/api/traces/lentes?limite=5").json()
+    assert any(l["id"] == "trace-test" and l["code_barre"] == "CB-TRACE" for l in lentes)
+
+    # Horloges monotones de deux processus : jamais comparées entre elles
+    assert "envoi_reception" not in traces.registre.durees({"t_envoi": 5.0, "t_reception": 5.001})
+
+def test_stand_layout_api_et_etag(client):
+    """La disposition est servie par l'API avec un ETag qui change à chaque nouvel import."""
+    assert client.get("/api/stands/6/layout").status_code == 404
+
+    payload = {"posteId": 6, "csv_content": "Tour\nVIS-0004,VIS-0004\nX,PHA-0001"}
+    client.post("/api/admin/upload-config", json=payload)
+
+    res = client.get("/api/stands/6/layout")
+    assert res.status_code == 200
+    etag = res.headers["etag"]
+    assert res.json()["layout"]["templateColumns"] == "repeat(2, 1fr)"
+    assert res.json()["items"][0] == {"id": "0-0", "val": "VIS-0004", "style": {"gridRow": "1 / span 1", "gridColumn": "1 / span 2"}}
+
+    assert client.get("/api/stands/6/layout", headers={"If-None-Match": etag}).status_code == 304
+
+    payload["csv_content"] = "Tour\nVIS-0004,X"
+    client.post("/api/admin/upload-config", json=payload)
+    res2 = client.get("/api/stands/6/layout", headers={"If-None-Match": etag})
+    assert res2.status_code == 200
+    assert res2.headers["etag"] != etag
+
+def test_upload_config_multiple_zip(client):
+    """Import d'une archive zip : dry-run puis application, les dispositions sont servies ensuite."""
+    import base64
+    import io
+    import zipfile
+
+    tampon = io.BytesIO()
+    with zipfile.ZipFile(tampon, "w") as z:
+        z.writestr("etagere_4.csv", "Presse\nVIS-0004,X")
+        z.writestr("etagere_6.csv", "Tour\nPHA-0001")
+    payload = {"zip_base64": base64.b64encode(tampon.getvalue()).decode(), "dry_run": True}
+
+    res = client.post("/api/admin/upload-config-multiple", json=payload)
+    assert res.status_code == 200 and res.json()["dry_run"] is True
+    assert client.get("/api/stands/4/layout").status_code == 404
+
+    payload["dry_run"] = False
+    res = client.post("/api/admin/upload-config-multiple", json=payload)
+    assert res.status_code == 200
+    assert [s["cases"]["ajoutees"] for s in res.json()["stands"]] == [1, 1]
+    assert client.get("/api/stands/6/layout").json()["items"][0]["val"] == "PHA-0001"
+
+    assert client.post("/api/admin/upload-config-multiple", json={}).status_code == 400
+
+def test_historique_stock_api(client):
+    """Une récupération et un inventaire apparaissent dans la courbe de stock de la boîte."""
+    client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+    db = SessionLocal()
+    try:
+        id_commande = db.query(Commande).filter(Commande.idBoite == 4).first().idCommande
+    finally:
+        db.close()
+    assert client.put(f"/api/commande/{id_commande}/statut", json={"nouveau_statut": "A déposer"}).status_code == 200
+    client.post("/api/admin/update-stock-boite", json={"idBoite": 4, "nbBoite": 25})
+
+    courbe = client.get("/api/stock/4/historique").json()
+    assert [(p["motif"], p["stock"]) for p in courbe["points"]][-2:] == [("recuperation", 9), ("inventaire", 25)]
+    assert client.get("/api/stock/4").json()["stock"] == 25
+    assert client.get("/api/stock/4?date=2000-01-01T00:00:00").status_code == 404
+
+def test_prevision_stock_alerte_websocket(client):
+    """Des scans rapprochés sur une boîte presque vide déclenchent une alerte WebSocket et la prévision."""
+    client.post("/api/set-active-mode", json={"mode": "Normal"})
+    db = SessionLocal()
+    try:
+        db.query(Boite).filter(Boite.idBoite == 4).update({Boite.nbBoite: 3})
+        db.commit()
+    finally:
+        db.close()
+
+    with client.websocket_connect("/ws/scans") as ws:
+        client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+        assert "type" not in ws.receive_json()
+        # Autre poste : deuxième commande (un rescan du poste 1 serait regroupé, sans nouvel intervalle)
+        client.post("/scan", json={"poste": 2, "code_barre": "VIS-0004"})
+        assert "type" not in ws.receive_json()
+        alerte = ws.receive_json()
+    assert alerte["type"] == "alerte_stock" and alerte["idBoite"] == 4
+    assert alerte["stock_disponible"] == 1
+
+    previsions = client.get("/api/stock/forecast?mode=Normal").json()
+    assert previsions[0]["idBoite"] == 4 and previsions[0]["alerte"] is True
+
+def test_kpi_cycle_api(client):
+    """KPI en direct pendant le cycle, puis figés en cache à l'arrêt."""
+    client.post("/api/set-active-mode", json={"mode": "Normal"})
+    date_id = datetime.fromisoformat(client.post("/api/cycle/start?mode=Normal").json()["date_debut"]).strftime("%Y-%m-%d %H:%M:%S")
+    client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+
+    live = client.get(f"/api/admin/kpi/{date_id}?mode=Normal").json()
+    assert live["en_cours"] is True and live["global"]["nb_commandes"] == 1
+    assert live["postes"]["1"]["nb_commandes"] == 1
+
+    assert client.post("/api/cycle/stop").json()["status"] == "ok"
+    final = client.get(f"/api/admin/kpi/{date_id}?mode=Normal").json()
+    assert final["en_cours"] is False and final["global"]["nb_commandes"] == 1
+    assert client.get("/api/admin/kpi/2000-01-01 00:00:00").status_code == 404
+    assert client.get("/api/admin/kpi/pas-une-date").status_code == 400
+
+def test_login_jeton_et_limiteur(client):
+    """Mot de passe haché en base, jeton de session signé ; 429 après la rafale d'échecs, pas pour les succès."""
+    import securite
+    securite.limiteur_login.reinitialiser()
+    db = SessionLocal()
+    try:
+        assert db.query(Login).filter_by(username="test").first().password.startswith("scrypt$")
+    finally:
+        db.close()
+
+    jeton = client.post("/api/login", json={"username": "test", "password": "password123"}).json()["token"]
+    session = client.get("/api/session", headers={"Authorization": f"Bearer {jeton}"})
+    assert session.status_code == 200 and session.json()["username"] == "test"
+    falsifie = jeton[:-2] + ("AA" if not jeton.endswith("AA") else "BB")
+    assert client.get("/api/session", headers={"Authorization": f"Bearer {falsifie}"}).status_code == 401
+    assert client.get("/api/session").status_code == 401
+
+    # Tablettes qui se reconnectent : les succès ne consomment rien
+    assert {client.post("/api/login", json={"username": "test", "password": "password123"}).status_code
+            for _ in range(securite.TENTATIVES_MAX + 2)} == {200}
+    codes = [client.post("/api/login", json={"username": "test", "password": "x"}).status_code
+             for _ in range(securite.TENTATIVES_MAX + 1)]
+    assert codes[-1] == 429 and set(codes[:-1]) == {401}
+    assert client.post("/api/login", json={"username": "test", "password": "password123"}).status_code == 429
+    securite.limiteur_login.reinitialiser()
+
+def test_websocket_abonnements_par_poste(client):
+    """Un client abonné au poste 2 ne reçoit pas les scans du poste 1 ; le mode filtre aussi."""
+    def postes_scannes(ws, n):
+        # Les messages typés (alerte de stock, accusé d'abonnement) ne sont pas des scans
+        postes = []
+        while len(postes) < n:
+            data = ws.receive_json()
+            if "type" not in data:
+                postes.append(data["poste"])
+        return postes
+
+    client.post("/api/set-active-mode", json={"mode": "Normal"})
+    with client.websocket_connect("/ws/scans?poste=2&mode=Normal") as poste2, \
+         client.websocket_connect("/ws/scans?mode=Personnalisé") as autre_mode, \
+         client.websocket_connect("/ws/scans") as tout:
+        client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+        client.post("/scan", json={"poste": 2, "code_barre": "VIS-0004"})
+        assert postes_scannes(poste2, 1) == [2]
+        assert postes_scannes(tout, 2) == [1, 2]
+
+        # Changement d'abonnement en cours de connexion, confirmé par le serveur
+        autre_mode.send_json({"action": "abonner", "poste": [1], "mode": "Normal"})
+        assert autre_mode.receive_json() == {"type": "abonnement", "sujets": ["poste:1"], "mode": "Normal"}
+        client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+        assert postes_scannes(autre_mode, 1) == [1]
+        assert postes_scannes(tout, 1) == [1]
+
+    from server import manager
+    assert manager.destinataires({"poste": 1}) == set()
+
+def test_websocket_reprise_sans_trou(client):
+    """Reconnexion avec last_seq : seuls les scans manqués du poste suivi sont rejoués."""
+    def scans(ws, n):
+        recus = []
+        while len(recus) < n:
+            data = ws.receive_json()
+            if "type" not in data:
+                recus.append(data)
+        return recus
+
+    client.post("/api/set-active-mode", json={"mode": "Normal"})
+    with client.websocket_connect("/ws/scans?poste=2") as ws:
+        client.post("/scan", json={"poste": 2, "code_barre": "VIS-0004"})
+        last_seq = scans(ws, 1)[0]["seq"]
+
+    # Pendant la coupure : un scan d'un autre poste, puis un du poste 2
+    client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+    client.post("/scan", json={"poste": 2, "code_barre": "VIS-0004"})
+
+    with client.websocket_connect(f"/ws/scans?poste=2&last_seq={last_seq}") as ws:
+        client.post("/scan", json={"poste": 2, "code_barre": "VIS-0004"})
+        rejoue, direct = scans(ws, 2)
+        assert rejoue["poste"] == 2 and last_seq < rejoue["seq"] < direct["seq"]
+
+    # Trou trop ancien : le client doit tout recharger
+    with client.websocket_connect("/ws/scans?last_seq=1") as ws:
+        assert ws.receive_json()["type"] == "resync"
+
+def test_evenements_position_et_statut(client):
+    """Position du train et transitions de commande poussées sur le WebSocket, typées."""
+    def evenement(ws, type_attendu):
+        while True:
+            data = ws.receive_json()
+            if data.get("type") == type_attendu:
+                return data
+
+    client.post("/api/set-active-mode", json={"mode": "Normal"})
+    with client.websocket_connect("/ws/scans?mode=Normal") as ws:
+        client.put("/api/train/position?mode=Normal", json={"position": "3"})
+        assert evenement(ws, "train_position")["position"] == 3
+
+        client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+        id_commande = ws.receive_json()["id_commande"]
+        client.put(f"/api/commande/{id_commande}/statut", json={"nouveau_statut": "x"})
+        data = evenement(ws, "statut_commande")
+        assert (data["id_commande"], data["statut"], data["poste"]) == (id_commande, "A déposer", 1)
+        client.delete(f"/api/commande/{id_commande}")
+        assert evenement(ws, "statut_commande")["statut"] == "Annulée"
+
+def test_websocket_encodages(client, monkeypatch):
+    """JSON compact par défaut, encodé une seule fois pour tous les clients ; format inconnu refusé."""
+    import encodage
+    from starlette.websockets import WebSocketDisconnect
+
+    encodes = []
+    encodeur, binaire = encodage.ENCODEURS["json"]
+    monkeypatch.setitem(encodage.ENCODEURS, "json", (lambda d: encodes.append(d.get("seq")) or encodeur(d), binaire))
+
+    with client.websocket_connect("/ws/scans") as a, client.websocket_connect("/ws/scans?format=json") as b:
+        client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+        texte_a, texte_b = a.receive_text(), b.receive_text()
+    assert texte_a == texte_b and '", "' not in texte_a
+    assert len(encodes) == len(set(encodes))   # une fois par message, pas par socket
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws/scans?format=xml") as ws:
+            ws.receive_text()
+    if encodage.msgpack is not None:
+        with client.websocket_connect("/ws/scans?format=msgpack") as ws:
+            client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"})
+            assert encodage.msgpack.unpackb(ws.receive_bytes())["poste"] == 1
+
+def test_canal_ingestion_accuse_et_doublons(client):
+    """Scans numérotés sur /ws/ingestion : accusé par lot, refus signalés, renvois ignorés."""
+    def nb_commandes():
+        db = SessionLocal()
+        try:
+            return db.query(Commande).count()
+        finally:
+            db.close()
+
+    avant = nb_commandes()
+    with client.websocket_connect("/ws/ingestion?emetteur=test-ingestion") as ws:
+        assert ws.receive_json() == {"type": "bienvenue", "dernier_seq": 0}
+        ws.send_json([{"seq": 1, "poste": 1, "code_barre": "VIS-0004"},
+                      {"seq": 2, "poste": 1, "code_barre": "INCONNU"},
+                      {"seq": 3, "poste": 2, "code_barre": "VIS-0004"}])
+        accuse = ws.receive_json()
+        while accuse["seq"] < 3:
+            accuse = ws.receive_json()
+        assert accuse["type"] == "ack"
+    assert nb_commandes() == avant + 2
+
+    # Reconnexion : le serveur annonce le dernier scan enregistré, un renvoi ne crée rien
+    with client.websocket_connect("/ws/ingestion?emetteur=test-ingestion") as ws:
+        assert ws.receive_json()["dernier_seq"] == 3
+        ws.send_json({"seq": 3, "poste": 2, "code_barre": "VIS-0004"})
+        assert ws.receive_json()["seq"] == 3
+    assert nb_commandes() == avant + 2
+
+def test_canal_ingestion_note_les_scans_sans_commande(client, monkeypatch):
+    """Rebond ou refus accusé puis socket fermée : le numéro est enregistré, l'émetteur ne le renverra pas."""
+    monkeypatch.setattr(filtre_scans.rebonds, "duree", 60)
+    with client.websocket_connect("/ws/ingestion?emetteur=test-rebond") as ws:
+        ws.receive_json()
+        ws.send_json({"seq": 1, "poste": 1, "code_barre": "VIS-0004"})
+        assert ws.receive_json()["seq"] == 1
+        # Fermeture sans attendre l'accusé
+        ws.send_json([{"seq": 2, "poste": 1, "code_barre": "VIS-0004"},
+                      {"seq": 3, "poste": 1, "code_barre": "INCONNU"}])
+
+    with client.websocket_connect("/ws/ingestion?emetteur=test-rebond") as ws:
+        assert ws.receive_json()["dernier_seq"] == 3
+
+def test_scan_doublons(client, monkeypatch):
+    """Rebond dans la fenêtre ou clé d'idempotence déjà vue : accusé, mais ni commande ni diffusion."""
+    monkeypatch.setattr(filtre_scans.rebonds, "duree", 60)
+    db = SessionLocal()
+    try:
+        avant = db.query(Commande).count()
+    finally:
+        db.close()
+
+    premier = client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"}).json()
+    rebond = client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"}).json()
+    assert rebond["doublon"] and rebond["id_commande"] == premier["id_commande"]
+    assert "doublon" not in client.post("/scan", json={"poste": 2, "code_barre": "VIS-0004"}).json()
+
+    # Refus (404) : rien n'est réservé, le code pourra être scanné normalement
+    assert client.post("/scan", json={"poste": 99, "code_barre": "VIS-0004"}).status_code == 404
+    assert "doublon" not in client.post("/scan", json={"poste": 99, "code_barre": "VIS-0004"}).json().get("detail", "")
+
+    monkeypatch.setattr(filtre_scans.rebonds, "duree", 0)
+    envoi = client.post("/scan", json={"poste": 3, "code_barre": "VIS-0004"}, headers={"Idempotency-Key": "abc"}).json()
+    renvoi = client.post("/scan", json={"poste": 3, "code_barre": "VIS-0004", "cle_idempotence": "abc"}).json()
+    assert renvoi["doublon"] and renvoi["id_commande"] == envoi["id_commande"]
+
+    db = SessionLocal()
+    try:
+        assert db.query(Commande).count() == avant + 3
+    finally:
+        db.close()
+
+def test_scans_regroupes_en_une_commande(client):
+    """Même boîte redemandée par le même poste avant récupération : une commande, quantite + 1, stock décrémenté d'autant."""
+    db = SessionLocal()
+    try:
+        stock_avant = db.query(Boite.nbBoite).filter_by(code_barre="VIS-0004").scalar()
+    finally:
+        db.close()
+
+    premier = client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"}).json()
+    second = client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"}).json()
+    assert second["id_commande"] == premier["id_commande"] and second["quantite"] == 2
+    # Autre poste : commande distincte
+    assert client.post("/scan", json={"poste": 2, "code_barre": "VIS-0004"}).json()["id_commande"] != premier["id_commande"]
+
+    id_commande = premier["id_commande"]
+    tache = next(t for t in client.get("/api/commandes/en_cours?mode=Normal").json() if t["id"] == id_commande)
+    assert tache["quantite"] == 2
+    assert client.put(f"/api/commande/{id_commande}/statut", json={"nouveau_statut": "A déposer"}).status_code == 200
+
+    db = SessionLocal()
+    try:
+        assert db.query(Boite.nbBoite).filter_by(code_barre="VIS-0004").scalar() == stock_avant - 2
+    finally:
+        db.close()
+
+    # Une fois récupérée, un nouveau scan ouvre une nouvelle commande
+    troisieme = client.post("/scan", json={"poste": 1, "code_barre": "VIS-0004"}).json()
+    assert troisieme["id_commande"] != id_commande and troisieme["quantite"] == 1
+
+def test_recuperation_partielle_commande_regroupee(client):
+    """Commande regroupée plus grande que le stock : le train emporte ce qu'il y a, le reste attend."""
+    def fixer_stock(nb):
+        db = SessionLocal()
+        try:
+            db.query(Boite).filter_by(code_barre="VIS-0007").update({Boite.nbBoite: nb})
+            db.commit()
+        finally:
+            db.close()
+
+    client.post("/api/set-active-mode", json={"mode": "Normal"})
+    for _ in range(3):
+        id_commande = client.post("/scan", json={"poste": 1, "code_barre": "VIS-0007"}).json()["id_commande"]
+    fixer_stock(2)
+
+    with client.websocket_connect("/ws/scans?mode=Normal") as ws:
+        res = client.put(f"/api/commande/{id_commande}/statut", json={"nouveau_statut": "A déposer"}).json()
+        assert res["nouveau_statut"] == "A déposer" and res["quantite"] == 2
+        while (data := ws.receive_json()).get("type") != "nouvelle_commande":
+            pass
+        assert data["id"] == res["reste"] and data["quantite"] == 1 and data["statut"] == "A récupérer"
+
+    db = SessionLocal()
+    try:
+        assert db.query(Boite.nbBoite).filter_by(code_barre="VIS-0007").scalar() == 0
+        reste = db.get(Commande, res["reste"])
+        assert (reste.idPoste, reste.statutCommande, reste.quantite) == (1, "A récupérer", 1)
+    finally:
+        db.close()
+    assert client.put(f"/api/commande/{res['reste']}/statut", json={"nouveau_statut": "A déposer"}).status_code == 409
+
+    # Même règle à l'arrêt du train
+    for _ in range(2):
+        id_lot = client.post("/scan", json={"poste": 2, "code_barre": "VIS-0007"}).json()["id_commande"]
+    fixer_stock(1)
+    res = client.put("/api/commandes/statut", json={"ids": [id_lot]}).json()
+    assert res["commandes"] == [{"id_commande": id_lot, "nouveau_statut": "A déposer", "quantite": 1}]
+    assert len(res["restes"]) == 1 and not res["rejets"]
+
+def test_statuts_par_lot(client):
+    """Arrêt du train : plusieurs commandes avancées en un appel, un seul évènement, boîte vide rejetée."""
+    def evenement(ws, type_attendu):
+        while True:
+            data = ws.receive_json()
+            if data.get("type") == type_attendu:
+                return data
+
+    db = SessionLocal()
+    try:
+        db.query(Boite).filter_by(code_barre="VIS-0005").update({Boite.nbBoite: 0})
+        db.query(Boite).filter_by(code_barre="VIS-0004").update({Boite.idMagasin: 6})
+        db.commit()
+        stock_avant = db.query(Boite.nbBoite).filter_by(code_barre="VIS-0004").scalar()
+    finally:
+        db.close()
+
+    client.post("/api/set-active-mode", json={"mode": "Normal"})
+    scanner = lambda poste, code: client.post("/scan", json={"poste": poste, "code_barre": code}).json()["id_commande"]
+    a, b, vide = scanner(1, "VIS-0004"), scanner(2, "VIS-0004"), scanner(1, "VIS-0005")
+
+    with client.websocket_connect("/ws/scans?mode=Normal") as ws:
+        res = client.put("/api/commandes/statut", json={"ids": [a, b, vide, 999999]}).json()
+        assert sorted(c["id_commande"] for c in res["commandes"]) == sorted([a, b])
+        assert {r["idCommande"]: r["status"] for r in res["rejets"]} == {vide: "stock_epuise", 999999: "error"}
+        data = evenement(ws, "statuts_commandes")
+        assert sorted(c["id_commande"] for c in data["commandes"]) == sorted([a, b])
+        assert {c["statut"] for c in data["commandes"]} == {"A déposer"}
+
+    db = SessionLocal()
+    try:
+        assert db.query(Boite.nbBoite).filter_by(code_barre="VIS-0004").scalar() == stock_avant - 2
+        assert db.get(Commande, vide).statutCommande == "A récupérer"
+    finally:
+        db.close()
+
+    res = client.put("/api/commandes/statut", json={"ids": [a, b]}).json()
+    assert {c["nouveau_statut"] for c in res["commandes"]} == {"Commande finie"}
+
+    # Toutes les récupérations d'un magasin
+    c = scanner(3, "VIS-0004")
+    res = client.put("/api/commandes/statut", json={"id_magasin": 6, "mode": "Normal"}).json()
+    assert [x["id_commande"] for x in res["commandes"]] == [c]
+
+    # Stock partiel : la première récupération passe, le dépôt de la même boîte aussi
+    depot = scanner(1, "VIS-0006")
+    client.put("/api/commandes/statut", json={"ids": [depot]})
+    r1, r2 = scanner(2, "VIS-0006"), scanner(3, "VIS-0006")
+    db = SessionLocal()
+    try:
+        db.query(Boite).filter_by(code_barre="VIS-0006").update({Boite.nbBoite: 1})
+        db.commit()
+    finally:
+        db.close()
+    res = client.put("/api/commandes/statut", json={"ids": [r2, depot, r1]}).json()
+    assert {x["id_commande"]: x["nouveau_statut"] for x in res["commandes"]} == {r1: "A déposer", depot: "Commande finie"}
+    assert [(r["idCommande"], r["status"]) for r in res["rejets"]] == [(r2, "stock_epuise")]
+
+    assert client.put("/api/commandes/statut", json={}).status_code == 400
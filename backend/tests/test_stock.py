@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+from database import SessionLocal, reset_db, data_db, Boite, MouvementStock, InstantaneStock
+from stock import enregistrer_mouvement, inventorier, stock_a, historique, amorcer, compacter
+
+
+def _base():
+    reset_db()
+    data_db()
+    db = SessionLocal()
+    amorcer(db, datetime(2024, 1, 1))
+    db.commit()
+    return db
+
+def test_stock_courant_et_voyage_dans_le_temps():
+    """Le stock se reconstitue à n'importe quel instant depuis instantané + mouvements."""
+    db = _base()
+    try:
+        t0 = datetime(2024, 1, 1)
+        enregistrer_mouvement(db, 1, -1, "recuperation", 42)
+        db.commit()
+        t1 = datetime.now()
+        enregistrer_mouvement(db, 1, 3, "approvisionnement")
+        assert inventorier(db, 1, 20) == 8
+        db.commit()
+
+        assert db.get(Boite, 1).nbBoite == 20
+        assert stock_a(db, 1) == 20
+        assert stock_a(db, 1, t0) == 10
+        assert stock_a(db, 1, t1) == 9
+        assert stock_a(db, 1, t0 - timedelta(days=1)) is None
+        assert inventorier(db, 9999, 3) is None
+
+        courbe = historique(db, 1, t0)
+        assert courbe["stock_initial"] == 10
+        assert [(p["motif"], p["stock"]) for p in courbe["points"]] == [
+            ("recuperation", 9), ("approvisionnement", 12), ("inventaire", 20),
+        ]
+    finally:
+        db.close()
+
+def test_compaction_purge_et_ecarts():
+    """La compaction purge les vieux mouvements sans changer le stock et rattrape les écritures hors registre."""
+    db = _base()
+    try:
+        vieux = datetime.now() - timedelta(days=60)
+        db.add(MouvementStock(idBoite=2, date=vieux, delta=-4, motif="recuperation"))
+        db.query(Boite).filter(Boite.idBoite == 2).update({Boite.nbBoite: Boite.nbBoite - 4})
+        # Écriture directe, hors registre
+        db.query(Boite).filter(Boite.idBoite == 3).update({Boite.nbBoite: 7})
+        db.commit()
+
+        # Un premier instantané plus ancien que la rétention couvre le vieux mouvement
+        bilan = compacter(db, date=vieux + timedelta(days=1))
+        db.commit()
+        assert bilan["ecarts"] == 1
+        assert stock_a(db, 3) == 7
+
+        bilan = compacter(db)
+        db.commit()
+        # Le vieux mouvement de la boîte 2 et l'écart de la boîte 3, tous deux couverts
+        assert bilan["mouvements_supprimes"] == 2
+        assert db.query(MouvementStock).filter(MouvementStock.idBoite == 2).count() == 0
+        assert stock_a(db, 2) == 6
+        assert db.query(InstantaneStock).filter(InstantaneStock.idBoite == 2).count() == 2
+    finally:
+        db.close()
+
+def test_transitions_concurrentes_sans_survente():
+    """Des validations parallèles ne font jamais passer le stock sous zéro ni ne décomptent deux fois."""
+    from concurrent.futures import ThreadPoolExecutor
+    from database import Commande
+    import requetes
+
+    db = _base()
+    try:
+        db.query(Boite).filter(Boite.idBoite == 5).update({Boite.nbBoite: 6})
+        db.commit()
+    finally:
+        db.close()
+    ids = [requetes.creer_commande_personnalisee(5, 1).idCommande for _ in range(15)]
+
+    # Chaque commande est validée deux fois en parallèle (double clic, deux écrans)
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        resultats = list(pool.map(requetes.changer_statut_commande, ids * 2))
+
+    statuts = [r["status"] for r in resultats]
+    assert "error" not in statuts
+    assert statuts.count("stock_epuise") >= 9
+
+    db = SessionLocal()
+    try:
+        assert db.get(Boite, 5).nbBoite == 0
+        recuperees = db.query(Commande).filter(Commande.idCommande.in_(ids), Commande.date_recuperation.isnot(None)).count()
+        sorties = db.query(MouvementStock).filter(MouvementStock.idBoite == 5, MouvementStock.motif == "recuperation").count()
+        assert recuperees == sorties == 6
+        assert db.query(Commande).filter(Commande.idCommande.in_(ids), Commande.statutCommande == "A récupérer").count() == 9
+    finally:
+        db.close()
@@ -0,0 +1,111 @@
+from update_grid import etiqueter_groupes
+
+def test_etiqueter_groupes_fusion_et_ordre():
+    """Les cellules adjacentes identiques forment un groupe, repéré par sa première cellule."""
+    grid = [
+        ["A", "A", "B"],
+        ["C", "A", "B"],
+        ["C", "", "A"],  # ce "A" n'est pas adjacent au premier groupe
+        ["X"],           # ligne plus courte
+    ]
+    groupes = etiqueter_groupes(grid, 3)
+
+    assert [(g["val"], g["r"], g["c"]) for g in groupes] == [
+        ("A", 0, 0), ("B", 0, 2), ("C", 1, 0), ("A", 2, 2), ("X", 3, 0),
+    ]
+    a = groupes[0]
+    assert (a["r_min"], a["r_max"], a["c_min"], a["c_max"]) == (0, 1, 0, 1)
+    b = groupes[1]
+    assert (b["r_max"], b["c_min"], b["c_max"]) == (1, 2, 2)
+
+def test_etiqueter_groupes_serpentin():
+    """Une zone en U est reconnue comme un seul groupe (fusion tardive de deux racines)."""
+    grid = [
+        ["A", "B", "A"],
+        ["A", "B", "A"],
+        ["A", "A", "A"],
+    ]
+    groupes = etiqueter_groupes(grid, 3)
+    assert len(groupes) == 2
+    assert groupes[0]["val"] == "A" and groupes[0]["r_max"] == 2 and groupes[0]["c_max"] == 2
+
+def test_traiter_fichier_config_diff():
+    """Un re-upload identique ne touche à rien ; une modification n'applique que le delta."""
+    from database import SessionLocal, reset_db, data_db, Case
+    from update_grid import traiter_fichier_config
+
+    reset_db()
+    data_db()
+    db = SessionLocal()
+    try:
+        csv_v1 = "Presse\nVIS-0004,VIS-0004,X\nPHA-0001,ELE-0022,X"
+        res = traiter_fichier_config(csv_v1, 7, db)
+        assert res["cases"] == {"ajoutees": 3, "modifiees": 0, "supprimees": 0, "inchangees": 0}
+
+        res = traiter_fichier_config(csv_v1, 7, db)
+        assert res["cases"] == {"ajoutees": 0, "modifiees": 0, "supprimees": 0, "inchangees": 3}
+
+        csv_v2 = "Presse\nVIS-0004,VIS-0004,X\nPHA-0002,X,X"
+        res = traiter_fichier_config(csv_v2, 7, db)
+        assert res["cases"] == {"ajoutees": 0, "modifiees": 1, "supprimees": 1, "inchangees": 1}
+
+        cases = {(c.ligne, c.colonne): c.idBoite for c in db.query(Case).filter(Case.idStand == 7)}
+        assert cases == {(1, 1): 4, (2, 1): 2}
+    finally:
+        db.close()
+
+def test_import_multiple_classeur_dry_run_et_doublons(monkeypatch):
+    """Le classeur est validé en bloc : dry-run sans effet, doublon bloquant, puis application unique."""
+    import pytest
+    from fastapi import HTTPException
+    from database import SessionLocal, reset_db, data_db, Case, Stand
+    import update_grid
+    from update_grid import decouper_classeur, traiter_import_multiple
+
+    reset_db()
+    data_db()
+    # Force le passage par le pool de processus
+    monkeypatch.setattr(update_grid, "SEUIL_POOL", 1)
+
+    classeur = (
+        "#STAND,1\nPoste A\nVIS-0004,PHA-0001\n"
+        "#STAND,6\nTour\nVIS-0004,X\nINCONNU-9,X\n"
+        "#STAND,7\nEmboutissage\nPHA-0002,PHA-0002\n"
+    )
+    db = SessionLocal()
+    try:
+        fichiers = decouper_classeur(classeur)
+        assert [s for s, _ in fichiers] == [1, 6, 7]
+
+        rapport = traiter_import_multiple(fichiers, db, dry_run=True)
+        assert rapport["status"] == "ok"
+        assert rapport["stands"][1]["codes_inconnus"] == ["INCONNU-9"]
+        assert rapport["stands"][0]["cases"]["ajoutees"] == 2
+        assert db.query(Case).count() == 0
+
+        # VIS-0004 sur deux magasins : refusé, rien n'est écrit
+        doublon = classeur + "#STAND,5\nExterne\nVIS-0004\n"
+        with pytest.raises(HTTPException) as exc:
+            traiter_import_multiple(decouper_classeur(doublon), db)
+        assert exc.value.detail["doublons"] == [{"code_barre": "VIS-0004", "stands": [6, 5]}]
+
+        rapport = traiter_import_multiple(fichiers, db)
+        assert rapport["status"] == "ok" and not rapport["dry_run"]
+        assert db.query(Case).count() == 4
+        assert db.get(Stand, 7).nomStand == "Emboutissage"
+    finally:
+        db.close()
+
+def test_lire_archive_zip():
+    """Le stand est déduit du nom de chaque CSV de l'archive."""
+    import io
+    import zipfile
+    from update_grid import lire_archive_zip
+
+    tampon = io.BytesIO()
+    with zipfile.ZipFile(tampon, "w") as z:
+        z.writestr("ligne/etagere_4.csv", "Presse\nVIS-0004")
+        z.writestr("6.csv", "\ufeffTour\nX")
+        z.writestr("LISEZMOI.txt", "ignoré")
+    fichiers = sorted(lire_archive_zip(tampon.getvalue()))
+    assert fichiers == [(4, "Presse\nVIS-0004"), (6, "Tour\nX")]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Traçage de bout en bout d'un scan : zapette -> sender -> /scan -> base -> broadcast -> écran.
+
+Chaque scan porte un identifiant de trace et des horodatages time.monotonic()
+posés par sender.py (lecture, envoi). Le serveur ajoute les siens (réception,
+écriture en base, broadcast) et l'écran renvoie un accusé d'affichage. Les
+durées par étape sont agrégées sur une fenêtre glissante des derniers scans.
+
+Les horloges monotones de deux processus ne sont pas comparables : le trajet
+sender -> serveur est mesuré sur l'heure murale (time.time(), "h_envoi" posé par
+le sender, "h_reception" par le serveur), juste si les machines sont synchronisées
+(NTP). Les autres étapes restent mesurées dans un même processus.
+
+Utilisé en ligne de commande, affiche les scans récents les plus lents :
+    python traces.py --serveur http://127.0.0.1:8000 --nombre 10
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+TAILLE_FENETRE = 1000
+# Au-delà (ou en négatif), l'écart d'heure murale sender/serveur trahit des horloges désynchronisées
+ECART_MAX_INTER_PROCESSUS = 60.0
+
+# Étapes mesurées : (nom, horodatage de début, horodatage de fin)
+ETAPES = [
+    ("lecture_envoi", "t_lecture", "t_envoi"),
+    ("envoi_reception", "h_envoi", "h_reception"),   # Heure murale : deux processus
+    ("reception_base", "t_reception", "t_base"),
+    ("base_broadcast", "t_base", "t_broadcast"),
+    ("broadcast_affichage", "t_broadcast", "t_affichage"),
+]
+
+
+def nouvelle_trace():
+    """Crée les champs de trace à joindre au payload d'un scan (côté lecteur)."""
+    return {"id": uuid.uuid4().hex, "t_lecture": time.monotonic()}
+
+
+class RegistreTraces:
+    """Conserve les TAILLE_FENETRE derniers scans tracés (OrderedDict borné)."""
+    def __init__(self, taille=TAILLE_FENETRE):
+        self.taille = taille
+        self.lock = threading.Lock()
+        self.traces = OrderedDict()
+
+    def demarrer(self, trace_client, poste, code_barre):
+        """Enregistre l'arrivée d'un scan sur /scan ; retourne l'identifiant de trace."""
+        trace_client = trace_client or {}
+        trace_id = str(trace_client.get("id") or uuid.uuid4().hex)
+        trace = {
+            "id": trace_id,
+            "poste": poste,
+            "code_barre": code_barre,
+            "t_reception": time.monotonic(),
+            "h_reception": time.time(),
+        }
+        for cle in ("t_lecture", "t_envoi", "h_envoi"):
+            if isinstance(trace_client.get(cle), (int, float)):
+                trace[cle] = float(trace_client[cle])
+        with self.lock:
+            self.traces[trace_id] = trace
+            while len(self.traces) > self.taille:
+                self.traces.popitem(last=False)
+        return trace_id
+
+    def marquer(self, trace_id, etape):
+        """
+        Pose l'horodatage `etape` (ex : "t_base") sur une trace existante. Le premier est
+        gardé : chaque écran accuse l'affichage, c'est le plus rapide qui compte.
+        """
+        with self.lock:
+            trace = self.traces.get(trace_id)
+            if trace is not None:
+                trace.setdefault(etape, time.monotonic())
+                return True
+        return False
+
+    def vider(self):
+        with self.lock:
+            self.traces.clear()
+
+    def durees(self, trace):
+        """Durées (ms) par étape d'une trace ; les étapes incomplètes ou incohérentes sont ignorées."""
+        resultat = {}
+        for nom, debut, fin in ETAPES:
+            if debut in trace and fin in trace:
+                d = trace[fin] - trace[debut]
+                if 0 <= d <= ECART_MAX_INTER_PROCESSUS:
+                    resultat[nom] = round(d * 1000, 3)
+        if resultat:
+            resultat["total"] = round(sum(resultat.values()), 3)
+        return resultat
+
+    def repartition(self):
+        """Statistiques par étape (nb, moyenne, p50, p95, max en ms) sur la fenêtre."""
+        with self.lock:
+            traces = list(self.traces.values())
+        par_etape = {}
+        for t in traces:
+            for nom, d in self.durees(t).items():
+                par_etape.setdefault(nom, []).append(d)
+
+        stats = {}
+        for nom, valeurs in par_etape.items():
+            valeurs.sort()
+            stats[nom] = {
+                "nb": len(valeurs),
+                "moyenne_ms": round(statistics.fmean(valeurs), 3),
+                "p50_ms": valeurs[len(valeurs) // 2],
+                "p95_ms": valeurs[min(len(valeurs) - 1, int(len(valeurs) * 0.95))],
+                "max_ms": valeurs[-1],
+            }
+        return {"fenetre": len(traces), "etapes": stats}
+
+    def plus_lentes(self, limite=10):
+        """Scans récents triés par durée totale décroissante."""
+        with self.lock:
+            traces = list(self.traces.values())
+        lignes = []
+        for t in traces:
+            d = self.durees(t)
+            if d:
+                lignes.append({"id": t["id"], "poste": t["poste"], "code_barre": t["code_barre"], "durees": d})
+        lignes.sort(key=lambda x: x["durees"]["total"], reverse=True)
+        return lignes[:limite]
+
+registre = RegistreTraces()
+
+
+# ---------- CLI ----------
+
+def main(argv=None):
+    import requests
+
+    parser = argparse.ArgumentParser(description="Affiche les scans récents les plus lents")
+    parser.add_argument("--serveur", default="http://127.0.0.1:8000")
+    parser.add_argument("--nombre", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    res = requests.get(f"{args.serveur}/api/traces/lentes", params={"limite": args.nombre}, timeout=5)
+    res.raise_for_status()
+    lentes = res.json()
+    if not lentes:
+        print("[INFO] Aucun scan tracé pour le moment.")
+        return 0
+
+    noms = [e[0] for e in ETAPES]
+    print(f"{'trace':<10} {'poste':>5} {'code_barre':<16} " + " ".join(f"{n:>20}" for n in noms) + f" {'total':>10}")
+    for l in lentes:
+        d = l["durees"]
+        cols = " ".join(f"{d[n]:>20.2f}" if n in d else f"{'-':>20}" for n in noms)
+        print(f"{l['id'][:8]:<10} {str(l['poste']):>5} {str(l['code_barre'])[:16]:<16} {cols} {d['total']:>10.2f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,44 +2,93 @@
 Logique de traitement des configurations de stands via fichiers CSV.
 Transforme un tableur CSV en une structure de données JSON pour le front-end
 et met à jour les emplacements physiques des boîtes en base de données.
+La disposition JSON est stockée en base (table etageres) et servie par l'API
+depuis un cache mémoire, invalidé à chaque import.
+Un changement de ligne complet passe par traiter_import_multiple : toutes les
+étagères sont analysées, validées ensemble puis appliquées en une transaction.
 """
 import csv
+import hashlib
+import io
 import json
 import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from fastapi import HTTPException
+from sqlalchemy import insert, update, or_
 from sqlalchemy.orm import Session
-from database import Stand, Boite, Case
+from database import BASE_DIR, SessionLocal, Stand, Boite, Case, Etagere
 
-def traiter_fichier_config(csv_content: str, stand_id: int, db: Session):
+# Cache des dispositions : {idStand: (json, empreinte)}
+_cache_layouts = {}
+
+# Nombre maximal de codes-barres par clause IN (limite de variables SQLite)
+TAILLE_LOT_IN = 500
+
+def etiqueter_groupes(grid, nb_cols):
     """
-    Traite le fichier CSV pour configurer un stand :
-    1. Met à jour le nom du stand (Ligne 1).
-    2. Supprime les anciennes cases physiques liées à ce stand.
-    3. Analyse la grille (Ligne 2+) pour gérer les fusions et les objets.
-    4. Associe logiquement la boîte au magasin ou au poste (selon categorie stand).
-    5. Génère le fichier JSON visuel pour le frontend.
+    Regroupe les cellules adjacentes (haut, bas, gauche, droite) de même valeur.
+    La grille est encodée en entiers puis étiquetée par Union-Find (temps linéaire).
+    Retourne les groupes non vides dans l'ordre de leur première cellule
+    (parcours ligne par ligne), avec leur rectangle englobant.
     """
-    reader = csv.reader(csv_content.splitlines())
-    rows = list(reader)
-    if not rows:
-        raise HTTPException(status_code=400, detail="Le fichier CSV est vide.")
+    nb_rows = len(grid)
+    codes = {}
+    encodee = [-1] * (nb_rows * nb_cols)  # -1 = cellule vide ou hors de la ligne
+    for r, ligne in enumerate(grid):
+        base = r * nb_cols
+        for c, val in enumerate(ligne):
+            if val:
+                encodee[base + c] = codes.setdefault(val, len(codes))
 
-    # 1. MISE À JOUR DU NOM ET RÉCUPÉRATION DE LA CATÉGORIE
-    stand = db.query(Stand).filter(Stand.idStand == stand_id).first()
-    if not stand:
-        raise HTTPException(status_code=404, detail="Stand introuvable dans la base de données.")
+    parent = list(range(nb_rows * nb_cols))
 
-    nouveau_nom = rows[0][0].strip() if rows[0] else ""
-    if nouveau_nom:
-        stand.nomStand = nouveau_nom
-        db.commit()
+    def racine(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # compression de chemin
+            i = parent[i]
+        return i
 
-    # 2. NETTOYAGE DES ANCIENNES CASES EN BD
-    # On supprime les emplacements physiques actuels pour reconstruire la nouvelle grille
-    db.query(Case).filter(Case.idStand == stand_id).delete()
-    db.commit()
+    for i, code in enumerate(encodee):
+        if code < 0:
+            continue
+        # Voisin de gauche (même ligne) et voisin du dessus
+        if i % nb_cols and encodee[i - 1] == code:
+            ra, rb = racine(i - 1), racine(i)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+        if i >= nb_cols and encodee[i - nb_cols] == code:
+            ra, rb = racine(i - nb_cols), racine(i)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+
+    groupes = {}
+    for i, code in enumerate(encodee):
+        if code < 0:
+            continue
+        r, c = divmod(i, nb_cols)
+        g = groupes.get(racine(i))
+        if g is None:
+            groupes[racine(i)] = {"val": grid[r][c], "r": r, "c": c, "r_min": r, "r_max": r, "c_min": c, "c_max": c}
+        else:
+            if r > g["r_max"]: g["r_max"] = r
+            if c < g["c_min"]: g["c_min"] = c
+            if c > g["c_max"]: g["c_max"] = c
+    return list(groupes.values())
+
+def analyser_csv(csv_content: str):
+    """
+    Partie sans base de données de l'import : nom du stand (ligne 1), grille
+    nettoyée (lignes 2+) et zones fusionnées. Ne manipule que des types simples
+    pour pouvoir tourner dans un processus du pool d'import multiple.
+    Retourne None si le CSV est vide.
+    """
+    rows = list(csv.reader(csv_content.splitlines()))
+    if not rows:
+        return None
 
-    # 3. PRÉPARATION DE LA GRILLE (Données à partir de la ligne 2)
     grid = []
     for r in rows[1:]:
         cleaned = [cell.strip() for cell in r]
@@ -48,92 +97,378 @@ def traiter_fichier_config(csv_content: str, stand_id: int, db: Session):
 
     nb_rows = len(grid)
     nb_cols = max(len(r) for r in grid) if nb_rows > 0 else 0
-    visited = set()
+    return {
+        "nom": rows[0][0].strip() if rows[0] else "",
+        "nb_rows": nb_rows,
+        "nb_cols": nb_cols,
+        # ÉTIQUETAGE DES ZONES FUSIONNÉES (Union-Find sur la grille encodée en entiers)
+        "groupes": etiqueter_groupes(grid, nb_cols),
+    }
+
+def codes_de(analyse):
+    """Codes-barres présents dans une grille analysée (hors cases vides "X")."""
+    return {g["val"] for g in analyse["groupes"] if g["val"].upper() != "X"}
+
+def resoudre_codes(db: Session, codes):
+    """Résout les codes-barres en idBoite par clauses IN de TAILLE_LOT_IN codes."""
+    boites_par_code = {}
+    codes_liste = sorted(codes)
+    for i in range(0, len(codes_liste), TAILLE_LOT_IN):
+        lot = codes_liste[i:i + TAILLE_LOT_IN]
+        requete = db.query(Boite.idBoite, Boite.code_barre).filter(Boite.code_barre.in_(lot)).order_by(Boite.idBoite)
+        for id_boite, code in requete:
+            boites_par_code.setdefault(code, id_boite)
+    return boites_par_code
+
+def construire_etagere(analyse, boites_par_code):
+    """
+    Retourne (cases_voulues, contenu, empreinte) : les cases physiques
+    {(ligne, colonne): idBoite} et la disposition JSON visuelle avec son empreinte.
+    """
     items_json = []
+    cases_voulues = {}  # (ligne, colonne) -> idBoite
 
-    # 4. PARCOURS DE LA GRILLE ET ALGORITHME DE FUSION (Flood Fill)
-    for r in range(nb_rows):
-        for c in range(len(grid[r])):
-            if (r, c) in visited or not grid[r][c]:
-                continue
-            
-            val = grid[r][c]
-            
-            # Flood Fill : on identifie toutes les cellules adjacentes ayant la même valeur
-            stack = [(r, c)]
-            visited.add((r, c))
-            group = []
-            while stack:
-                curr_r, curr_c = stack.pop()
-                group.append((curr_r, curr_c))
-                # Vérification des voisins (haut, bas, gauche, droite)
-                for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                    nr, nc = curr_r + dr, curr_c + dc
-                    if 0 <= nr < nb_rows and 0 <= nc < len(grid[nr]):
-                        if grid[nr][nc] == val and (nr, nc) not in visited:
-                            visited.add((nr, nc))
-                            stack.append((nr, nc))
-
-            # Calcul des coordonnées de départ et de l'étalement (span)
-            rs, cs = [p[0] for p in group], [p[1] for p in group]
-            row_start, col_start = min(rs) + 1, min(cs) + 1
-            row_span, col_span = max(rs) - min(rs) + 1, max(cs) - min(cs) + 1
-
-            # LOGIQUE MÉTIER : Case "X" (vide) ou Code-barre (objet)
-            is_empty = (val.upper() == "X")
-            display_val = "" if is_empty else val
-            
-            if not is_empty:
-                # On cherche la boîte correspondante par son code-barre
-                boite = db.query(Boite).filter(Boite.code_barre == val).first()
-                if boite:
-                    # A. Création de la case physique en BD (Position L/C)
-                    db.add(Case(
-                        idStand=stand_id,
-                        idBoite=boite.idBoite,
-                        ligne=row_start,
-                        colonne=col_start
-                    ))
-                    
-                    # B. Mise à jour de l'assignation logique de la boîte
-                    # On utilise la catégorie du stand pour savoir quel champ remplir
-                    if stand.categorie == 1:  # C'est un Magasin
-                        boite.idMagasin = stand_id
-                    else:  # C'est un Poste (catégorie 0)
-                        boite.idPoste = stand_id
-
-            # Préparation des données pour le fichier JSON visuel
-            items_json.append({
-                "id": f"{r}-{c}",
-                "val": display_val,
-                "style": {
-                    "gridRow": f"{row_start} / span {row_span}",
-                    "gridColumn": f"{col_start} / span {col_span}"
-                }
-            })
-
-    # Sauvegarde finale des changements (cases et assignations de boîtes)
-    db.commit()
+    for g in analyse["groupes"]:
+        val = g["val"]
+        row_start, col_start = g["r_min"] + 1, g["c_min"] + 1
+        row_span, col_span = g["r_max"] - g["r_min"] + 1, g["c_max"] - g["c_min"] + 1
 
-    # 5. GÉNÉRATION DU FICHIER JSON POUR LE FRONTEND
+        # LOGIQUE MÉTIER : Case "X" (vide) ou Code-barre (objet)
+        is_empty = (val.upper() == "X")
+        display_val = "" if is_empty else val
+        
+        if not is_empty:
+            id_boite = boites_par_code.get(val)
+            if id_boite:
+                # Case physique voulue en BD (Position L/C)
+                cases_voulues[(row_start, col_start)] = id_boite
+
+        # Préparation des données pour le fichier JSON visuel
+        items_json.append({
+            "id": f"{g['r']}-{g['c']}",
+            "val": display_val,
+            "style": {
+                "gridRow": f"{row_start} / span {row_span}",
+                "gridColumn": f"{col_start} / span {col_span}"
+            }
+        })
+
+    # Disposition JSON servie au frontend par /api/stands/{id}/layout
     data_json = {
         "layout": {
-            "templateRows": f"repeat({nb_rows}, 1fr)",
-            "templateColumns": f"repeat({nb_cols}, 1fr)"
+            "templateRows": f"repeat({analyse['nb_rows']}, 1fr)",
+            "templateColumns": f"repeat({analyse['nb_cols']}, 1fr)"
         },
         "items": items_json
     }
-    
-    # Définition du chemin d'enregistrement
-    filename = f"etagere_{stand_id}.json"
-    public_path = os.path.join("..", "frontend", "public", filename)
-    
-    # Création du dossier si inexistant
-    os.makedirs(os.path.dirname(public_path), exist_ok=True)
-    with open(public_path, 'w', encoding='utf-8') as f:
-        json.dump(data_json, f, indent=2)
+    contenu = json.dumps(data_json, ensure_ascii=False, separators=(",", ":"))
+    empreinte = hashlib.sha256(contenu.encode("utf-8")).hexdigest()[:16]
+    return cases_voulues, contenu, empreinte
+
+def appliquer_etagere(db: Session, stand: Stand, nom: str, cases_voulues: dict, contenu: str, empreinte: str):
+    """
+    Écrit la configuration d'un stand dans la session, sans commit :
+    nom, diff des cases, assignation des boîtes et disposition visuelle.
+    Retourne le bilan des cases (voir appliquer_diff_cases).
+    """
+    if nom:
+        stand.nomStand = nom
+
+    # DIFF AVEC LES CASES EXISTANTES
+    bilan = appliquer_diff_cases(db, stand.idStand, cases_voulues)
+
+    # Mise à jour de l'assignation logique des boîtes (seulement celles qui changent)
+    # On utilise la catégorie du stand pour savoir quel champ remplir
+    ids_boites = set(cases_voulues.values())
+    if ids_boites:
+        champ = Boite.idMagasin if stand.categorie == 1 else Boite.idPoste
+        db.query(Boite).filter(
+            Boite.idBoite.in_(list(ids_boites)),
+            or_(champ.is_(None), champ != stand.idStand)
+        ).update({champ: stand.idStand}, synchronize_session=False)
+
+    # DISPOSITION VISUELLE (réécrite seulement si elle a changé)
+    etagere = db.query(Etagere).filter(Etagere.idStand == stand.idStand).first()
+    if not etagere:
+        db.add(Etagere(idStand=stand.idStand, layout=contenu, empreinte=empreinte, date_maj=datetime.now()))
+    elif etagere.empreinte != empreinte:
+        etagere.layout = contenu
+        etagere.empreinte = empreinte
+        etagere.date_maj = datetime.now()
+    return bilan
+
+def traiter_fichier_config(csv_content: str, stand_id: int, db: Session):
+    """
+    Traite le fichier CSV pour configurer un stand :
+    1. Met à jour le nom du stand (Ligne 1).
+    2. Analyse la grille (Ligne 2+) pour gérer les fusions et les objets.
+    3. Compare la grille aux cases existantes et n'applique que les différences.
+    4. Associe logiquement la boîte au magasin ou au poste (selon categorie stand).
+    5. Enregistre la disposition JSON visuelle pour le frontend (table etageres).
+    Toutes les modifications en base sont validées en une seule transaction :
+    un scan concurrent voit l'ancienne ou la nouvelle étagère, jamais un état vide.
+    """
+    analyse = analyser_csv(csv_content)
+    if analyse is None:
+        raise HTTPException(status_code=400, detail="Le fichier CSV est vide.")
+
+    stand = db.query(Stand).filter(Stand.idStand == stand_id).first()
+    if not stand:
+        raise HTTPException(status_code=404, detail="Stand introuvable dans la base de données.")
+
+    # Résolution de tous les codes-barres en une seule passe (IN par lots)
+    boites_par_code = resoudre_codes(db, codes_de(analyse))
+    cases_voulues, contenu, empreinte = construire_etagere(analyse, boites_par_code)
+
+    try:
+        bilan = appliquer_etagere(db, stand, analyse["nom"], cases_voulues, contenu, empreinte)
+        # Sauvegarde des changements en une seule transaction (nom, cases, assignations et disposition)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # Le cache est remplacé (et non vidé) : la prochaine ouverture du popup est un succès de cache
+    _cache_layouts[stand_id] = (contenu, empreinte)
 
     return {
         "status": "ok", 
-        "message": f"Le stand '{stand.nomStand}' a été mis à jour avec succès."
-    }
\ No newline at end of file
+        "message": f"Le stand '{stand.nomStand}' a été mis à jour avec succès.",
+        "cases": bilan
+    }
+
+def appliquer_diff_cases(db: Session, stand_id: int, cases_voulues: dict):
+    """
+    Aligne les cases d'un stand sur cases_voulues ({(ligne, colonne): idBoite})
+    sans commit : suppression des positions disparues, mise à jour des positions
+    dont la boîte change, insertion des nouvelles positions.
+    Retourne le nombre de cases ajoutées, modifiées, supprimées et inchangées.
+    """
+    existantes = {
+        (c.ligne, c.colonne): (c.idCase, c.idBoite)
+        for c in db.query(Case.idCase, Case.idBoite, Case.ligne, Case.colonne).filter(Case.idStand == stand_id)
+    }
+
+    a_supprimer = [id_case for pos, (id_case, _) in existantes.items() if pos not in cases_voulues]
+    a_modifier = [
+        {"idCase": existantes[pos][0], "idBoite": id_boite}
+        for pos, id_boite in cases_voulues.items()
+        if pos in existantes and existantes[pos][1] != id_boite
+    ]
+    a_ajouter = [
+        {"idStand": stand_id, "idBoite": id_boite, "ligne": pos[0], "colonne": pos[1]}
+        for pos, id_boite in cases_voulues.items()
+        if pos not in existantes
+    ]
+
+    for i in range(0, len(a_supprimer), TAILLE_LOT_IN):
+        db.query(Case).filter(Case.idCase.in_(a_supprimer[i:i + TAILLE_LOT_IN])).delete(synchronize_session=False)
+    if a_modifier:
+        db.execute(update(Case), a_modifier)
+    if a_ajouter:
+        db.execute(insert(Case), a_ajouter)
+
+    return {
+        "ajoutees": len(a_ajouter),
+        "modifiees": len(a_modifier),
+        "supprimees": len(a_supprimer),
+        "inchangees": len(cases_voulues) - len(a_ajouter) - len(a_modifier),
+    }
+
+def get_layout_etagere(stand_id: int):
+    """
+    Retourne (json, empreinte) de la disposition d'un stand, depuis le cache mémoire
+    ou à défaut depuis la base. Retourne None si le stand n'a jamais été configuré.
+    """
+    en_cache = _cache_layouts.get(stand_id)
+    if en_cache:
+        return en_cache
+
+    db = SessionLocal()
+    try:
+        etagere = db.query(Etagere).filter(Etagere.idStand == stand_id).first()
+        if etagere:
+            _cache_layouts[stand_id] = (etagere.layout, etagere.empreinte)
+            return _cache_layouts[stand_id]
+        return importer_ancien_fichier(stand_id, db)
+    finally:
+        db.close()
+
+def importer_ancien_fichier(stand_id: int, db: Session):
+    """
+    Reprise des dispositions générées avant la table etageres
+    (frontend/public/etagere_{id}.json) : importées une fois en base.
+    """
+    chemin = os.path.join(BASE_DIR, "..", "frontend", "public", f"etagere_{stand_id}.json")
+    if not os.path.exists(chemin):
+        return None
+    with open(chemin, encoding="utf-8") as f:
+        contenu = json.dumps(json.load(f), ensure_ascii=False, separators=(",", ":"))
+    empreinte = hashlib.sha256(contenu.encode("utf-8")).hexdigest()[:16]
+    db.add(Etagere(idStand=stand_id, layout=contenu, empreinte=empreinte, date_maj=datetime.now()))
+    db.commit()
+    _cache_layouts[stand_id] = (contenu, empreinte)
+    return _cache_layouts[stand_id]
+
+def invalider_layout(stand_id=None):
+    """Vide le cache d'un stand (ou de tous les stands si stand_id est None)."""
+    if stand_id is None:
+        _cache_layouts.clear()
+    else:
+        _cache_layouts.pop(stand_id, None)
+
+
+# ---------- IMPORT MULTIPLE (CHANGEMENT DE LIGNE) ----------
+
+# En dessous, l'analyse se fait sur place : démarrer le pool coûterait plus cher
+SEUIL_POOL = 4
+_pool = None
+
+def _get_pool():
+    """Pool de processus créé au premier import volumineux puis réutilisé."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+    return _pool
+
+def analyser_en_parallele(contenus):
+    """Analyse les CSV (analyser_csv) dans le pool de processus ; l'ordre est conservé."""
+    if len(contenus) < SEUIL_POOL:
+        return [analyser_csv(c) for c in contenus]
+    return list(_get_pool().map(analyser_csv, contenus))
+
+def decouper_classeur(csv_content: str):
+    """
+    Découpe un CSV « classeur » en sections, une par stand. Chaque section commence
+    par une ligne de marqueur `#STAND,<idStand>` suivie du CSV habituel (nom puis grille).
+    Retourne une liste de (idStand, csv_section).
+    """
+    sections = []
+    courante = None
+    for numero, ligne in enumerate(csv_content.splitlines(), start=1):
+        cellules = next(csv.reader([ligne]), [])
+        if cellules and cellules[0].strip().upper() == "#STAND":
+            try:
+                stand_id = int(cellules[1].strip())
+            except (IndexError, ValueError):
+                raise HTTPException(status_code=400, detail=f"Ligne {numero} : identifiant de stand invalide après #STAND.")
+            courante = (stand_id, [])
+            sections.append(courante)
+        elif courante is not None:
+            courante[1].append(ligne)
+        elif ligne.strip(" ,;"):
+            raise HTTPException(status_code=400, detail=f"Ligne {numero} : contenu avant la première section #STAND.")
+    return [(stand_id, "\n".join(lignes)) for stand_id, lignes in sections]
+
+def lire_archive_zip(donnees: bytes):
+    """
+    Lit une archive zip de CSV nommés d'après le stand (ex : etagere_4.csv, 4.csv).
+    Retourne une liste de (idStand, csv_content).
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(donnees))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="L'archive zip est illisible.")
+
+    fichiers = []
+    with archive:
+        for info in archive.infolist():
+            nom = os.path.basename(info.filename)
+            if info.is_dir() or nom.startswith(".") or "__MACOSX" in info.filename:
+                continue
+            if not nom.lower().endswith(".csv"):
+                continue
+            trouve = re.search(r"(\d+)\.csv$", nom, re.IGNORECASE)
+            if not trouve:
+                raise HTTPException(status_code=400, detail=f"Impossible de déduire le stand du fichier '{nom}'.")
+            fichiers.append((int(trouve.group(1)), archive.read(info).decode("utf-8-sig")))
+    return fichiers
+
+def traiter_import_multiple(fichiers, db: Session, dry_run: bool = False):
+    """
+    Configure plusieurs stands à partir d'une liste de (idStand, csv_content) :
+    1. Analyse toutes les grilles (pool de processus au-delà de SEUIL_POOL stands).
+    2. Valide l'ensemble : stands inconnus ou en double, CSV vides, code-barre
+       placé sur deux stands de même catégorie (erreurs) et codes inconnus (avertissements).
+    3. Applique toutes les étagères dans une seule transaction.
+    En dry_run, la transaction est annulée après calcul du bilan : le rapport
+    indique ce que l'import changerait sans rien modifier.
+    """
+    if not fichiers:
+        raise HTTPException(status_code=400, detail="Aucune configuration de stand à importer.")
+
+    analyses = analyser_en_parallele([contenu for _, contenu in fichiers])
+
+    ids = [stand_id for stand_id, _ in fichiers]
+    stands = {s.idStand: s for s in db.query(Stand).filter(Stand.idStand.in_(ids))}
+    codes = set()
+    for analyse in analyses:
+        if analyse is not None:
+            codes |= codes_de(analyse)
+    boites_par_code = resoudre_codes(db, codes)
+
+    erreurs = []
+    rapport_stands = []
+    deja_vus = set()
+    emplacements = {}  # (categorie, code_barre) -> [idStand]
+    for stand_id, analyse in zip(ids, analyses):
+        if stand_id in deja_vus:
+            erreurs.append(f"Stand {stand_id} présent plusieurs fois dans l'import.")
+            continue
+        deja_vus.add(stand_id)
+        stand = stands.get(stand_id)
+        if stand is None:
+            erreurs.append(f"Stand {stand_id} introuvable dans la base de données.")
+            continue
+        if analyse is None:
+            erreurs.append(f"Le fichier CSV du stand {stand_id} est vide.")
+            continue
+
+        codes_stand = codes_de(analyse)
+        for code in codes_stand:
+            emplacements.setdefault((stand.categorie, code), []).append(stand_id)
+        rapport_stands.append({
+            "idStand": stand_id,
+            "nom": analyse["nom"] or stand.nomStand,
+            "codes_inconnus": sorted(c for c in codes_stand if c not in boites_par_code),
+        })
+
+    doublons = [
+        {"code_barre": code, "stands": ids_stands}
+        for (_, code), ids_stands in sorted(emplacements.items())
+        if len(ids_stands) > 1
+    ]
+    for d in doublons:
+        erreurs.append(f"Le code-barre {d['code_barre']} est placé sur plusieurs stands : {d['stands']}.")
+
+    rapport = {
+        "status": "erreur" if erreurs else "ok",
+        "dry_run": dry_run,
+        "stands": rapport_stands,
+        "doublons": doublons,
+        "erreurs": erreurs,
+    }
+    if erreurs:
+        if dry_run:
+            return rapport
+        raise HTTPException(status_code=400, detail=rapport)
+
+    a_mettre_en_cache = {}
+    try:
+        for (stand_id, _), analyse, ligne in zip(fichiers, analyses, rapport_stands):
+            cases_voulues, contenu, empreinte = construire_etagere(analyse, boites_par_code)
+            ligne["cases"] = appliquer_etagere(db, stands[stand_id], analyse["nom"], cases_voulues, contenu, empreinte)
+            a_mettre_en_cache[stand_id] = (contenu, empreinte)
+        if dry_run:
+            db.rollback()
+        else:
+            # Toute la ligne bascule d'un coup : jamais un mélange d'ancienne et de nouvelle configuration
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    if not dry_run:
+        _cache_layouts.update(a_mettre_en_cache)
+        rapport["message"] = f"{len(rapport_stands)} stand(s) mis à jour avec succès."
+    return rapport
@@ -11,9 +11,27 @@ import {
 import PowerSettingsNewIcon from '@mui/icons-material/PowerSettingsNew';
 import LoginPopup from './popup/LoginPopup';
 
+const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
 export default function Accueil({ onContinue, onCustomStart, onAdminLogin }) {
   const [isLoginOpen, setIsLoginOpen] = useState(false);
 
+  // Session admin encore valide : accès direct, sinon on demande les identifiants
+  const handleAdminAccess = async () => {
+    const jeton = sessionStorage.getItem('jeton_admin');
+    if (jeton) {
+      try {
+        const res = await fetch(`${apiUrl}/api/session`, { headers: { Authorization: `Bearer ${jeton}` } });
+        if (res.ok) {
+          onAdminLogin();
+          return;
+        }
+        sessionStorage.removeItem('jeton_admin');
+      } catch (err) { console.error(err); }
+    }
+    setIsLoginOpen(true);
+  };
+
   // Fonction pour fermer l'application
   const handleQuit = () => {
     if (window.confirm("Voulez-vous vraiment fermer l'application ?")) {
@@ -112,7 +130,7 @@ export default function Accueil({ onContinue, onCustomStart, onAdminLogin }) {
       {/* Accès Admin */}
       <Button 
         variant="text" 
-        onClick={() => setIsLoginOpen(true)}
+        onClick={handleAdminAccess}
         sx={{ mt: 8, color: '#42526E', textTransform: 'none', fontWeight: 600, fontSize: '1rem' }}
       >
         Espace Administration
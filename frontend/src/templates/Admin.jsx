@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
     Box, Button, Grid, Typography, List, ListItemButton, ListItemText, Paper, IconButton, ToggleButtonGroup, ToggleButton, Avatar,
     Dialog, DialogTitle, DialogContent, DialogContentText, DialogActions
@@ -14,6 +14,12 @@ import InventoryIcon from '@mui/icons-material/Inventory';
 
 const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// Évènements WebSocket qui modifient l'historique, les logs ou les KPI affichés
+// (un scan arrive sans type) ; position du train, alertes et accusés n'y changent rien
+const EVENEMENTS_HISTORIQUE = new Set([
+    undefined, 'nouvelle_commande', 'statut_commande', 'statuts_commandes', 'commandes_videes', 'cycle', 'resync',
+]);
+
 export default function Admin({ onParametre, onApprovisionnement, onRetourAccueil, onGestionStock }) {
     const [currentView, setCurrentView] = useState('dashboard');
     const [filtreMode, setFiltreMode] = useState('Normal');
@@ -22,6 +28,7 @@ export default function Admin({ onParametre, onApprovisionnement, onRetourAccuei
     const [selectedCycleId, setSelectedCycleId] = useState('Total');
     const [selectedCycleLabel, setSelectedCycleLabel] = useState('Total');
     const [cycleLogs, setCycleLogs] = useState([]);
+    const [cycleKpi, setCycleKpi] = useState(null);
     const [openClearDialog, setOpenClearDialog] = useState(false);
     const [clearing, setClearing] = useState(false);
 
@@ -54,22 +61,80 @@ export default function Admin({ onParametre, onApprovisionnement, onRetourAccuei
         } catch (err) { console.error(err); }
     }
 
+    // KPI précalculés du cycle (cache à la clôture, incrémental pour le cycle en cours)
+    const fetchCycleKpi = async (id) => {
+        if (!id || id === 'Total') return;
+        try {
+            const res = await fetch(`${apiUrl}/api/admin/kpi/${id}?mode=${filtreMode}`);
+            setCycleKpi(res.ok ? await res.json() : null);
+        } catch (err) { console.error(err); }
+    }
+
+    const formatDuree = (repartition, cle) => {
+        if (!repartition) return '-';
+        const s = repartition[cle];
+        return s >= 60 ? `${Math.floor(s / 60)}m${String(Math.round(s % 60)).padStart(2, '0')}` : `${Math.round(s)}s`;
+    };
+
     useEffect(() => { fetchData(); }, [filtreMode, currentView]);
 
+    // Rafraîchissement relu à chaque rendu : le WebSocket ci-dessous appelle toujours la version à jour
+    const rafraichirRef = useRef(null);
+    rafraichirRef.current = () => {
+        fetchData();
+        if (currentView === 'logs' && selectedCycleId && selectedCycleId !== 'Total') {
+            fetchCycleLogs(selectedCycleId);
+        }
+        if (cycleKpi?.en_cours && selectedCycleId !== 'Total') {
+            fetchCycleKpi(selectedCycleId);
+        }
+    };
+
+    // Plus de sondage toutes les 5 s : on recharge quand le serveur signale un changement du mode affiché,
+    // une seule fois par rafale d'évènements
     useEffect(() => {
-        const interval = setInterval(() => {
-            fetchData();
-            if (currentView === 'logs' && selectedCycleId && selectedCycleId !== 'Total') {
-                fetchCycleLogs(selectedCycleId);
-            }
-        }, 5000);
-        return () => clearInterval(interval);
-    }, [currentView, selectedCycleId, filtreMode]);
+        const url = (location.protocol === 'https:' ? 'wss' : 'ws') + '://' + location.hostname + ':8000/ws/scans?mode=' + encodeURIComponent(filtreMode);
+        let ws = null;
+        let fermeture = false;
+        let relance = null;
+        let regroupement = null;
+
+        const planifier = () => {
+            if (regroupement) return;
+            regroupement = setTimeout(() => {
+                regroupement = null;
+                rafraichirRef.current();
+            }, 1000);
+        };
+
+        const connecter = () => {
+            ws = new WebSocket(url);
+            ws.addEventListener('message', (ev) => {
+                if (EVENEMENTS_HISTORIQUE.has(JSON.parse(ev.data).type)) planifier();
+            });
+            ws.addEventListener('close', () => {
+                if (fermeture) return;
+                relance = setTimeout(() => { planifier(); connecter(); }, 2000);
+            });
+        };
+        connecter();
+
+        return () => {
+            fermeture = true;
+            clearTimeout(relance);
+            clearTimeout(regroupement);
+            if (ws) ws.close();
+        };
+    }, [filtreMode]);
 
     const handleSelectCycle = (cycle) => {
         setSelectedCycleId(cycle.id);
         setSelectedCycleLabel(cycle.label);
-        if (cycle.id !== 'Total') fetchCycleLogs(cycle.id);
+        setCycleKpi(null);
+        if (cycle.id !== 'Total') {
+            fetchCycleLogs(cycle.id);
+            fetchCycleKpi(cycle.id);
+        }
         else setCycleLogs([]);
     }
 
@@ -79,6 +144,7 @@ export default function Admin({ onParametre, onApprovisionnement, onRetourAccuei
             setSelectedCycleId('Total');
             setSelectedCycleLabel('Total');
             setCycleLogs([]);
+            setCycleKpi(null);
         }
     };
 
@@ -236,6 +302,24 @@ export default function Admin({ onParametre, onApprovisionnement, onRetourAccuei
                 {/* ZONE DASHBOARD */}
                 <Box sx={{ flexGrow: 1, p: 4, overflowY: 'auto' }}>
                     {currentView === 'dashboard' ? (
+                        <>
+                        {cycleKpi && selectedCycleId !== 'Total' && (
+                            <Paper elevation={0} sx={{ p: 2, mb: 3, borderRadius: '12px', border: '1px solid #DFE1E6', bgcolor: 'white', display: 'flex', gap: 4, flexWrap: 'wrap' }}>
+                                {[
+                                    ['Commandes', cycleKpi.global.nb_commandes],
+                                    ['Cmd / heure', cycleKpi.global.commandes_par_heure ?? '-'],
+                                    ['Demande → récup. (p50 / p90 / p95)', ['p50', 'p90', 'p95'].map(k => formatDuree(cycleKpi.global.demande_recuperation, k)).join(' / ')],
+                                    ['Récup. → livraison (p50 / p90 / p95)', ['p50', 'p90', 'p95'].map(k => formatDuree(cycleKpi.global.recuperation_livraison, k)).join(' / ')],
+                                    ['Produits manquants', `${(cycleKpi.global.taux_manquant * 100).toFixed(1)} %`],
+                                ].map(([label, valeur]) => (
+                                    <Box key={label}>
+                                        <Typography sx={{ fontSize: '0.7rem', fontWeight: 800, color: '#6B778C', textTransform: 'uppercase' }}>{label}</Typography>
+                                        <Typography sx={{ fontSize: '1.1rem', fontWeight: 800, color: '#172B4D' }}>{valeur}</Typography>
+                                    </Box>
+                                ))}
+                                {cycleKpi.en_cours && <Typography sx={{ fontSize: '0.75rem', color: '#36B37E', fontWeight: 700, alignSelf: 'center' }}>● En cours</Typography>}
+                            </Paper>
+                        )}
                         <Grid container spacing={3}>
                             {dashboardData.stands.map((stand, index) => {
                                 const isArrivageStand = index < 3;
@@ -253,6 +337,9 @@ export default function Admin({ onParametre, onApprovisionnement, onRetourAccuei
 
                                 const arrivages = isArrivageStand ? aggregate(filteredHistory.filter(h => h.dest_id === stand.id && h.statut === 'Commande finie')) : [];
                                 const departs = !isArrivageStand ? aggregate(filteredHistory.filter(h => h.source_id === stand.id)) : [];
+                                const kpiStand = cycleKpi && selectedCycleId !== 'Total'
+                                    ? (isArrivageStand ? cycleKpi.postes : cycleKpi.magasins)[String(stand.id)]
+                                    : null;
 
                                 return (
                                     <Grid item xs={12} sm={6} md={4} key={stand.id}>
@@ -261,6 +348,11 @@ export default function Admin({ onParametre, onApprovisionnement, onRetourAccuei
                                                 <Avatar sx={{ bgcolor: isArrivageStand ? '#E3F2FD' : '#F4F5F7', color: '#172B4D', fontWeight: 800, fontSize: '0.9rem' }}>{stand.id}</Avatar>
                                                 <Typography variant="h6" sx={{ fontWeight: 800, color: '#172B4D' }}>{stand.nom}</Typography>
                                             </Box>
+                                            {kpiStand && (
+                                                <Typography sx={{ fontSize: '0.75rem', color: '#6B778C', mb: 1.5 }}>
+                                                    {kpiStand.nb_commandes} cmd · p90 récup. {formatDuree(kpiStand.demande_recuperation, 'p90')} · p90 livr. {formatDuree(kpiStand.recuperation_livraison, 'p90')} · manquants {(kpiStand.taux_manquant * 100).toFixed(0)} %
+                                                </Typography>
+                                            )}
                                             
                                             {isArrivageStand ? (
                                                 <Box>
@@ -286,6 +378,7 @@ export default function Admin({ onParametre, onApprovisionnement, onRetourAccuei
                                 );
                             })}
                         </Grid>
+                        </>
                     ) : (
                         <Paper elevation={0} sx={{ height: '100%', borderRadius: '12px', border: '1px solid #DFE1E6', display: 'flex', flexDirection: 'column', overflow: 'hidden' }}>
                             <Box sx={{ p: 3, bgcolor: 'white', borderBottom: '1px solid #F4F5F7', display: 'flex', alignItems: 'center', justifyContent: 'space-between' }}>
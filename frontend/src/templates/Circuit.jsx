@@ -85,6 +85,7 @@ export default function Base({mode, onApp}) {
   const posteNamesRef = useRef({}) // Référence pour accès instantané dans le WebSocket
 
   const [connected, setConnected] = useState(false)
+  const [alertesStock, setAlertesStock] = useState([]) // Ruptures prévues poussées par le serveur
   const wsRef = useRef(null)
   
   const [isPopupOpen, setIsPopupOpen] = useState(false)
@@ -137,28 +138,31 @@ export default function Base({mode, onApp}) {
     fetchStands();
 
     // 2. Charger la liste des commandes en cours
+    // Même format pour la liste initiale et pour l'évènement "nouvelle_commande"
+    const versTache = (cmd) => ({
+      id: String(cmd.id), 
+      posteId: String(cmd.poste),
+      magasinId: String(cmd.magasin_id),
+      
+      // On récupère le code_barre que l'API nous donne maintenant via la jointure avec la table boite
+      code_barre: cmd.code_barre ? String(cmd.code_barre).trim() : "", 
+      
+      item: cmd.nom_piece || cmd.code_barre || `Boîte ${cmd.id_boite}`,
+      status: cmd.statut || "A récupérer", 
+      gridRow: cmd.ligne,
+      gridCol: cmd.colonne,
+      ts: new Date(cmd.timestamp).toLocaleString(),
+      stock: cmd.stock,
+      quantite: cmd.quantite || 1,
+    });
+
     const fetchInitialTasks = async () => {
       try {
         const res = await fetch(`${apiUrl}/api/commandes/en_cours?mode=${mode}`);
         if (res.ok) {
           const data = await res.json();
 
-          const initialTasks = data.map(cmd => ({
-            id: String(cmd.id), 
-            posteId: String(cmd.poste),
-            magasinId: String(cmd.magasin_id),
-            
-            // On récupère le code_barre que l'API nous donne maintenant via la jointure avec la table boite
-            code_barre: cmd.code_barre ? String(cmd.code_barre).trim() : "", 
-            
-            item: cmd.nom_piece || cmd.code_barre || `Boîte ${cmd.id_boite}`,
-            status: cmd.statut || "A récupérer", 
-            gridRow: cmd.ligne,
-            gridCol: cmd.colonne,
-            ts: new Date(cmd.timestamp).toLocaleString(),
-            stock: cmd.stock,
-          }));
-          setTasks(initialTasks);
+          setTasks(data.map(versTache));
         }
       } catch (err) {
         console.error("Erreur chargement initial:", err);
@@ -199,21 +203,104 @@ export default function Base({mode, onApp}) {
     }
     fetchTrainPos();
 
-    const url = (location.protocol === 'https:' ? 'wss' : 'ws') + '://' + location.hostname + ':8000/ws/scans'
-    const ws = new WebSocket(url)
-    wsRef.current = ws
+    // Abonnement côté serveur : seulement les scans de ce mode (et du poste de la tablette si ?poste=X)
+    const sujets = new URLSearchParams({ mode })
+    new URLSearchParams(location.search).getAll('poste').forEach(p => sujets.append('poste', p))
+    const base = (location.protocol === 'https:' ? 'wss' : 'ws') + '://' + location.hostname + ':8000/ws/scans?'
+
+    // Reprise après coupure : on renvoie le dernier numéro reçu, le serveur rejoue seulement ce qui manque.
+    // Sans numéro (rien reçu avant la coupure) ou sur "resync" (trou trop ancien), on recharge tout.
+    let lastSeq = null
+    let fermeture = false
+    let delai = 1000
+    let relance = null
+
+    const toutRecharger = () => {
+      fetchInitialTasks();
+      fetchCycleStatus();
+      fetchTrainPos();
+    }
 
-    ws.addEventListener('open', () => setConnected(true))
-    ws.addEventListener('close', () => setConnected(false))
+    const connecter = (reprise) => {
+      const params = new URLSearchParams(sujets)
+      if (reprise && lastSeq !== null) params.set('last_seq', lastSeq)
+      const ws = new WebSocket(base + params)
+      wsRef.current = ws
+
+      ws.addEventListener('open', () => {
+        setConnected(true)
+        delai = 1000
+        if (reprise && lastSeq === null) toutRecharger()
+      })
+      ws.addEventListener('close', () => {
+        setConnected(false)
+        if (fermeture) return
+        relance = setTimeout(() => connecter(true), delai)
+        delai = Math.min(delai * 2, 15000)
+      })
+      ws.addEventListener('message', onMessage)
+    }
 
-    ws.addEventListener('message', (ev) => {
+    const onMessage = (ev) => {
       try {
         const data = JSON.parse(ev.data)
+        if (data.seq !== undefined && (lastSeq === null || data.seq > lastSeq)) lastSeq = data.seq
+
+        if (data.type === 'resync') {
+          toutRecharger();
+          return;
+        }
+
+        // Alerte de rupture prévue : une seule par boîte, les 5 plus récentes
+        if (data.type === 'alerte_stock') {
+          setAlertesStock(prev => [data, ...prev.filter(a => a.idBoite !== data.idBoite)].slice(0, 5));
+          return;
+        }
+        // Changements d'état poussés par le serveur (plus de rechargement périodique)
+        if (data.type === 'train_position') {
+          setCurrentTrainPoste(data.position);
+          return;
+        }
+        if (data.type === 'statut_commande') {
+          const id = String(data.id_commande)
+          if (data.statut === 'Annulée' || data.statut === 'Produit manquant') {
+            setTasks(prev => prev.filter(t => String(t.id) !== id));
+          } else {
+            // Récupération partielle : la tâche ne garde que les boîtes emportées
+            setTasks(prev => prev.map(t => String(t.id) === id ? { ...t, status: data.statut, quantite: data.quantite || t.quantite } : t));
+          }
+          return;
+        }
+        if (data.type === 'statuts_commandes') {
+          const nouveaux = Object.fromEntries(data.commandes.map(c => [String(c.id_commande), c]));
+          setTasks(prev => prev.map(t => {
+            const c = nouveaux[String(t.id)];
+            return c ? { ...t, status: c.statut, quantite: c.quantite || t.quantite } : t;
+          }));
+          return;
+        }
+        if (data.type === 'nouvelle_commande') {
+          setTasks(prev => prev.some(t => String(t.id) === String(data.id)) ? prev : [versTache(data), ...prev]);
+          return;
+        }
+        if (data.type === 'commandes_videes') {
+          fetchInitialTasks();
+          return;
+        }
+        if (data.type === 'cycle') {
+          setCycleActive(data.actif);
+          return;
+        }
+        if (data.type) return; // Autres messages typés (accusé d'abonnement...)
+
         const device = String(data.poste)
         
         setTasks((prev) => {
-            if (prev.some(t => t.id === data.id_commande)) {
-                return prev;
+            // Scan regroupé : même commande, une boîte de plus
+            if (prev.some(t => String(t.id) === String(data.id_commande))) {
+                return prev.map(t => String(t.id) === String(data.id_commande)
+                  ? { ...t, quantite: data.quantite || t.quantite, stock: data.stock }
+                  : t);
             }
 
             if (posteNamesRef.current[device]) {
@@ -230,17 +317,32 @@ export default function Base({mode, onApp}) {
                 status: 'A récupérer',
                 ts: new Date().toLocaleString(),
                 stock: data.stock,
+                quantite: data.quantite || 1,
               }
               return [newTask, ...prev].slice(0, 100);
             }
             return prev;
         })
+
+        // Accusé d'affichage pour le traçage scan -> écran (après le prochain rendu)
+        if (data.trace_id) {
+          requestAnimationFrame(() => {
+            fetch(`${apiUrl}/api/traces/${data.trace_id}/affichage`, { method: 'POST' })
+              .catch(() => {});
+          });
+        }
       } catch (err) {
         console.error("Erreur WebSocket :", err)
       }
-    })
+    }
+
+    connecter(false)
 
-    return () => ws.close()
+    return () => {
+      fermeture = true
+      clearTimeout(relance)
+      if (wsRef.current) wsRef.current.close()
+    }
   }, [mode])
 
   // --- CALCULS & MÉMOS --- De la prochaine destination du train ou du train
@@ -351,36 +453,33 @@ const handleToggleCycle = async () => {
   // Ferme la popup
   const closePopup = () => setIsPopupOpen(false)
   
-  // Change le statut d'une commande pour le front et envoie une requête de changement de statut pour la base de données
-  const handleTaskAction = async (taskId) => {
-    const currentTask = tasks.find(t => t.id === taskId);
-    if (!currentTask) return;
-
-    let nextStatusFront = "";
-
-    // Front
-    if (currentTask.status === 'A récupérer') {
-      nextStatusFront = "A déposer";
-    } else if (currentTask.status === 'A déposer') {
-      nextStatusFront = "Commande finie";
-    } else {
-      return;
-    }
+  // Fait avancer d'un cran les commandes validées à un arrêt du train : un seul appel pour tout le lot
+  const handleTaskAction = async (taskIds) => {
+    const ids = taskIds.filter(id => tasks.some(t => t.id === id)).map(Number);
+    if (ids.length === 0) return;
 
     // Requête à la base de données
     try {
-      await fetch(`${apiUrl}/api/commande/${taskId}/statut`, {
+      const res = await fetch(`${apiUrl}/api/commandes/statut`, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ nouveau_statut: "ignored" })
+        body: JSON.stringify({ ids, mode })
       });
+      if (!res.ok) return;
+      const resultat = await res.json();
 
-      setTasks(currentTasks => currentTasks.map(task => 
-        task.id === taskId ? { ...task, status: nextStatusFront } : task
+      const nouveaux = Object.fromEntries(resultat.commandes.map(c => [String(c.id_commande), c.nouveau_statut]));
+      setTasks(currentTasks => currentTasks.map(task =>
+        nouveaux[String(task.id)] ? { ...task, status: nouveaux[String(task.id)] } : task
       ));
 
+      // Boîte vide : ces commandes restent à récupérer
+      const epuises = resultat.rejets.filter(r => r.status === 'stock_epuise');
+      if (epuises.length > 0) {
+        alert([...new Set(epuises.map(r => r.message))].join('\n'));
+      }
     } catch (err) {
-      console.error("Erreur lors de la mise à jour du statut:", err);
+      console.error("Erreur lors de la mise à jour des statuts:", err);
     }
   }
 
@@ -568,6 +667,16 @@ return (
               </Box>
             </Box>
             
+            {alertesStock.length > 0 && (
+              <Box sx={{ mb: 2, p: 1.5, borderRadius: '8px', bgcolor: '#FFEBE6', border: '1px solid #FF8F73' }}>
+                {alertesStock.map(a => (
+                  <Typography key={a.idBoite} variant="body2" sx={{ color: '#BF2600', fontWeight: 600 }}>
+                    Rupture prévue : {a.nom_piece} ({a.code_barre}) dans {a.minutes_avant_rupture} min, {a.stock_disponible} disponible(s)
+                  </Typography>
+                ))}
+              </Box>
+            )}
+
             {/* GRILLE DU PLAN ÉPURÉE */}
             <Box sx={{
                 flexGrow: 1,
@@ -833,7 +942,7 @@ return (
                         boxShadow: '0 1px 2px rgba(9, 30, 66, 0.25)', display: 'flex', justifyContent: 'space-between', alignItems: 'center'
                       }}>
                         <Box>
-                          <Typography sx={{ fontSize: '0.9rem', fontWeight: 500, color: '#172B4D' }}>{task.item}</Typography>
+                          <Typography sx={{ fontSize: '0.9rem', fontWeight: 500, color: '#172B4D' }}>{task.item}{task.quantite > 1 ? ` ×${task.quantite}` : ''}</Typography>
                           <Typography sx={{ fontSize: '0.75rem', color: '#5E6C84' }}>→ {posteNames[task.posteId]}</Typography>
                         </Box>
                         <IconButton onClick={() => handleDeleteTask(task.id)} size="small" sx={{ color: '#EB5757' }}>
@@ -873,7 +982,7 @@ return (
                         boxShadow: '0 1px 2px rgba(9, 30, 66, 0.25)', display: 'flex', justifyContent: 'space-between', alignItems: 'center'
                       }}>
                         <Box>
-                          <Typography sx={{ fontSize: '0.9rem', fontWeight: 500, color: '#172B4D' }}>{task.item}</Typography>
+                          <Typography sx={{ fontSize: '0.9rem', fontWeight: 500, color: '#172B4D' }}>{task.item}{task.quantite > 1 ? ` ×${task.quantite}` : ''}</Typography>
                           <Typography sx={{ fontSize: '0.75rem', color: '#5E6C84' }}>depuis {posteNames[task.magasinId]}</Typography>
                         </Box>
                         <IconButton onClick={() => handleDeleteTask(task.id)} size="small" sx={{ color: '#EB5757' }}>
@@ -31,8 +31,51 @@ export default function ConfigDepartPerso({ onRetour, onLancer }) {
 
     useEffect(() => {
         fetchData();
-        const interval = setInterval(fetchCommandes, 2000);
-        return () => clearInterval(interval);
+
+        // Les changements sont poussés par le serveur : plus de rechargement toutes les 2 s
+        const url = (location.protocol === 'https:' ? 'wss' : 'ws') + '://' + location.hostname + ':8000/ws/scans?mode=' + encodeURIComponent(mode);
+        let ws = null;
+        let fermeture = false;
+        let relance = null;
+
+        // Nouveaux statuts {id: statut} : commandes finies ou annulées retirées, les autres mises à jour
+        const appliquerStatuts = (statuts) => {
+            setCommandes(prev => prev
+                .filter(c => statuts[c.id] !== 'Commande finie' && statuts[c.id] !== 'Annulée')
+                .map(c => statuts[c.id] ? { ...c, statut: statuts[c.id] } : c));
+        };
+
+        const onMessage = (ev) => {
+            const data = JSON.parse(ev.data);
+            if (data.type === 'nouvelle_commande') {
+                setCommandes(prev => prev.some(c => c.id === data.id) ? prev : [...prev, data]);
+            } else if (data.type === 'statut_commande') {
+                appliquerStatuts({ [data.id_commande]: data.statut });
+            } else if (data.type === 'statuts_commandes') {
+                // Arrêt du train : toutes les commandes avancées d'un coup
+                appliquerStatuts(Object.fromEntries(data.commandes.map(c => [c.id_commande, c.statut])));
+            } else if (data.type === 'cycle') {
+                setCycleActive(data.actif);
+            } else if (data.type === 'commandes_videes' || data.type === 'resync' || !data.type) {
+                fetchCommandes(); // Vidage ou nouveau scan : on relit la liste
+            }
+        };
+
+        const connecter = () => {
+            ws = new WebSocket(url);
+            ws.addEventListener('message', onMessage);
+            ws.addEventListener('close', () => {
+                if (fermeture) return;
+                relance = setTimeout(() => { fetchCommandes(); connecter(); }, 2000);
+            });
+        };
+        connecter();
+
+        return () => {
+            fermeture = true;
+            clearTimeout(relance);
+            if (ws) ws.close();
+        };
     }, []);
 
     const fetchData = async () => {
@@ -40,8 +40,13 @@ export default function LoginPopup({ open, onClose, onLoginSuccess }) {
       });
 
       if (response.ok) {
+        // Jeton signé : l'espace admin ne redemande pas les identifiants tant qu'il est valide
+        const data = await response.json();
+        sessionStorage.setItem('jeton_admin', data.token);
         if (onLoginSuccess) onLoginSuccess();
         onClose(); 
+      } else if (response.status === 429) {
+        setError("Trop de tentatives, réessayez dans un instant");
       } else {
         setError("Identifiants incorrects");
       }
@@ -39,9 +39,10 @@ export default function PopupLivraison({ open, onClose, posteId, posteName, task
       setLoading(true);
       setClickedTasks(new Set());
       
-      fetch(`/etagere_${posteId}.json`)
+      // Disposition servie par l'API (cache mémoire + ETag côté serveur)
+      fetch(`${apiUrl}/api/stands/${posteId}/layout`)
         .then(res => {
-          if (!res.ok) throw new Error(`Fichier etagere_${posteId}.json introuvable`);
+          if (!res.ok) throw new Error(`Étagère du stand ${posteId} introuvable`);
           return res.json();
         })
         .then(data => {
@@ -77,7 +78,7 @@ export default function PopupLivraison({ open, onClose, posteId, posteName, task
   };
 
   const handleValidate = () => {
-    clickedTasks.forEach(taskId => onDeliver(taskId));
+    onDeliver(Array.from(clickedTasks));
     onClose();
   };
 